@@ -115,6 +115,16 @@ SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
 }
 
+# Cache de sesiones validadas (access token -> sigue abierta). La del proceso
+# acota con su TTL cuánto tarda un logout en llegar a los demás workers; la
+# de Django (CACHES) se comparte y se invalida en login/logout.
+TOKENS_CACHE_MAX_ENTRADAS = 10000
+TOKENS_CACHE_TTL_SEGUNDOS = 60
+TOKENS_CACHE_COMPARTIDA_TTL_SEGUNDOS = 300
+# Sesiones (dispositivos) simultáneas por usuario; al superarlo cada login
+# cierra la más vieja
+TOKENS_MAX_SESIONES = 1
+
 # Custom User Model
 AUTH_USER_MODEL = "users.User"
 
@@ -135,6 +145,78 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Trips: despacho de conductores
+# Tamaño (en grados) de las celdas del índice espacial de conductores
+TRIPS_TAMANO_CELDA_GRADOS = 0.01
+# Cada cuántos segundos el índice de cada proceso lee de DriverLocation las
+# posiciones que escribieron otros workers o el buffer (None: solo al cargar),
+# y cada cuántos lo recarga entero para quitar las filas borradas
+TRIPS_INDICE_SINCRONIZACION_SEGUNDOS = 1
+TRIPS_INDICE_RECARGA_SEGUNDOS = 60
+# Celdas (en grados, ~5.5 km) de las zonas de trips.grupos, con las que
+# trips.presencia cuenta conductores por región
+TRIPS_TAMANO_CELDA_GRUPOS_GRADOS = 0.05
+# Almacén de posiciones en vivo: AlmacenUbicacionesDB, AlmacenUbicacionesSQL,
+# AlmacenUbicacionesRedis o AlmacenUbicacionesPostGIS (requiere PostGIS)
+TRIPS_ALMACEN_UBICACIONES = "trips.ubicaciones.AlmacenUbicacionesDB"
+TRIPS_REDIS_URL = "redis://{}:{}/0".format(
+    os.environ.get("REDIS_HOST", "localhost"), os.environ.get("REDIS_PORT", 6379)
+)
+# Radio máximo (km) de las búsquedas GEOSEARCH en Redis
+TRIPS_RADIO_BUSQUEDA_KM = 50
+# Escritura diferida de DriverLocation (None para escribir cada ping)
+TRIPS_BUFFER_UBICACIONES = {"intervalo_ms": 500, "max_entradas": 500}
+# Puntos aceptados por mensaje update_location_batch (se quedan los más nuevos)
+TRIPS_MAX_PUNTOS_LOTE = 500
+# Antigüedad máxima del `ts` de esos puntos; los más viejos se descartan
+TRIPS_ANTIGUEDAD_MAXIMA_PUNTOS_SEGUNDOS = 86400
+# "inmediato": cada viaje toma al conductor más cercano al crearse.
+# "lote": los viajes de una ventana se asignan juntos (asignación óptima);
+# solo con TRIPS_MODO_OFERTA "individual", las ofertas abiertas van de a una.
+TRIPS_MODO_DESPACHO = "inmediato"
+TRIPS_VENTANA_DESPACHO_MS = 1000
+TRIPS_CANDIDATOS_POR_VIAJE = 5
+# Reasignación tras rechazos o timeouts: ofertas por viaje antes de cancelarlo
+# con "no_drivers_available", y radio de búsqueda (km) que se multiplica por
+# TRIPS_FACTOR_RADIO en cada intento hasta TRIPS_RADIO_MAXIMO_KM
+TRIPS_MAX_INTENTOS_ASIGNACION = 5
+TRIPS_RADIO_INICIAL_KM = 3
+TRIPS_FACTOR_RADIO = 2
+TRIPS_RADIO_MAXIMO_KM = 20
+# "individual" ofrece el viaje a un conductor por vez; "abierta" a los
+# TRIPS_OFERTA_K más cercanos a la vez y se lo lleva el primero que acepta.
+# TRIPS_OFERTA_K_POR_REGION ajusta k por región de trips.presencia ("f:c")
+TRIPS_MODO_OFERTA = "individual"
+TRIPS_OFERTA_K = 3
+TRIPS_OFERTA_K_POR_REGION = {}
+# Registro de conductores conectados y libres: DisponibilidadRedis (compartido
+# entre workers; su `ocupar` es la reserva que evita dar un conductor a dos
+# viajes) o DisponibilidadMemoria (solo con un único worker)
+TRIPS_DISPONIBILIDAD = "trips.disponibilidad.DisponibilidadRedis"
+# Último latido de cada conductor: PresenciaRedis (compartida entre workers y
+# la que ve el comando `presencia` desde otro proceso) o PresenciaMemoria (solo
+# con un único worker). El despacho ignora a quien no se vio en
+# TRIPS_PRESENCIA_FRESCURA_SEGUNDOS (None lo desactiva); los clientes mandan
+# "heartbeat" más seguido que eso.
+TRIPS_PRESENCIA = "trips.presencia.PresenciaRedis"
+TRIPS_PRESENCIA_FRESCURA_SEGUNDOS = 60
+# Segundos que tiene un conductor para responder una oferta de viaje
+TRIPS_TIMEOUT_OFERTA_SEGUNDOS = 30
+# Dónde persisten los timeouts de ofertas: AlmacenTemporizadoresRedis
+# (sobrevive a reinicios) o AlmacenTemporizadoresMemoria
+TRIPS_ALMACEN_TEMPORIZADORES = "trips.temporizadores.AlmacenTemporizadoresRedis"
+# Hilos del pool para el acceso a la base desde TripConsumer (acota también
+# las conexiones abiertas por proceso). 0 usa el hilo único de asgiref.
+TRIPS_HILOS_DB = 8
+# Métricas por acción de TripConsumer servidas en /metrics (texto Prometheus),
+# con gauges del backlog de timeouts y del buffer de ubicaciones de cada
+# worker: MetricasMemoria (por proceso) o MetricasRedis (sumadas entre
+# workers). Con TRIPS_METRICAS_TOKEN el endpoint exige
+# "Authorization: Bearer <token>"
+TRIPS_METRICAS = "trips.metricas.MetricasRedis"
+TRIPS_METRICAS_LIMITES_SEGUNDOS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+TRIPS_METRICAS_TOKEN = os.environ.get("TRIPS_METRICAS_TOKEN")
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -143,6 +225,10 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASSWORD', 'postgres'),
         'HOST': os.environ.get('DB_HOST', 'localhost'),
         'PORT': os.environ.get('DB_PORT', '5432'),
+        # Conexiones persistentes: cada hilo de trips.concurrencia reutiliza
+        # la suya en lugar de abrir una por llamada
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
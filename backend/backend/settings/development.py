@@ -13,9 +13,21 @@ DATABASES = {
         "PASSWORD": os.environ.get("DB_PASSWORD", "postgres"),
         "HOST": os.environ.get("DB_HOST", "localhost"),
         "PORT": os.environ.get("DB_PORT", "5432"),
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Timeouts de ofertas en memoria: con un solo proceso no hace falta Redis y
+# no quedan temporizadores de corridas anteriores apuntando a otra base
+TRIPS_ALMACEN_TEMPORIZADORES = "trips.temporizadores.AlmacenTemporizadoresMemoria"
+# Por lo mismo, conductores libres y latidos en memoria (runserver es un solo
+# proceso)
+TRIPS_DISPONIBILIDAD = "trips.disponibilidad.DisponibilidadMemoria"
+TRIPS_PRESENCIA = "trips.presencia.PresenciaMemoria"
+# Y las métricas de /metrics, que no tienen otros workers con quienes sumarse
+TRIPS_METRICAS = "trips.metricas.MetricasMemoria"
+
 # CORS settings for development
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOWED_ORIGINS = [
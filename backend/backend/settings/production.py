@@ -22,6 +22,8 @@ DATABASES = {
         "PASSWORD": get_env_value("DB_PASSWORD"),
         "HOST": get_env_value("DB_HOST"),
         "PORT": get_env_value("DB_PORT"),
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
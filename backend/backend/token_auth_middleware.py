@@ -0,0 +1,61 @@
+import logging
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from users.cache_tokens import FALTA, cache_sesiones, sesion_activa, usuario_cacheado
+
+logger = logging.getLogger(__name__)
+
+
+def obtener_token(scope):
+    """Access token del query string (?token=...) o del header Authorization."""
+    token = parse_qs(scope.get("query_string", b"").decode()).get("token")
+    if token:
+        return token[0]
+
+    for nombre, valor in scope.get("headers", []):
+        if nombre == b"authorization":
+            partes = valor.decode().split()
+            if len(partes) == 2 and partes[0] in api_settings.AUTH_HEADER_TYPES:
+                return partes[1]
+    return None
+
+
+async def autenticar(token):
+    """
+    Validar el JWT localmente (firma y vencimiento) y luego la sesión.
+
+    Igual que `CustomJWTAuthentication`, el token debe seguir registrado en
+    users.Token. Esa comprobación se cachea (positiva o negativa) junto con
+    los campos del usuario para que una tormenta de reconexiones no llegue a
+    Postgres; con la entrada en la cache del proceso ni siquiera se cambia
+    de hilo.
+    """
+    try:
+        validado = AccessToken(token)
+    except TokenError as e:
+        logger.debug(f"Token inválido: {e}")
+        return None
+
+    jti = validado[api_settings.JTI_CLAIM]
+    datos = cache_sesiones.obtener(jti)
+    if datos is not FALTA:
+        return usuario_cacheado(datos)
+    return await database_sync_to_async(sesion_activa)(
+        jti, validado[api_settings.USER_ID_CLAIM], validado["exp"]
+    )
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """Pone en scope["user"] el usuario del JWT, o AnonymousUser."""
+
+    async def __call__(self, scope, receive, send):
+        token = obtener_token(scope)
+        user = await autenticar(token) if token else None
+        scope = dict(scope, user=user or AnonymousUser())
+        logger.debug(f"Conexión WebSocket autenticada como: {scope['user']}")
+        return await super().__call__(scope, receive, send)
@@ -0,0 +1,53 @@
+import pytest
+from django.db import connections
+from trips.disponibilidad import obtener_disponibilidad
+from trips.models import DriverLocation, Trip
+from trips.presencia import obtener_presencia
+from users.models import Conductor, Pasajero
+
+
+@pytest.fixture(scope="session")
+def django_db_modify_db_settings(django_db_modify_db_settings_parallel_suffix):
+    """
+    Sin conexiones persistentes en los tests: los hilos de trips.concurrencia
+    y de asgiref no deben dejar abierta la base de test al terminar.
+    """
+    connections.settings["default"]["CONN_MAX_AGE"] = 0
+
+
+@pytest.fixture
+def viaje():
+    """Viaje pendiente de un pasajero, con origen y destino en Bogotá."""
+    pasajero = Pasajero.objects.create_user(
+        username="pasajero_test",
+        email="pasajero@test.com",
+        password="testpassword",
+        rol="Pasajero",
+    )
+    return Trip.objects.create(
+        cliente=pasajero,
+        origen={"lat": 4.6097, "lng": -74.0817},
+        destino={"lat": 4.6297, "lng": -74.0647},
+    )
+
+
+@pytest.fixture
+def crear_conductor():
+    """
+    Fábrica de conductores. Con `lat` queda además ubicado, libre y con un
+    latido, listo para recibir ofertas.
+    """
+
+    def crear(email, lat=None, lon=-74.0817):
+        conductor = Conductor.objects.create_user(
+            username=email, email=email, password="testpassword", rol="Conductor"
+        )
+        if lat is not None:
+            DriverLocation.objects.create(
+                conductor=conductor, latitud=lat, longitud=lon
+            )
+            obtener_disponibilidad().conectar(conductor.id)
+            obtener_presencia().latido(conductor.id)
+        return conductor
+
+    return crear
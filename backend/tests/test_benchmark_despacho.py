@@ -0,0 +1,32 @@
+import json
+from io import StringIO
+import pytest
+from django.core.management import call_command
+from trips.models import DriverLocation
+
+
+@pytest.mark.django_db
+def test_benchmark_despacho_guarda_json(tmp_path):
+    salida = tmp_path / "despacho.json"
+
+    call_command(
+        "benchmark_despacho",
+        tamanos="20,50",
+        almacenes="bucle,indice,sql",
+        llamadas=3,
+        salida=str(salida),
+        stdout=StringIO(),
+    )
+
+    datos = json.loads(salida.read_text())
+    medidos = {(r["almacen"], r["conductores"]) for r in datos["resultados"]}
+    assert medidos == {
+        (almacen, tamano)
+        for almacen in ("bucle", "indice", "sql")
+        for tamano in (20, 50)
+    }
+    consultas = {r["almacen"]: r["consultas_por_llamada"] for r in datos["resultados"]}
+    # Una consulta para validar candidatos; el bucle además lee toda la tabla
+    assert consultas == {"bucle": 2, "indice": 1, "sql": 1}
+    # Los conductores sembrados se descartan
+    assert not DriverLocation.objects.exists()
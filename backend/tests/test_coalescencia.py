@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+from trips.coalescencia import BuzonUltimoValor
+
+
+@pytest.mark.asyncio
+async def test_cliente_lento_recibe_solo_la_ultima_posicion():
+    entregados = []
+    liberar = asyncio.Event()
+
+    async def entregar(evento):
+        await liberar.wait()  # cliente que no consume
+        entregados.append(evento)
+
+    buzon = BuzonUltimoValor(entregar)
+    buzon.poner("a", {"type": "driver_location", "lat": 0})
+    await asyncio.sleep(0)  # el primero ya está en vuelo
+    for lat in range(1, 100):
+        buzon.poner("a", {"type": "driver_location", "lat": lat})
+    buzon.poner("b", {"type": "driver_location", "lat": -1})
+
+    # Memoria acotada: una entrada pendiente por clave
+    assert len(buzon) == 2
+    assert buzon.reemplazados == 98
+
+    liberar.set()
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert [e["lat"] for e in entregados] == [0, 99, -1]
+    await buzon.cerrar()
+
+
+@pytest.mark.asyncio
+async def test_cerrar_descarta_lo_pendiente():
+    entregados = []
+
+    async def entregar(evento):
+        await asyncio.sleep(10)
+        entregados.append(evento)
+
+    buzon = BuzonUltimoValor(entregar)
+    buzon.poner("a", {"type": "driver_location"})
+    buzon.poner("b", {"type": "driver_location"})
+    await asyncio.sleep(0)
+    await buzon.cerrar()
+
+    assert len(buzon) == 0
+    assert entregados == []
@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+import pytest
+from django.db import connection, connections
+from trips.concurrencia import crear_executor, en_hilo
+
+
+def _dormir(segundos):
+    time.sleep(segundos)
+    return threading.current_thread().name
+
+
+@pytest.mark.asyncio
+class TestEnHilo:
+    async def test_llamadas_en_paralelo_en_el_pool(self):
+        executor = crear_executor(4)
+        dormir = en_hilo(_dormir, executor=executor)
+
+        inicio = time.perf_counter()
+        hilos = await asyncio.gather(*(dormir(0.2) for _ in range(4)))
+        duracion = time.perf_counter() - inicio
+        executor.shutdown()
+
+        # Con el hilo único de asgiref tardaría 0.8 s
+        assert duracion < 0.6
+        assert all(nombre.startswith("trips-db") for nombre in hilos)
+        assert len(set(hilos)) == 4
+
+    async def test_el_pool_acota_la_concurrencia(self):
+        executor = crear_executor(2)
+        dormir = en_hilo(_dormir, executor=executor)
+
+        hilos = await asyncio.gather(*(dormir(0.05) for _ in range(6)))
+        executor.shutdown()
+
+        assert len(set(hilos)) == 2
+
+    @pytest.mark.django_db(transaction=True)
+    async def test_cada_hilo_reutiliza_su_conexion(self, monkeypatch):
+        monkeypatch.setitem(connections.settings["default"], "CONN_MAX_AGE", 60)
+        executor = crear_executor(2)
+
+        def pid_conexion():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_backend_pid()")
+                return cursor.fetchone()[0]
+
+        barrera = threading.Barrier(2)
+
+        def cerrar():
+            # Una vez en cada hilo del pool, para no dejar conexiones abiertas
+            barrera.wait(timeout=5)
+            connections.close_all()
+
+        try:
+            pids = await asyncio.gather(
+                *(en_hilo(pid_conexion, executor=executor)() for _ in range(20))
+            )
+        finally:
+            cerrar_en_hilo = en_hilo(cerrar, executor=executor)
+            await asyncio.gather(cerrar_en_hilo(), cerrar_en_hilo())
+            executor.shutdown()
+
+        # 20 llamadas, una conexión por hilo
+        assert len(set(pids)) <= 2
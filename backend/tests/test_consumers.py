@@ -10,9 +10,15 @@ from django.contrib.auth.models import AnonymousUser
 from backend.asgi import application
 from trips.models import Trip, DriverLocation
 from users.models import Conductor, Pasajero
+from channels.layers import get_channel_layer
+from trips import tramas
 from trips.consumers import TripConsumer
+from trips.metricas import obtener_metricas
+from trips.presencia import obtener_presencia
+from trips.buffer_ubicaciones import obtener_buffer
 import json
 import asyncio
+import msgpack
 
 # Configurar logging
 logging.basicConfig(level=logging.DEBUG)
@@ -180,6 +186,438 @@ class TestWebSocketConnections:
                 await database_sync_to_async(conductor.delete)()
             logger.debug("Limpieza completada")
 
+    async def test_ubicacion_invalida(self):
+        """Una posición mal formada se rechaza sin cerrar el socket."""
+        conductor = await database_sync_to_async(Conductor.objects.create_user)(
+            username="conductor_invalida",
+            email="conductor_invalida@test.com",
+            password="testpassword",
+            rol="Conductor",
+        )
+        application = URLRouter(
+            [
+                re_path(r"^ws/trip/$", TripConsumer.as_asgi()),
+            ]
+        )
+        communicator = WebsocketCommunicator(application=application, path="/ws/trip/")
+        communicator.scope["user"] = conductor
+        try:
+            connected, _ = await communicator.connect(timeout=10)
+            assert connected
+
+            for lat, lon in (("x", -74.08), (None, -74.08), (95, -74.08)):
+                await communicator.send_json_to(
+                    {"action": "update_location", "lat": lat, "lon": lon}
+                )
+                respuesta = await communicator.receive_json_from(timeout=2)
+                assert respuesta == {"error": "Ubicación inválida"}
+
+            # Texto numérico se sigue aceptando, como antes
+            await communicator.send_json_to(
+                {"action": "update_location", "lat": "4.6097", "lon": "-74.0817"}
+            )
+            respuesta = await communicator.receive_json_from(timeout=2)
+            assert respuesta == {"status": "location_updated"}
+        finally:
+            await communicator.disconnect()
+            if obtener_buffer() is not None:
+                await database_sync_to_async(obtener_buffer().volcar)()
+            await database_sync_to_async(conductor.delete)()
+
+    async def test_subprotocolo_msgpack(self):
+        """Un cliente que negocia msgpack habla en tramas binarias; sin él, JSON."""
+        conductor = await database_sync_to_async(Conductor.objects.create_user)(
+            username="conductor_msgpack",
+            email="conductor_msgpack@test.com",
+            password="testpassword",
+            rol="Conductor",
+        )
+        application = URLRouter(
+            [
+                re_path(r"^ws/trip/$", TripConsumer.as_asgi()),
+            ]
+        )
+        ubicacion_data = {"action": "update_location", "lat": 4.60971, "lon": -74.08175}
+
+        communicator = WebsocketCommunicator(
+            application=application,
+            path="/ws/trip/",
+            subprotocols=["msgpack"],
+        )
+        communicator.scope["user"] = conductor
+        try:
+            connected, subprotocol = await communicator.connect(timeout=10)
+            assert connected
+            assert subprotocol == "msgpack"
+
+            await communicator.send_to(bytes_data=msgpack.packb(ubicacion_data))
+            response = await communicator.receive_from(timeout=2)
+            assert isinstance(response, bytes)
+            assert msgpack.unpackb(response) == {"status": "location_updated"}
+        finally:
+            await communicator.disconnect()
+
+        # Cliente viejo: sin subprotocolo sigue recibiendo JSON
+        communicator = WebsocketCommunicator(application=application, path="/ws/trip/")
+        communicator.scope["user"] = conductor
+        try:
+            connected, subprotocol = await communicator.connect(timeout=10)
+            assert connected
+            assert subprotocol is None
+
+            await communicator.send_json_to(ubicacion_data)
+            response = await communicator.receive_json_from(timeout=2)
+            assert response == {"status": "location_updated"}
+        finally:
+            await communicator.disconnect()
+            # Escribir ya los pings diferidos, antes de borrar al conductor
+            if obtener_buffer() is not None:
+                await database_sync_to_async(obtener_buffer().volcar)()
+            await database_sync_to_async(conductor.delete)()
+
+    async def test_posicion_al_pasajero(self):
+        """El pasajero sigue al conductor del viaje aceptado, hasta que termina."""
+        conductor = await database_sync_to_async(Conductor.objects.create_user)(
+            username="conductor_posicion",
+            email="conductor_posicion@test.com",
+            password="testpassword",
+            rol="Conductor",
+        )
+        pasajero = await database_sync_to_async(Pasajero.objects.create_user)(
+            username="pasajero_posicion",
+            email="pasajero_posicion@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        trip = await Trip.objects.acreate(
+            cliente=pasajero,
+            origen={"lat": 4.6097, "lng": -74.0817},
+            destino={"lat": 4.6297, "lng": -74.0647},
+            estado="asignado",
+            conductor_asignado=conductor,
+        )
+        application = URLRouter(
+            [
+                re_path(r"^ws/trip/$", TripConsumer.as_asgi()),
+            ]
+        )
+        conductor_ws = WebsocketCommunicator(application=application, path="/ws/trip/")
+        conductor_ws.scope["user"] = conductor
+        pasajero_ws = WebsocketCommunicator(application=application, path="/ws/trip/")
+        pasajero_ws.scope["user"] = pasajero
+        try:
+            assert (await conductor_ws.connect(timeout=10))[0]
+            assert (await pasajero_ws.connect(timeout=10))[0]
+
+            await conductor_ws.send_json_to(
+                {"action": "accept_trip", "trip_id": trip.id}
+            )
+            assert (await conductor_ws.receive_json_from(timeout=2))[
+                "status"
+            ] == "trip_accepted"
+
+            for i in range(5):
+                await conductor_ws.send_json_to(
+                    {"action": "update_location", "lat": 4.61 + i / 1000, "lon": -74.08}
+                )
+                await conductor_ws.receive_json_from(timeout=2)
+
+            # Llegan en orden y la última posición nunca se pierde
+            posiciones = []
+            while not posiciones or posiciones[-1]["lat"] != 4.614:
+                posiciones.append(await pasajero_ws.receive_json_from(timeout=2))
+            assert all(p["type"] == "driver_location" for p in posiciones)
+            assert all(p["trip_id"] == str(trip.id) for p in posiciones)
+            latitudes = [p["lat"] for p in posiciones]
+            assert latitudes == sorted(latitudes)
+
+            # Terminado el viaje, el conductor deja de publicar su posición
+            trip.estado = "completado"
+            await database_sync_to_async(trip.save)()
+            assert await conductor_ws.receive_json_from(timeout=2) == {
+                "type": "trip_finished",
+                "trip_id": str(trip.id),
+            }
+            await conductor_ws.send_json_to(
+                {"action": "update_location", "lat": 4.7, "lon": -74.08}
+            )
+            await conductor_ws.receive_json_from(timeout=2)
+            assert await pasajero_ws.receive_nothing(timeout=0.5)
+        finally:
+            await conductor_ws.disconnect()
+            await pasajero_ws.disconnect()
+            if obtener_buffer() is not None:
+                await database_sync_to_async(obtener_buffer().volcar)()
+            await database_sync_to_async(conductor.delete)()
+            await database_sync_to_async(pasajero.delete)()
+
+    async def test_completar_y_cancelar_viaje(self):
+        """El conductor termina su viaje y el pasajero cancela el suyo."""
+        conductor = await database_sync_to_async(Conductor.objects.create_user)(
+            username="conductor_fin",
+            email="conductor_fin@test.com",
+            password="testpassword",
+            rol="Conductor",
+        )
+        pasajero = await database_sync_to_async(Pasajero.objects.create_user)(
+            username="pasajero_fin",
+            email="pasajero_fin@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        en_curso = await Trip.objects.acreate(
+            cliente=pasajero,
+            origen={"lat": 4.6097, "lng": -74.0817},
+            destino={"lat": 4.6297, "lng": -74.0647},
+            estado="aceptado",
+            conductor_asignado=conductor,
+        )
+        pendiente = await Trip.objects.acreate(
+            cliente=pasajero,
+            origen={"lat": 4.6097, "lng": -74.0817},
+            destino={"lat": 4.6297, "lng": -74.0647},
+        )
+        application = URLRouter(
+            [
+                re_path(r"^ws/trip/$", TripConsumer.as_asgi()),
+            ]
+        )
+        conductor_ws = WebsocketCommunicator(application=application, path="/ws/trip/")
+        conductor_ws.scope["user"] = conductor
+        pasajero_ws = WebsocketCommunicator(application=application, path="/ws/trip/")
+        pasajero_ws.scope["user"] = pasajero
+        try:
+            assert (await conductor_ws.connect(timeout=10))[0]
+            assert (await pasajero_ws.connect(timeout=10))[0]
+
+            await conductor_ws.send_json_to(
+                {"action": "complete_trip", "trip_id": en_curso.id}
+            )
+            assert await conductor_ws.receive_json_from(timeout=2) == {
+                "type": "trip_finished",
+                "trip_id": str(en_curso.id),
+            }
+            assert await pasajero_ws.receive_json_from(timeout=2) == {
+                "status": "trip_completed",
+                "trip_id": str(en_curso.id),
+            }
+
+            # Un viaje terminado ya no se completa ni se cancela
+            await conductor_ws.send_json_to(
+                {"action": "complete_trip", "trip_id": en_curso.id}
+            )
+            assert "error" in await conductor_ws.receive_json_from(timeout=2)
+            await pasajero_ws.send_json_to(
+                {"action": "cancel_trip", "trip_id": en_curso.id}
+            )
+            assert "error" in await pasajero_ws.receive_json_from(timeout=2)
+
+            await pasajero_ws.send_json_to(
+                {"action": "cancel_trip", "trip_id": pendiente.id}
+            )
+            assert await pasajero_ws.receive_json_from(timeout=2) == {
+                "status": "trip_cancelled",
+                "trip_id": str(pendiente.id),
+            }
+            estados = [
+                viaje.estado
+                async for viaje in Trip.objects.filter(cliente=pasajero).order_by("id")
+            ]
+            assert estados == ["completado", "cancelado"]
+        finally:
+            await conductor_ws.disconnect()
+            await pasajero_ws.disconnect()
+            await database_sync_to_async(conductor.delete)()
+            await database_sync_to_async(pasajero.delete)()
+
+    async def test_tramas_precodificadas(self):
+        """Cada consumer reenvía las tramas del evento en su formato."""
+        conductor = await database_sync_to_async(Conductor.objects.create_user)(
+            username="conductor_tramas",
+            email="conductor_tramas@test.com",
+            password="testpassword",
+            rol="Conductor",
+        )
+        application = URLRouter(
+            [
+                re_path(r"^ws/trip/$", TripConsumer.as_asgi()),
+            ]
+        )
+        cliente_json = WebsocketCommunicator(application=application, path="/ws/trip/")
+        cliente_json.scope["user"] = conductor
+        cliente_msgpack = WebsocketCommunicator(
+            application=application, path="/ws/trip/", subprotocols=["msgpack"]
+        )
+        cliente_msgpack.scope["user"] = conductor
+        trip = Trip(
+            id=7,
+            origen={"lat": 4.6097, "lng": -74.0817},
+            destino={"lat": 4.6297, "lng": -74.0647},
+        )
+        evento = tramas.evento_oferta(trip)
+        try:
+            assert (await cliente_json.connect(timeout=10))[0]
+            assert (await cliente_msgpack.connect(timeout=10))[0]
+
+            await get_channel_layer().group_send(f"drivers_{conductor.id}", evento)
+
+            codificado = evento["tramas"]
+            assert await cliente_json.receive_from(timeout=2) == codificado["json"]
+            assert await cliente_msgpack.receive_from(timeout=2) == (
+                codificado["msgpack"]
+            )
+            assert msgpack.unpackb(evento["tramas"]["msgpack"]) == {
+                "type": "trip_assigned",
+                "trip_id": "7",
+                "origen": trip.origen,
+                "destino": trip.destino,
+            }
+        finally:
+            await cliente_json.disconnect()
+            await cliente_msgpack.disconnect()
+            await database_sync_to_async(conductor.delete)()
+
+    async def test_heartbeat(self):
+        """El latido del conductor se responde y lo mantiene como visto."""
+        conductor = await database_sync_to_async(Conductor.objects.create_user)(
+            username="conductor_latido",
+            email="conductor_latido@test.com",
+            password="testpassword",
+            rol="Conductor",
+        )
+        application = URLRouter(
+            [
+                re_path(r"^ws/trip/$", TripConsumer.as_asgi()),
+            ]
+        )
+        communicator = WebsocketCommunicator(application=application, path="/ws/trip/")
+        communicator.scope["user"] = conductor
+        try:
+            assert (await communicator.connect(timeout=10))[0]
+            await communicator.send_json_to({"action": "heartbeat"})
+            assert await communicator.receive_json_from(timeout=2) == {
+                "type": "heartbeat"
+            }
+            assert conductor.id in obtener_presencia().frescos()
+        finally:
+            await communicator.disconnect()
+            await database_sync_to_async(conductor.delete)()
+
+    async def test_metricas_por_accion(self):
+        """Cada acción y cada conexión quedan contadas en trips.metricas."""
+        conductor = await database_sync_to_async(Conductor.objects.create_user)(
+            username="conductor_metricas",
+            email="conductor_metricas@test.com",
+            password="testpassword",
+            rol="Conductor",
+        )
+        application = URLRouter(
+            [
+                re_path(r"^ws/trip/$", TripConsumer.as_asgi()),
+            ]
+        )
+        communicator = WebsocketCommunicator(application=application, path="/ws/trip/")
+        communicator.scope["user"] = conductor
+        metricas = obtener_metricas()
+        latidos = ("trips_acciones_total", (("accion", "heartbeat"),))
+        conexiones = ("trips_conexiones_abiertas", (("rol", "Conductor"),))
+        antes = await database_sync_to_async(metricas.valores)()
+        try:
+            assert (await communicator.connect(timeout=10))[0]
+            # Acciones que no son texto se cuentan sin cerrar el socket
+            for accion in ([], {}):
+                await communicator.send_json_to({"action": accion})
+                assert await communicator.receive_nothing(timeout=0.2)
+            await communicator.send_json_to({"action": "heartbeat"})
+            await communicator.receive_json_from(timeout=2)
+
+            despues = await database_sync_to_async(metricas.valores)()
+            assert despues[latidos] == antes[latidos] + 1
+            assert despues[conexiones] == antes[conexiones] + 1
+        finally:
+            await communicator.disconnect()
+            await database_sync_to_async(conductor.delete)()
+
+        final = await database_sync_to_async(metricas.valores)()
+        assert final[conexiones] == antes[conexiones]
+
+    async def test_oferta_abierta(self, settings):
+        """La oferta llega a los k más cercanos; al aceptar uno se retira al resto."""
+        settings.TRIPS_MODO_OFERTA = "abierta"
+        settings.TRIPS_OFERTA_K = 2
+        conductores = []
+        for i in range(2):
+            conductor = await database_sync_to_async(Conductor.objects.create_user)(
+                username=f"conductor_abierta{i}",
+                email=f"conductor_abierta{i}@test.com",
+                password="testpassword",
+                rol="Conductor",
+            )
+            await DriverLocation.objects.acreate(
+                conductor=conductor, latitud=4.6097 + i / 1000, longitud=-74.0817
+            )
+            conductores.append(conductor)
+        pasajero = await database_sync_to_async(Pasajero.objects.create_user)(
+            username="pasajero_abierta",
+            email="pasajero_abierta@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        application = URLRouter(
+            [
+                re_path(r"^ws/trip/$", TripConsumer.as_asgi()),
+            ]
+        )
+        sockets = []
+        for usuario in [*conductores, pasajero]:
+            socket = WebsocketCommunicator(application=application, path="/ws/trip/")
+            socket.scope["user"] = usuario
+            sockets.append(socket)
+        uno_ws, dos_ws, pasajero_ws = sockets
+        try:
+            for socket in sockets:
+                assert (await socket.connect(timeout=10))[0]
+
+            await pasajero_ws.send_json_to(
+                {
+                    "action": "create_trip",
+                    "origen": {"lat": 4.6097, "lng": -74.0817},
+                    "destino": {"lat": 4.6297, "lng": -74.0647},
+                }
+            )
+            novedad = await pasajero_ws.receive_json_from(timeout=2)
+            assert novedad["status"] == "trip_offered"
+            assert novedad["drivers"] == 2
+            ofertas = [
+                await socket.receive_json_from(timeout=2) for socket in (uno_ws, dos_ws)
+            ]
+            assert [o["type"] for o in ofertas] == ["trip_assigned"] * 2
+            trip_id = ofertas[0]["trip_id"]
+
+            # Gana el primero que acepta; el otro ya no puede tomarlo
+            await dos_ws.send_json_to({"action": "accept_trip", "trip_id": trip_id})
+            assert (await dos_ws.receive_json_from(timeout=2))[
+                "status"
+            ] == "trip_accepted"
+            assert await uno_ws.receive_json_from(timeout=2) == {
+                "type": "trip_withdrawn",
+                "trip_id": trip_id,
+            }
+            novedad = await pasajero_ws.receive_json_from(timeout=2)
+            assert novedad["status"] == "trip_assigned"
+            assert novedad["driver_id"] == conductores[1].id
+
+            await uno_ws.send_json_to({"action": "accept_trip", "trip_id": trip_id})
+            assert await uno_ws.receive_nothing(timeout=0.5)
+            trip = await Trip.objects.aget(id=trip_id)
+            assert trip.estado == "aceptado"
+            assert trip.conductor_asignado_id == conductores[1].id
+        finally:
+            for socket in sockets:
+                await socket.disconnect()
+            for usuario in [*conductores, pasajero]:
+                await database_sync_to_async(usuario.delete)()
+
     async def test_asignacion_viaje(self):
         """Verifica que el sistema asigna el viaje al conductor más cercano."""
         try:
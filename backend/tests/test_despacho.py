@@ -0,0 +1,132 @@
+import itertools
+import random
+import pytest
+from trips.despacho import asignar_lote, hungaro
+from trips.disponibilidad import obtener_disponibilidad
+from trips.models import Trip
+from trips.presencia import obtener_presencia
+from users.models import Pasajero
+
+
+def _costo_minimo(costos):
+    """Mejor asignación probando todas las permutaciones (matrices chicas)."""
+    n, m = len(costos), len(costos[0])
+    if n <= m:
+        return min(
+            sum(costos[i][j] for i, j in enumerate(columnas))
+            for columnas in itertools.permutations(range(m), n)
+        )
+    return min(
+        sum(costos[i][j] for j, i in enumerate(filas))
+        for filas in itertools.permutations(range(n), m)
+    )
+
+
+class TestHungaro:
+    @pytest.mark.parametrize("n,m", [(1, 1), (3, 3), (4, 6), (6, 4), (5, 5)])
+    def test_costo_optimo(self, n, m):
+        rnd = random.Random(n * 10 + m)
+        for _ in range(20):
+            costos = [[rnd.uniform(0, 10) for _ in range(m)] for _ in range(n)]
+            pares = hungaro(costos)
+
+            assert len(pares) == min(n, m)
+            assert (
+                len({i for i, _ in pares}) == len({j for _, j in pares}) == len(pares)
+            )
+            assert sum(costos[i][j] for i, j in pares) == pytest.approx(
+                _costo_minimo(costos)
+            )
+
+    def test_matriz_vacia(self):
+        assert hungaro([]) == []
+        assert hungaro([[]]) == []
+
+
+@pytest.mark.django_db
+class TestAsignarLote:
+    @pytest.fixture(autouse=True)
+    def disponibilidad(self):
+        obtener_disponibilidad.cache_clear()
+        obtener_presencia.cache_clear()
+        yield obtener_disponibilidad()
+        obtener_disponibilidad.cache_clear()
+        obtener_presencia.cache_clear()
+
+    def _trip(self, pasajero, lat, lon):
+        return Trip.objects.create(
+            cliente=pasajero,
+            origen={"lat": lat, "lng": lon},
+            destino={"lat": 4.7, "lng": -74.0},
+        )
+
+    def test_minimiza_la_distancia_total(self, crear_conductor):
+        """
+        Asignando de a uno, el viaje A tomaría a c1 y dejaría al viaje B con
+        c2, mucho más lejos. En lote, A toma a c2 y B a c1.
+        """
+        c1 = crear_conductor("c1@test.com", 4.6, -74.10)
+        c2 = crear_conductor("c2@test.com", 4.6, -74.08)
+        pasajero = Pasajero.objects.create_user(
+            username="pasajero_test",
+            email="pasajero@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        viaje_a = self._trip(pasajero, 4.6, -74.091)
+        viaje_b = self._trip(pasajero, 4.6, -74.11)
+
+        asignaciones, sin_candidatos, en_espera = asignar_lote([viaje_a.id, viaje_b.id])
+
+        assert {trip.id: c.id for trip, c in asignaciones} == {
+            viaje_a.id: c2.id,
+            viaje_b.id: c1.id,
+        }
+        assert sin_candidatos == en_espera == []
+        viaje_a.refresh_from_db()
+        assert viaje_a.estado == "asignado"
+        assert viaje_a.conductor_asignado_id == c2.id
+
+    def test_viajes_que_no_alcanzan_conductor_quedan_en_espera(self, crear_conductor):
+        c1 = crear_conductor("c1@test.com", 4.6, -74.10)
+        pasajero = Pasajero.objects.create_user(
+            username="pasajero_test",
+            email="pasajero@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        viaje_a = self._trip(pasajero, 4.6, -74.10)
+        viaje_b = self._trip(pasajero, 4.6, -74.11)
+
+        asignaciones, _, en_espera = asignar_lote([viaje_a.id, viaje_b.id])
+
+        assert [(trip.id, c.id) for trip, c in asignaciones] == [(viaje_a.id, c1.id)]
+        assert [trip.id for trip in en_espera] == [viaje_b.id]
+
+    def test_sin_conductores_o_sin_intentos_se_cancela(self, settings, crear_conductor):
+        settings.TRIPS_MAX_INTENTOS_ASIGNACION = 2
+        c1 = crear_conductor("c1@test.com", 4.6, -74.10)
+        pasajero = Pasajero.objects.create_user(
+            username="pasajero_test",
+            email="pasajero@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        # c1 ya rechazó el primero; el segundo agotó sus intentos
+        rechazado = self._trip(pasajero, 4.6, -74.10)
+        rechazado.conductores_excluidos = [c1.id]
+        rechazado.save()
+        agotado = self._trip(pasajero, 4.6, -74.10)
+        agotado.intentos_asignacion = 2
+        agotado.save()
+
+        asignaciones, sin_candidatos, en_espera = asignar_lote(
+            [rechazado.id, agotado.id]
+        )
+
+        assert asignaciones == [] and en_espera == []
+        assert {trip.id for trip in sin_candidatos} == {rechazado.id, agotado.id}
+        for trip in (rechazado, agotado):
+            trip.refresh_from_db()
+            assert trip.estado == "cancelado"
+        assert c1.id in obtener_disponibilidad().disponibles()
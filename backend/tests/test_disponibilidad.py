@@ -0,0 +1,80 @@
+import uuid
+import pytest
+from trips.disponibilidad import DisponibilidadMemoria, DisponibilidadRedis
+from trips.models import Trip
+from users.models import Conductor, Pasajero
+
+
+@pytest.fixture(params=["memoria", "redis"])
+def disponibilidad(request):
+    if request.param == "memoria":
+        yield DisponibilidadMemoria()
+        return
+    registro = DisponibilidadRedis(prefijo=f"test:disponibilidad:{uuid.uuid4().hex}")
+    yield registro
+    registro.redis.delete(*registro.claves)
+
+
+@pytest.mark.django_db
+class TestDisponibilidad:
+    def test_transiciones(self, disponibilidad):
+        disponibilidad.conectar(1)
+        disponibilidad.conectar(2)
+        assert disponibilidad.disponibles() == {1, 2}
+
+        # Reservar solo funciona una vez
+        assert disponibilidad.ocupar(1) is True
+        assert disponibilidad.ocupar(1) is False
+        assert disponibilidad.disponibles() == {2}
+
+        disponibilidad.liberar(1)
+        assert disponibilidad.disponibles() == {1, 2}
+
+        # Un conductor desconectado no vuelve a estar disponible al liberarse
+        disponibilidad.ocupar(2)
+        disponibilidad.desconectar(2)
+        disponibilidad.liberar(2)
+        assert disponibilidad.disponibles() == {1}
+        assert disponibilidad.ocupar(2) is False
+
+    def test_disponibles_entre(self, disponibilidad):
+        for conductor_id in (1, 2, 3):
+            disponibilidad.conectar(conductor_id)
+        disponibilidad.ocupar(2)
+
+        assert disponibilidad.disponibles_entre([1, 2, 4]) == {1}
+        assert disponibilidad.disponibles_entre([]) == set()
+
+    def test_varias_conexiones_del_mismo_conductor(self, disponibilidad):
+        disponibilidad.conectar(1)
+        disponibilidad.conectar(1)
+        disponibilidad.desconectar(1)
+        assert disponibilidad.disponibles() == {1}
+        disponibilidad.desconectar(1)
+        assert disponibilidad.disponibles() == set()
+
+    def test_conectar_con_viaje_en_curso_queda_ocupado(self, disponibilidad):
+        conductor = Conductor.objects.create_user(
+            username="conductor_test",
+            email="conductor@test.com",
+            password="testpassword",
+            rol="Conductor",
+        )
+        pasajero = Pasajero.objects.create_user(
+            username="pasajero_test",
+            email="pasajero@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        Trip.objects.create(
+            cliente=pasajero,
+            origen={"lat": 4.6, "lng": -74.08},
+            destino={"lat": 4.7, "lng": -74.0},
+            conductor_asignado=conductor,
+            estado="asignado",
+        )
+
+        disponibilidad.conectar(conductor.id)
+        assert disponibilidad.disponibles() == set()
+        disponibilidad.liberar(conductor.id)
+        assert disponibilidad.disponibles() == {conductor.id}
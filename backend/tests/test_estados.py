@@ -0,0 +1,79 @@
+import pytest
+from trips import estados
+from trips.disponibilidad import obtener_disponibilidad
+from trips.models import Trip
+from users.models import Pasajero
+
+
+@pytest.mark.django_db
+class TestEstados:
+    def test_ciclo_completo_una_consulta_por_transicion(
+        self, viaje, django_assert_num_queries, crear_conductor
+    ):
+        conductor = crear_conductor("conductor@test.com")
+
+        with django_assert_num_queries(1):
+            assert estados.asignar(viaje.id, conductor.id)
+        with django_assert_num_queries(1):
+            assert estados.aceptar(viaje.id, conductor.id)
+        assert estados.completar(viaje.id, conductor.id)
+
+        viaje.refresh_from_db()
+        assert viaje.estado == "completado"
+        assert viaje.conductor_asignado_id == conductor.id
+
+    def test_aceptar_y_timeout_compiten(self, viaje, crear_conductor):
+        """Solo una de las dos transiciones sobre la misma oferta se aplica."""
+        conductor = crear_conductor("conductor@test.com")
+        assert estados.asignar(viaje.id, conductor.id)
+
+        assert estados.rechazar(viaje.id, conductor.id)
+        assert not estados.aceptar(viaje.id, conductor.id)
+
+        viaje.refresh_from_db()
+        assert (viaje.estado, viaje.conductor_asignado_id) == ("pendiente", None)
+
+    def test_otro_conductor_no_puede_responder(self, viaje, crear_conductor):
+        conductor = crear_conductor("conductor@test.com")
+        otro = crear_conductor("otro@test.com")
+        assert estados.asignar(viaje.id, conductor.id)
+
+        assert not estados.asignar(viaje.id, otro.id)
+        assert not estados.aceptar(viaje.id, otro.id)
+        assert not estados.rechazar(viaje.id, otro.id)
+        assert estados.cancelar(viaje.id)
+        assert not estados.cancelar(viaje.id)
+
+    def test_solo_el_pasajero_cancela_su_viaje(self, viaje):
+        otro = Pasajero.objects.create_user(
+            username="otro", email="otro@test.com", password="testpassword"
+        )
+
+        assert not estados.cancelar(viaje.id, cliente_id=otro.id)
+        assert estados.cancelar(viaje.id, cliente_id=viaje.cliente_id)
+
+    def test_completar_y_cancelar_liberan_al_conductor(self, viaje, crear_conductor):
+        obtener_disponibilidad.cache_clear()
+        disponibilidad = obtener_disponibilidad()
+        conductor = crear_conductor("conductor@test.com")
+        disponibilidad.conectar(conductor.id)
+        otro = Trip.objects.create(
+            cliente=viaje.cliente, origen=viaje.origen, destino=viaje.destino
+        )
+        try:
+            # Los UPDATE no disparan post_save: la liberación es de estados
+            for trip in (viaje, otro):
+                assert disponibilidad.ocupar(conductor.id)
+                assert estados.asignar(trip.id, conductor.id)
+                assert estados.aceptar(trip.id, conductor.id)
+                if trip is viaje:
+                    assert estados.completar(trip.id, conductor.id)
+                else:
+                    assert estados.cancelar(trip.id)
+                assert conductor.id in disponibilidad.disponibles()
+        finally:
+            obtener_disponibilidad.cache_clear()
+
+    def test_transicion_no_permitida(self, viaje):
+        with pytest.raises(ValueError):
+            estados.transicion(viaje.id, "completado", "pendiente")
@@ -0,0 +1,9 @@
+from trips import grupos
+
+
+def test_celda(settings):
+    settings.TRIPS_TAMANO_CELDA_GRUPOS_GRADOS = 0.05
+
+    assert grupos.celda(4.6097, -74.0817) == (92, -1482)
+    # Puntos a pocos metros caen en la misma celda
+    assert grupos.celda(4.6099, -74.0815) == grupos.celda(4.6097, -74.0817)
@@ -0,0 +1,76 @@
+import time
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from trips.historial import registrar_lote, validar_puntos
+from trips.models import DriverLocation, DriverLocationHistory
+from users.models import Conductor
+
+
+@pytest.fixture
+def conductor():
+    return Conductor.objects.create_user(
+        username="conductor_test",
+        email="conductor@test.com",
+        password="testpassword",
+        rol="Conductor",
+    )
+
+
+# Un instante reciente (ms), para que los puntos caigan en la ventana
+AHORA = int(time.time() * 1000)
+
+
+def _punto(ts, lat, lon=-74.08):
+    return {"ts": ts, "lat": lat, "lon": lon}
+
+
+def test_validar_puntos_ordena_y_descarta(settings):
+    settings.TRIPS_MAX_PUNTOS_LOTE = 2
+    puntos = [
+        _punto(AHORA + 3000, 4.63),
+        {"lat": 4.0, "lon": -74.0},  # sin ts
+        _punto(AHORA + 1000, 4.61),
+        _punto(AHORA + 2000, "x"),
+        _punto(AHORA + 4000, 4.64),
+    ]
+
+    assert validar_puntos(puntos) == [
+        (AHORA + 3000, 4.63, -74.08),
+        (AHORA + 4000, 4.64, -74.08),
+    ]
+    assert validar_puntos(None) == []
+
+
+def test_validar_puntos_descarta_ts_fuera_de_rango(settings):
+    settings.TRIPS_ANTIGUEDAD_MAXIMA_PUNTOS_SEGUNDOS = 3600
+    puntos = [
+        _punto("nan", 4.60),
+        _punto(float("inf"), 4.60),
+        _punto(1e20, 4.60),  # datetime.fromtimestamp fallaría al registrar
+        _punto(AHORA - 2 * 3600 * 1000, 4.60),
+        _punto(AHORA + 3600 * 1000, 4.60),
+        _punto(AHORA - 60 * 1000, 4.61),
+    ]
+
+    assert validar_puntos(puntos) == [(AHORA - 60 * 1000, 4.61, -74.08)]
+
+
+@pytest.mark.django_db
+def test_registrar_lote(conductor, settings):
+    settings.TRIPS_BUFFER_UBICACIONES = None
+    puntos = validar_puntos(
+        [_punto(AHORA + 2000, 4.62), _punto(AHORA, 4.60)] + [_punto(AHORA + 1000, 4.61)]
+    )
+
+    with CaptureQueriesContext(connection) as consultas:
+        assert registrar_lote(conductor.id, puntos) == 3
+    # Todo el recorrido en un solo INSERT
+    sql = [c["sql"] for c in consultas.captured_queries]
+    assert len([s for s in sql if "trips_driverlocationhistory" in s]) == 1
+
+    # La posición en vivo es el punto más nuevo, aunque no llegó último
+    assert DriverLocation.objects.get(conductor=conductor).latitud == 4.62
+    recorrido = DriverLocationHistory.objects.filter(conductor=conductor)
+    assert [p.latitud for p in recorrido.order_by("timestamp")] == [4.60, 4.61]
+    assert recorrido.first().timestamp.timestamp() * 1000 in (AHORA, AHORA + 1000)
@@ -0,0 +1,146 @@
+import pytest
+from trips.buffer_ubicaciones import BufferUbicaciones
+from trips.metricas import MetricasMemoria, MetricasRedis, obtener_metricas, worker
+from trips.models import Trip
+from trips.temporizadores import obtener_almacen_temporizadores
+
+ACCION = ("accion", "create_trip")
+
+
+def test_histograma_y_contadores_por_accion(settings):
+    settings.TRIPS_METRICAS_LIMITES_SEGUNDOS = [0.1, 1]
+    metricas = MetricasMemoria()
+
+    with metricas.medir("create_trip"):
+        pass
+    with pytest.raises(ValueError):
+        with metricas.medir("create_trip"):
+            raise ValueError
+    for accion in ("hackeo", [], {}, None):
+        with metricas.medir(accion):
+            pass
+
+    valores = metricas.valores()
+    assert valores[("trips_acciones_total", (ACCION,))] == 2
+    assert valores[("trips_acciones_errores_total", (ACCION,))] == 1
+    assert valores[("trips_acciones_total", (("accion", "desconocida"),))] == 4
+
+    lineas = metricas.exportar().splitlines()
+    assert "# TYPE trips_accion_duracion_segundos histogram" in lineas
+    bucket = "trips_accion_duracion_segundos_bucket"
+    assert f'{bucket}{{accion="create_trip",le="1"}} 2' in lineas
+    assert f'{bucket}{{accion="create_trip",le="+Inf"}} 2' in lineas
+    assert 'trips_accion_duracion_segundos_count{accion="create_trip"} 2' in lineas
+
+
+def test_conexiones_por_rol():
+    metricas = MetricasMemoria()
+
+    metricas.conexion("Conductor", 1)
+    metricas.conexion("Conductor", 1)
+    metricas.conexion("Pasajero", 1)
+    metricas.conexion("Conductor", -1)
+
+    texto = metricas.exportar()
+    assert 'trips_conexiones_abiertas{rol="Conductor"} 1' in texto
+    assert 'trips_conexiones_abiertas{rol="Pasajero"} 1' in texto
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    """Buffer propio con un ping sin volcar (el hilo no despierta en el test)."""
+    buffer = BufferUbicaciones(intervalo_ms=60000, max_entradas=1000)
+    buffer.agregar(1, 4.6097, -74.0817)
+    buffer.ultimo_volcado_lag_ms = 250.0
+    monkeypatch.setattr("trips.buffer_ubicaciones.obtener_buffer", lambda: buffer)
+    return buffer
+
+
+def test_gauges_de_temporizadores_y_buffer(settings, buffer):
+    settings.TRIPS_ALMACEN_TEMPORIZADORES = (
+        "trips.temporizadores.AlmacenTemporizadoresMemoria"
+    )
+    obtener_almacen_temporizadores.cache_clear()
+    try:
+        obtener_almacen_temporizadores().guardar("1:10", 1e10)
+        obtener_almacen_temporizadores().guardar("2:20", 1e10)
+
+        lineas = MetricasMemoria().exportar().splitlines()
+    finally:
+        obtener_almacen_temporizadores.cache_clear()
+
+    assert "trips_temporizadores_pendientes 2" in lineas
+    etiqueta = f'{{worker="{worker()}"}}'
+    assert f"trips_buffer_ubicaciones_pendientes{etiqueta} 1" in lineas
+    assert f"trips_buffer_ubicaciones_lag_segundos{etiqueta} 0.25" in lineas
+    assert any(
+        linea.startswith(f"trips_buffer_ubicaciones_antiguedad_segundos{etiqueta}")
+        for linea in lineas
+    )
+
+
+@pytest.mark.django_db
+def test_consultas_de_la_accion():
+    metricas = MetricasMemoria()
+    Trip.objects.exists()  # fuera de una acción no cuenta
+
+    with metricas.medir("accept_trip"):
+        Trip.objects.exists()
+        Trip.objects.count()
+
+    valores = metricas.valores()
+    etiquetas = (("accion", "accept_trip"),)
+    assert valores[("trips_accion_consultas_total", etiquetas)] == 2
+    assert valores[("trips_accion_db_segundos_total", etiquetas)] > 0
+
+
+def test_redis_suma_los_workers():
+    # Dos instancias con la misma clave hacen de dos procesos
+    workers = [MetricasRedis(clave="trips:metricas:test") for _ in range(2)]
+    workers[0].redis.delete("trips:metricas:test")
+    try:
+        for metricas in workers:
+            with metricas.medir("heartbeat"):
+                pass
+            metricas.conexion("Conductor", 1)
+        # Cada worker vuelca desde su hilo; aquí se fuerza
+        workers[1].volcar()
+
+        valores = workers[0].valores()
+        assert valores[("trips_acciones_total", (("accion", "heartbeat"),))] == 2
+        assert valores[("trips_conexiones_abiertas", (("rol", "Conductor"),))] == 2
+    finally:
+        workers[0].redis.delete("trips:metricas:test")
+
+
+def test_redis_gauges_de_cada_worker(buffer):
+    metricas = MetricasRedis(clave="trips:metricas:test", vigencia=30)
+    clave = metricas.clave_procesos + worker()
+    try:
+        metricas.volcar()
+
+        # Otro proceso los lee de Redis; si el worker muere, la clave vence
+        serie = ("trips_buffer_ubicaciones_pendientes", (("worker", worker()),))
+        otro = MetricasRedis(clave="trips:metricas:test")
+        assert otro.medidores_workers()[serie] == 1
+        assert 0 < metricas.redis.ttl(clave) <= 30
+    finally:
+        metricas.redis.delete("trips:metricas:test", clave)
+
+
+@pytest.mark.django_db
+def test_endpoint(client, settings):
+    settings.TRIPS_METRICAS = "trips.metricas.MetricasMemoria"
+    obtener_metricas.cache_clear()
+    try:
+        respuesta = client.get("/metrics")
+        assert respuesta.status_code == 200
+        assert respuesta["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert b"# TYPE trips_acciones_total counter" in respuesta.content
+
+        settings.TRIPS_METRICAS_TOKEN = "secreto"
+        assert client.get("/metrics").status_code == 401
+        respuesta = client.get("/metrics", HTTP_AUTHORIZATION="Bearer secreto")
+        assert respuesta.status_code == 200
+    finally:
+        obtener_metricas.cache_clear()
@@ -0,0 +1,108 @@
+import pytest
+from trips.disponibilidad import obtener_disponibilidad
+from trips.models import Trip
+from trips.presencia import obtener_presencia, region
+from trips.reasignacion import (
+    aceptar_oferta_abierta,
+    expirar_oferta_abierta,
+    k_oferta,
+    ofrecer_siguiente,
+    rechazar_oferta_abierta,
+)
+
+
+@pytest.mark.django_db
+class TestOfertaAbierta:
+    @pytest.fixture(autouse=True)
+    def registros(self, settings):
+        settings.TRIPS_RADIO_INICIAL_KM = 1
+        settings.TRIPS_FACTOR_RADIO = 2
+        settings.TRIPS_RADIO_MAXIMO_KM = 10
+        settings.TRIPS_OFERTA_K = 2
+        obtener_disponibilidad.cache_clear()
+        obtener_presencia.cache_clear()
+        yield
+        obtener_disponibilidad.cache_clear()
+        obtener_presencia.cache_clear()
+
+    @pytest.fixture
+    def conductores(self, crear_conductor):
+        # Del más cercano al más lejano, todos dentro del primer radio
+        return [crear_conductor(f"c{i}@test.com", 4.6097 + i * 0.001) for i in range(3)]
+
+    def _ids(self, conductores):
+        return [conductor.id for conductor in conductores]
+
+    def test_ofrece_a_los_k_mas_cercanos_sin_reservarlos(self, viaje, conductores):
+        ofertados = ofrecer_siguiente(viaje)
+
+        assert self._ids(ofertados) == self._ids(conductores[:2])
+        viaje.refresh_from_db()
+        assert viaje.estado == "pendiente"
+        assert viaje.conductores_ofertados == self._ids(conductores[:2])
+        assert viaje.intentos_asignacion == 1
+        libres = obtener_disponibilidad().disponibles()
+        assert {c.id for c in conductores} <= libres
+
+    def test_gana_el_primero_que_acepta(self, viaje, conductores):
+        uno, dos, _ = conductores
+        ofrecer_siguiente(viaje)
+
+        assert aceptar_oferta_abierta(viaje.id, dos.id) == [uno.id]
+        assert aceptar_oferta_abierta(viaje.id, uno.id) is None
+
+        viaje.refresh_from_db()
+        assert viaje.estado == "aceptado"
+        assert viaje.conductor_asignado_id == dos.id
+        libres = obtener_disponibilidad().disponibles()
+        assert dos.id not in libres
+        assert uno.id in libres
+
+    def test_no_acepta_quien_no_fue_ofertado_o_ya_rechazo(self, viaje, conductores):
+        uno, dos, tres = conductores
+        ofrecer_siguiente(viaje)
+
+        assert aceptar_oferta_abierta(viaje.id, tres.id) is None
+        assert not rechazar_oferta_abierta(viaje.id, uno.id)
+        assert aceptar_oferta_abierta(viaje.id, uno.id) is None
+        assert Trip.objects.get(id=viaje.id).estado == "pendiente"
+
+    def test_rechazo_de_todos_cierra_la_oferta(self, viaje, conductores):
+        uno, dos, tres = conductores
+        ofrecer_siguiente(viaje)
+
+        assert not rechazar_oferta_abierta(viaje.id, uno.id)
+        assert rechazar_oferta_abierta(viaje.id, dos.id)
+
+        viaje.refresh_from_db()
+        assert viaje.conductores_ofertados == []
+        assert self._ids(ofrecer_siguiente(viaje)) == [tres.id]
+
+    def test_vencida_se_ofrece_a_otros(self, viaje, conductores):
+        uno, dos, tres = conductores
+        ofrecer_siguiente(viaje)
+
+        viaje, anteriores, nuevos = expirar_oferta_abierta(viaje.id)
+
+        assert anteriores == [uno.id, dos.id]
+        assert self._ids(nuevos) == [tres.id]
+        assert set(viaje.conductores_excluidos) == {uno.id, dos.id}
+        # Ya se cerró: un segundo vencimiento no hace nada
+        aceptar_oferta_abierta(viaje.id, tres.id)
+        assert expirar_oferta_abierta(viaje.id) is None
+
+    def test_sin_candidatos_cancela(self, viaje, conductores):
+        ofrecer_siguiente(viaje)
+        expirar_oferta_abierta(viaje.id)
+
+        viaje, _, nuevos = expirar_oferta_abierta(viaje.id)
+
+        assert nuevos == []
+        assert viaje.estado == "cancelado"
+
+    def test_k_por_region(self, settings, viaje, conductores):
+        origen = region(viaje.origen["lat"], viaje.origen["lng"])
+        settings.TRIPS_OFERTA_K_POR_REGION = {origen: 3}
+
+        assert k_oferta(viaje) == 3
+        assert self._ids(ofrecer_siguiente(viaje)) == self._ids(conductores)
@@ -0,0 +1,49 @@
+import uuid
+import pytest
+from trips.presencia import PresenciaMemoria, PresenciaRedis
+
+
+@pytest.fixture(params=["memoria", "redis"])
+def presencia(request):
+    if request.param == "memoria":
+        yield PresenciaMemoria()
+        return
+    registro = PresenciaRedis(prefijo=f"test:presencia:{uuid.uuid4().hex}")
+    yield registro
+    registro.redis.delete(*registro.claves)
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    ahora = [1_700_000_000.0]
+    monkeypatch.setattr("trips.presencia.time.time", lambda: ahora[0])
+    return ahora
+
+
+def test_frescura_y_purga(presencia, reloj):
+    presencia.latido(1, 4.6097, -74.0817)
+    presencia.latido(2, 4.6097, -74.0817)
+    reloj[0] += 50
+    presencia.latido(2)  # latido sin posición: conserva su región
+
+    assert presencia.frescos(ventana=60) == {1, 2}
+    reloj[0] += 20
+    assert presencia.frescos(ventana=60) == {2}
+    assert presencia.frescos_entre([1, 2, 3], ventana=60) == {2}
+    assert presencia.frescos_entre([], ventana=60) == set()
+
+    assert presencia.purgar(ventana=60) == [1]
+    assert presencia.purgar(ventana=60) == []
+    assert presencia.frescos(ventana=3600) == {2}
+
+
+def test_conteo_por_region(presencia, reloj, settings):
+    settings.TRIPS_TAMANO_CELDA_GRUPOS_GRADOS = 0.05
+    presencia.latido(1, 4.6097, -74.0817)
+    presencia.latido(2, 4.6098, -74.0818)
+    presencia.latido(3, 6.2442, -75.5812)
+    presencia.latido(4)  # todavía sin posición
+
+    assert presencia.por_region(ventana=60) == {"92:-1482": 2, "124:-1512": 1}
+    reloj[0] += 120
+    assert presencia.por_region(ventana=60) == {}
@@ -0,0 +1,79 @@
+import pytest
+from trips import estados
+from trips.disponibilidad import obtener_disponibilidad
+from trips.models import Trip
+from trips.presencia import obtener_presencia
+from trips.reasignacion import asignar_siguiente, radios_busqueda
+
+
+def test_radios_busqueda(settings):
+    settings.TRIPS_RADIO_INICIAL_KM = 1
+    settings.TRIPS_FACTOR_RADIO = 2
+    settings.TRIPS_RADIO_MAXIMO_KM = 10
+
+    assert radios_busqueda(0) == [1, 2, 4, 8, 10]
+    assert radios_busqueda(2) == [4, 8, 10]
+    assert radios_busqueda(5) == [10]
+
+    settings.TRIPS_RADIO_INICIAL_KM = None
+    assert radios_busqueda(3) == [None]
+
+
+@pytest.mark.django_db
+class TestAsignarSiguiente:
+    @pytest.fixture(autouse=True)
+    def registros(self, settings):
+        settings.TRIPS_RADIO_INICIAL_KM = 1
+        settings.TRIPS_FACTOR_RADIO = 2
+        settings.TRIPS_RADIO_MAXIMO_KM = 10
+        obtener_disponibilidad.cache_clear()
+        obtener_presencia.cache_clear()
+        yield
+        obtener_disponibilidad.cache_clear()
+        obtener_presencia.cache_clear()
+
+    def _rechazar(self, viaje, conductor):
+        assert estados.rechazar(viaje.id, conductor.id)
+        obtener_disponibilidad().liberar(conductor.id)
+        return Trip.objects.get(id=viaje.id)
+
+    def test_no_vuelve_a_ofrecer_a_quien_ya_lo_rechazo(self, viaje, crear_conductor):
+        # Dos conductores cerca que dejan vencer la oferta: antes el viaje
+        # rebotaba entre ellos para siempre
+        uno = crear_conductor("uno@test.com", 4.6097)
+        dos = crear_conductor("dos@test.com", 4.6107)
+
+        assert asignar_siguiente(viaje).id == uno.id
+        viaje = self._rechazar(viaje, uno)
+        assert asignar_siguiente(viaje).id == dos.id
+        viaje = self._rechazar(viaje, dos)
+
+        assert viaje.conductores_excluidos == [uno.id, dos.id]
+        assert viaje.intentos_asignacion == 2
+        assert asignar_siguiente(viaje) is None
+        assert Trip.objects.get(id=viaje.id).estado == "cancelado"
+
+    def test_amplia_el_radio_hasta_el_maximo(self, viaje, crear_conductor):
+        # ~5.5 km al norte: fuera de 1, 2 y 4 km, dentro de 8
+        lejano = crear_conductor("lejano@test.com", 4.6597)
+        assert asignar_siguiente(viaje).id == lejano.id
+
+    def test_sin_conductores_en_el_radio_maximo_cancela(self, viaje, crear_conductor):
+        crear_conductor("muy_lejano@test.com", 4.8097)  # ~22 km
+        assert asignar_siguiente(viaje) is None
+        assert viaje.estado == "cancelado"
+        assert Trip.objects.get(id=viaje.id).estado == "cancelado"
+
+    def test_cancela_al_agotar_los_intentos(self, viaje, settings, crear_conductor):
+        settings.TRIPS_MAX_INTENTOS_ASIGNACION = 2
+        conductores = [
+            crear_conductor(f"c{i}@test.com", 4.6097 + i / 1000) for i in range(3)
+        ]
+        for conductor in conductores[:2]:
+            assert asignar_siguiente(viaje).id == conductor.id
+            viaje = self._rechazar(viaje, conductor)
+
+        # Queda un conductor libre, pero el viaje ya gastó sus intentos
+        assert asignar_siguiente(viaje) is None
+        assert Trip.objects.get(id=viaje.id).estado == "cancelado"
+        assert conductores[2].id in obtener_disponibilidad().disponibles()
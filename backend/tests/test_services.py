@@ -0,0 +1,314 @@
+import time
+import random
+import pytest
+from trips.buffer_ubicaciones import obtener_buffer
+from trips.disponibilidad import obtener_disponibilidad
+from trips.geo import distancias_km, k_mas_cercanos
+from trips.indice_espacial import IndiceEspacial, indice_conductores, obtener_indice
+from trips.models import Trip, DriverLocation
+from trips.presencia import obtener_presencia
+from trips.services import asignar_conductor, calcular_distancia, candidatos_conductor
+from trips.ubicaciones import AlmacenUbicacionesSQL, obtener_almacen
+from users.models import Conductor, Pasajero
+
+
+def _fuerza_bruta(puntos, lat, lon, k, excluir=(), solo=None):
+    ids = [
+        cid for cid in puntos if cid not in excluir and (solo is None or cid in solo)
+    ]
+    distancias = distancias_km(
+        (lat, lon), [puntos[cid][0] for cid in ids], [puntos[cid][1] for cid in ids]
+    )
+    return sorted(zip(distancias.tolist(), ids))[:k]
+
+
+class TestIndiceEspacial:
+    def test_k_mas_cercanos_coincide_con_fuerza_bruta(self):
+        """El índice devuelve los mismos vecinos que recorrer todos los puntos."""
+        rnd = random.Random(42)
+        indice = IndiceEspacial(tamano_celda=0.01)
+        puntos = {}
+        for conductor_id in range(2000):
+            punto = (4.6 + rnd.uniform(-0.2, 0.2), -74.08 + rnd.uniform(-0.2, 0.2))
+            puntos[conductor_id] = punto
+            indice.actualizar(conductor_id, *punto)
+
+        for _ in range(50):
+            lat = 4.6 + rnd.uniform(-0.3, 0.3)
+            lon = -74.08 + rnd.uniform(-0.3, 0.3)
+            excluir = {rnd.randrange(2000) for _ in range(5)}
+            esperado = _fuerza_bruta(puntos, lat, lon, 5, excluir)
+            obtenido = indice.k_mas_cercanos(lat, lon, k=5, excluir=excluir)
+            assert [cid for _, cid in obtenido] == [cid for _, cid in esperado]
+            assert [d for d, _ in obtenido] == pytest.approx([d for d, _ in esperado])
+
+    def test_solo_considera_los_permitidos(self):
+        rnd = random.Random(3)
+        indice = IndiceEspacial(tamano_celda=0.01)
+        puntos = {}
+        for conductor_id in range(2000):
+            punto = (4.6 + rnd.uniform(-0.2, 0.2), -74.08 + rnd.uniform(-0.2, 0.2))
+            puntos[conductor_id] = punto
+            indice.actualizar(conductor_id, *punto)
+
+        # Conjuntos chicos (medición directa) y grandes (búsqueda por anillos)
+        for tamano in (10, 1500):
+            solo = set(rnd.sample(range(2000), tamano))
+            esperado = _fuerza_bruta(puntos, 4.6, -74.08, 5, solo=solo)
+            obtenido = indice.k_mas_cercanos(4.6, -74.08, k=5, solo=solo)
+            assert [cid for _, cid in obtenido] == [cid for _, cid in esperado]
+
+        assert indice.k_mas_cercanos(4.6, -74.08, k=5, solo=set()) == []
+
+    def test_puntos_lejanos_y_movimientos(self):
+        """Encuentra puntos a cientos de km y respeta los cambios de celda."""
+        indice = IndiceEspacial(tamano_celda=0.01)
+        indice.actualizar(1, 10.0, -70.0)
+        assert indice.k_mas_cercanos(4.6, -74.08)[0][1] == 1
+
+        indice.actualizar(2, 4.7, -74.1)
+        assert indice.k_mas_cercanos(4.6, -74.08)[0][1] == 2
+
+        indice.actualizar(2, 20.0, -60.0)
+        assert indice.k_mas_cercanos(4.6, -74.08)[0][1] == 1
+
+        indice.eliminar(1)
+        assert [cid for _, cid in indice.k_mas_cercanos(4.6, -74.08, k=3)] == [2]
+
+
+class TestDistancias:
+    def test_lote_coincide_con_escalar(self):
+        origen = (4.6097, -74.0817)
+        latitudes = [4.6097, 4.6197, 10.0, -33.45]
+        longitudes = [-74.0817, -74.0917, -70.0, -70.66]
+        distancias = distancias_km(origen, latitudes, longitudes)
+        for lat, lon, distancia in zip(latitudes, longitudes, distancias):
+            assert calcular_distancia(origen, (lat, lon)) == round(distancia, 2)
+        assert calcular_distancia(origen, (4.6197, -74.0917)) == 1.57
+
+    def test_k_mas_cercanos_sin_ordenar_todo(self):
+        rnd = random.Random(7)
+        latitudes = [rnd.uniform(-10, 10) for _ in range(1000)]
+        longitudes = [rnd.uniform(-80, -60) for _ in range(1000)]
+        origen = (0.0, -70.0)
+
+        indices, distancias = k_mas_cercanos(origen, latitudes, longitudes, k=10)
+        todas = distancias_km(origen, latitudes, longitudes)
+        assert list(indices) == list(todas.argsort(kind="stable")[:10])
+        assert list(distancias) == sorted(distancias)
+        assert len(k_mas_cercanos(origen, latitudes[:3], longitudes[:3], k=10)[0]) == 3
+
+
+@pytest.mark.django_db
+class TestAsignarConductor:
+    @pytest.fixture(autouse=True)
+    def disponibilidad(self):
+        obtener_disponibilidad.cache_clear()
+        obtener_presencia.cache_clear()
+        yield obtener_disponibilidad()
+        obtener_disponibilidad.cache_clear()
+        obtener_presencia.cache_clear()
+
+    def test_ignora_conductores_sin_latidos(
+        self, monkeypatch, settings, crear_conductor
+    ):
+        settings.TRIPS_PRESENCIA_FRESCURA_SEGUNDOS = 60
+        ausente = crear_conductor("ausente@test.com", 4.6097, -74.0817)
+        presente = crear_conductor("presente@test.com", 4.6197, -74.0917)
+        pasajero = Pasajero.objects.create_user(
+            username="pasajero_test",
+            email="pasajero@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        trip = Trip.objects.create(
+            cliente=pasajero,
+            origen={"lat": 4.6097, "lng": -74.0817},
+            destino={"lat": 4.6297, "lng": -74.0647},
+        )
+
+        # Dos minutos después solo el segundo siguió mandando latidos
+        ahora = time.time() + 120
+        monkeypatch.setattr("trips.presencia.time.time", lambda: ahora)
+        obtener_presencia().latido(presente.id)
+
+        assert asignar_conductor(trip).id == presente.id
+        assert ausente.id in obtener_disponibilidad().disponibles()
+
+    def test_asigna_el_mas_cercano_excluyendo_al_anterior(
+        self, disponibilidad, crear_conductor
+    ):
+        cercano = crear_conductor("cercano@test.com", 4.6097, -74.0817)
+        lejano = crear_conductor("lejano@test.com", 4.6197, -74.0917)
+        pasajero = Pasajero.objects.create_user(
+            username="pasajero_test",
+            email="pasajero@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        trip = Trip.objects.create(
+            cliente=pasajero,
+            origen={"lat": 4.6097, "lng": -74.0817},
+            destino={"lat": 4.6297, "lng": -74.0647},
+        )
+
+        assert asignar_conductor(trip).id == cercano.id
+        disponibilidad.liberar(cercano.id)
+        assert asignar_conductor(trip, excluir_conductor=cercano).id == lejano.id
+        disponibilidad.liberar(lejano.id)
+
+        # Al moverse, el índice refleja la nueva posición
+        ubicacion = cercano.ubicacion
+        ubicacion.latitud, ubicacion.longitud = 4.7, -74.2
+        ubicacion.save()
+        assert asignar_conductor(trip).id == lejano.id
+
+    def test_no_asigna_conductores_ocupados_ni_desconectados(
+        self, disponibilidad, crear_conductor
+    ):
+        cercano = crear_conductor("cercano@test.com", 4.6097, -74.0817)
+        medio = crear_conductor("medio@test.com", 4.6147, -74.0867)
+        lejano = crear_conductor("lejano@test.com", 4.6197, -74.0917)
+        pasajero = Pasajero.objects.create_user(
+            username="pasajero_test",
+            email="pasajero@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        trip = Trip.objects.create(
+            cliente=pasajero,
+            origen={"lat": 4.6097, "lng": -74.0817},
+            destino={"lat": 4.6297, "lng": -74.0647},
+        )
+
+        # La asignación reserva al conductor: el siguiente viaje toma otro
+        assert asignar_conductor(trip).id == cercano.id
+        assert cercano.id not in disponibilidad.disponibles()
+        disponibilidad.desconectar(medio.id)
+        assert asignar_conductor(trip).id == lejano.id
+        assert asignar_conductor(trip) is None
+
+        # Terminar el viaje lo devuelve a los disponibles
+        trip.conductor_asignado = cercano
+        trip.estado = "completado"
+        trip.save()
+        assert asignar_conductor(trip).id == cercano.id
+
+    def test_amplia_la_busqueda_pasando_a_los_ocupados(
+        self, disponibilidad, crear_conductor
+    ):
+        conductores = [
+            crear_conductor(f"conductor{i}@test.com", 4.6 + i / 1000, -74.08)
+            for i in range(12)
+        ]
+        # Los diez más cercanos están ocupados: hacen falta varias tandas
+        for conductor in conductores[:10]:
+            disponibilidad.ocupar(conductor.id)
+        pasajero = Pasajero.objects.create_user(
+            username="pasajero_test",
+            email="pasajero@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        trip = Trip.objects.create(
+            cliente=pasajero,
+            origen={"lat": 4.6, "lng": -74.08},
+            destino={"lat": 4.6297, "lng": -74.0647},
+        )
+
+        candidatos = candidatos_conductor(trip, k=2)
+        assert [c.id for _, c in candidatos] == [c.id for c in conductores[10:]]
+        # El radio corta la búsqueda antes de llegar a los libres (~1.1 km)
+        assert candidatos_conductor(trip, k=2, radio_km=1) == []
+
+    def test_sin_conductores(self):
+        pasajero = Pasajero.objects.create_user(
+            username="pasajero_test",
+            email="pasajero@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        trip = Trip.objects.create(
+            cliente=pasajero,
+            origen={"lat": 4.6097, "lng": -74.0817},
+            destino={"lat": 4.6297, "lng": -74.0647},
+        )
+        assert asignar_conductor(trip) is None
+
+    def test_una_consulta_por_asignacion(
+        self, django_assert_num_queries, crear_conductor
+    ):
+        """Regresión del N+1: con el índice cargado basta validar al candidato."""
+        for i in range(20):
+            crear_conductor(f"conductor{i}@test.com", 4.6 + i / 1000, -74.08)
+        pasajero = Pasajero.objects.create_user(
+            username="pasajero_test",
+            email="pasajero@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        trip = Trip.objects.create(
+            cliente=pasajero,
+            origen={"lat": 4.6, "lng": -74.08},
+            destino={"lat": 4.6297, "lng": -74.0647},
+        )
+        obtener_indice()
+
+        with django_assert_num_queries(1):
+            assert asignar_conductor(trip).email == "conductor0@test.com"
+
+
+@pytest.mark.django_db
+class TestAlmacenUbicacionesSQL:
+    def test_candidatos_ordenados_en_una_consulta(self, django_assert_num_queries):
+        conductores = []
+        for i, (lat, lon) in enumerate(
+            [(4.6197, -74.0917), (4.6097, -74.0817), (4.7097, -74.1817)]
+        ):
+            conductor = Conductor.objects.create_user(
+                username=f"c{i}",
+                email=f"c{i}@test.com",
+                password="testpassword",
+                rol="Conductor",
+            )
+            DriverLocation.objects.create(
+                conductor=conductor, latitud=lat, longitud=lon
+            )
+            conductores.append(conductor)
+        # Un pasajero con ubicación no debe aparecer como candidato
+        pasajero = Pasajero.objects.create_user(
+            username="pasajero_test",
+            email="pasajero@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        DriverLocation.objects.create(
+            conductor=pasajero, latitud=4.6097, longitud=-74.0817
+        )
+
+        almacen = AlmacenUbicacionesSQL()
+        with django_assert_num_queries(1):
+            candidatos = almacen.candidatos(
+                4.6097, -74.0817, k=2, excluir={conductores[2].id}
+            )
+
+        assert [c.id for _, c in candidatos] == [conductores[1].id, conductores[0].id]
+        assert candidatos[0][0] == pytest.approx(0.0, abs=1e-6)
+        assert candidatos[1][0] == pytest.approx(
+            calcular_distancia((4.6097, -74.0817), (4.6197, -74.0917)), abs=0.01
+        )
+
+    def test_guardar_no_alimenta_el_indice_en_memoria(self, settings):
+        settings.TRIPS_ALMACEN_UBICACIONES = "trips.ubicaciones.AlmacenUbicacionesSQL"
+        obtener_almacen.cache_clear()
+        conductor = Conductor.objects.create_user(
+            username="c0", email="c0@test.com", password="testpassword", rol="Conductor"
+        )
+        try:
+            obtener_almacen().guardar(conductor.id, 4.6097, -74.0817)
+            obtener_buffer().volcar()
+        finally:
+            obtener_almacen.cache_clear()
+
+        assert DriverLocation.objects.filter(conductor=conductor).exists()
+        assert conductor.id not in indice_conductores
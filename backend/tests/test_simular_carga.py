@@ -0,0 +1,29 @@
+from io import StringIO
+import pytest
+from django.core.management import call_command
+from trips.models import Trip
+from users.models import User
+
+
+@pytest.mark.django_db(transaction=True)
+def test_simular_carga_reporta_y_limpia():
+    salida = StringIO()
+
+    call_command(
+        "simular_carga",
+        conductores=4,
+        pasajeros=2,
+        actualizaciones=2,
+        stdout=salida,
+    )
+
+    filas = {
+        linea.split()[0]: linea.split()[1:] for linea in salida.getvalue().splitlines()
+    }
+    assert filas["conexion"][0] == "6"
+    assert filas["update_location"][0] == "8"
+    assert filas["create_trip"][0] == "2"
+    assert filas["accept_trip"][0] == "2"
+    # Los usuarios simulados y sus viajes se borran al terminar
+    assert not User.objects.filter(email__endswith="@carga.local").exists()
+    assert not Trip.objects.exists()
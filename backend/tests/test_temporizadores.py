@@ -0,0 +1,120 @@
+import asyncio
+import time
+import uuid
+import pytest
+from trips.disponibilidad import obtener_disponibilidad
+from trips.models import Trip, DriverLocation
+from trips.presencia import obtener_presencia
+from trips.temporizadores import (
+    AlmacenTemporizadoresMemoria,
+    AlmacenTemporizadoresRedis,
+    Temporizadores,
+    expirar_oferta,
+)
+from users.models import Conductor, Pasajero
+
+
+@pytest.fixture
+def almacen_redis():
+    almacen = AlmacenTemporizadoresRedis(
+        clave=f"test:temporizadores:{uuid.uuid4().hex}"
+    )
+    yield almacen
+    almacen.redis.delete(almacen.clave)
+
+
+class Registro:
+    def __init__(self):
+        self.vencidos = []
+
+    async def __call__(self, trip_id, conductor_id):
+        self.vencidos.append((trip_id, conductor_id))
+
+
+@pytest.mark.asyncio
+class TestTemporizadores:
+    async def test_vencen_en_orden_y_se_cancelan(self):
+        registro = Registro()
+        temporizadores = Temporizadores(AlmacenTemporizadoresMemoria(), registro)
+
+        await temporizadores.programar(1, 10, segundos=0.2)
+        await temporizadores.programar(2, 20, segundos=0.05)
+        await temporizadores.programar(3, 30, segundos=0.1)
+        assert temporizadores.pendientes() == 3
+
+        assert await temporizadores.cancelar(3, 30) is True
+        assert await temporizadores.cancelar(3, 30) is False
+        await asyncio.sleep(0.4)
+
+        assert registro.vencidos == [(2, 20), (1, 10)]
+        assert temporizadores.pendientes() == 0
+        assert temporizadores.metricas()["disparados"] == 2
+        await temporizadores.detener()
+
+    async def test_recupera_temporizadores_tras_reinicio(self, almacen_redis):
+        # Temporizadores que dejó un proceso anterior, uno ya vencido
+        almacen_redis.guardar("5:7", time.time() - 1)
+        almacen_redis.guardar("6:8", time.time() + 0.1)
+
+        registros = [Registro(), Registro()]
+        procesos = [Temporizadores(almacen_redis, registro) for registro in registros]
+        for temporizadores in procesos:
+            temporizadores.iniciar()
+        await asyncio.sleep(0.4)
+
+        # Cada vencimiento se dispara una sola vez entre todos los procesos
+        vencidos = registros[0].vencidos + registros[1].vencidos
+        assert sorted(vencidos) == [(5, 7), (6, 8)]
+        assert almacen_redis.pendientes() == 0
+        for temporizadores in procesos:
+            await temporizadores.detener()
+
+
+@pytest.mark.django_db
+class TestExpirarOferta:
+    def test_reasigna_a_otro_conductor(self):
+        obtener_disponibilidad.cache_clear()
+        obtener_presencia.cache_clear()
+        disponibilidad = obtener_disponibilidad()
+        conductores = []
+        for i, lat in enumerate([4.6097, 4.6197]):
+            conductor = Conductor.objects.create_user(
+                username=f"c{i}",
+                email=f"c{i}@test.com",
+                password="testpassword",
+                rol="Conductor",
+            )
+            DriverLocation.objects.create(
+                conductor=conductor, latitud=lat, longitud=-74.0817
+            )
+            disponibilidad.conectar(conductor.id)
+            obtener_presencia().latido(conductor.id)
+            conductores.append(conductor)
+        pasajero = Pasajero.objects.create_user(
+            username="pasajero_test",
+            email="pasajero@test.com",
+            password="testpassword",
+            rol="Pasajero",
+        )
+        trip = Trip.objects.create(
+            cliente=pasajero,
+            origen={"lat": 4.6097, "lng": -74.0817},
+            destino={"lat": 4.6297, "lng": -74.0647},
+            conductor_asignado=conductores[0],
+            estado="asignado",
+        )
+        disponibilidad.ocupar(conductores[0].id)
+
+        trip, nuevo = expirar_oferta(trip.id, conductores[0].id)
+
+        assert nuevo.id == conductores[1].id
+        trip.refresh_from_db()
+        assert (trip.estado, trip.conductor_asignado_id) == (
+            "asignado",
+            conductores[1].id,
+        )
+        assert disponibilidad.disponibles() == {conductores[0].id}
+
+        # Un vencimiento viejo no toca una oferta que ya cambió
+        assert expirar_oferta(trip.id, conductores[0].id) is None
+        obtener_disponibilidad.cache_clear()
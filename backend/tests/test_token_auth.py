@@ -0,0 +1,171 @@
+import pytest
+from asgiref.sync import async_to_sync, sync_to_async
+from rest_framework.test import APIClient
+from backend.token_auth_middleware import TokenAuthMiddleware
+from users.cache_tokens import FALTA, cache_sesiones
+from users.models import Conductor, Token, User
+
+
+@pytest.fixture(autouse=True)
+def limpiar_cache():
+    cache_sesiones.limpiar()
+    yield
+    cache_sesiones.limpiar()
+
+
+async def _conectar(query_string=b"", headers=()):
+    """Pasar una conexión por el middleware y devolver el usuario del scope."""
+    usuarios = []
+
+    async def app(scope, receive, send):
+        usuarios.append(scope["user"])
+
+    scope = {"type": "websocket", "query_string": query_string, "headers": headers}
+    await TokenAuthMiddleware(app)(scope, None, None)
+    return usuarios[0]
+
+
+def _login(cliente):
+    Conductor.objects.create_user(
+        username="conductor_test",
+        email="conductor@test.com",
+        password="testpassword",
+        rol="Conductor",
+    )
+    respuesta = cliente.post(
+        "/api/users/login",
+        {"email": "conductor@test.com", "password": "testpassword"},
+        format="json",
+    )
+    return respuesta.data["access"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+class TestTokenAuthMiddleware:
+    async def test_reconexiones_usan_la_cache(self):
+        access = await sync_to_async(_login)(APIClient())
+
+        user = await _conectar(f"token={access}".encode())
+        assert user.email == "conductor@test.com"
+
+        # Sin pasar por LogoutView la cache no se entera: no volvió a la base
+        await sync_to_async(Token.objects.all().delete)()
+        assert (await _conectar(f"token={access}".encode())).id == user.id
+        encabezado = [(b"authorization", f"Bearer {access}".encode())]
+        assert (await _conectar(headers=encabezado)).id == user.id
+
+        assert not (await _conectar(b"token=basura")).is_authenticated
+        assert not (await _conectar()).is_authenticated
+
+    async def test_logout_invalida_la_cache(self):
+        cliente = APIClient()
+        access = await sync_to_async(_login)(cliente)
+        assert (await _conectar(f"token={access}".encode())).is_authenticated
+
+        cliente.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        respuesta = await sync_to_async(cliente.post)("/api/users/logout")
+        assert respuesta.status_code == 200
+
+        assert not (await _conectar(f"token={access}".encode())).is_authenticated
+
+
+@pytest.mark.django_db
+class TestCustomJWTAuthentication:
+    @pytest.fixture(autouse=True)
+    def cache_compartida(self, settings):
+        settings.CACHES = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        }
+
+    def test_peticion_en_caliente_sin_consultas(self, django_assert_num_queries):
+        cliente = APIClient()
+        access = _login(cliente)
+        cliente.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        assert cliente.get("/api/users/test").status_code == 200
+
+        with django_assert_num_queries(0):
+            assert cliente.get("/api/users/test").status_code == 200
+
+        # Otro worker (cache del proceso vacía) resuelve con la compartida
+        cache_sesiones.limpiar()
+        with django_assert_num_queries(0):
+            assert cliente.get("/api/users/test").status_code == 200
+
+    def test_conexion_websocket_en_caliente_sin_consultas(
+        self, django_assert_num_queries
+    ):
+        cliente = APIClient()
+        access = _login(cliente)
+        # La primera validación (por HTTP) llena las dos caches
+        cliente.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        assert cliente.get("/api/users/test").status_code == 200
+        user = User.objects.get(email="conductor@test.com")
+        conectar = async_to_sync(_conectar)
+        query_string = f"token={access}".encode()
+
+        # Con la compartida y con la del proceso; el usuario se arma de la
+        # cache con lo que usan el consumer y su __str__
+        for limpiar in (True, False):
+            if limpiar:
+                cache_sesiones.limpiar()
+            with django_assert_num_queries(0):
+                reconectado = conectar(query_string)
+                assert (reconectado.id, reconectado.rol) == (user.id, "Conductor")
+                assert str(reconectado) == str(user)
+
+    def test_usuario_desactivado_no_autentica(self):
+        cliente = APIClient()
+        access = _login(cliente)
+        cliente.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        assert cliente.get("/api/users/test").status_code == 200
+
+        # Guardar al usuario invalida sus sesiones cacheadas
+        conductor = Conductor.objects.get(email="conductor@test.com")
+        conductor.is_active = False
+        conductor.save()
+        assert cache_sesiones.obtener(Token.objects.get().access_jti) is FALTA
+        assert cliente.get("/api/users/test").status_code == 401
+
+        conductor.is_active = True
+        conductor.save()
+        assert cliente.get("/api/users/test").status_code == 200
+
+    def test_login_y_logout_invalidan(self):
+        cliente = APIClient()
+        access = _login(cliente)
+        cliente.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        assert cliente.get("/api/users/test").status_code == 200
+
+        # Un nuevo login reemplaza el token anterior
+        cliente.post(
+            "/api/users/login",
+            {"email": "conductor@test.com", "password": "testpassword"},
+            format="json",
+        )
+        assert cliente.get("/api/users/test").status_code == 401
+
+    def test_varias_sesiones_por_usuario(self, settings):
+        settings.TOKENS_MAX_SESIONES = 2
+        cliente = APIClient()
+        accesos = [_login(cliente)]
+        for _ in range(2):
+            respuesta = cliente.post(
+                "/api/users/login",
+                {"email": "conductor@test.com", "password": "testpassword"},
+                format="json",
+            )
+            accesos.append(respuesta.data["access"])
+
+        def estado(access):
+            cliente.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+            return cliente.get("/api/users/test").status_code
+
+        # El tercer login cerró la sesión más vieja
+        assert [estado(access) for access in accesos] == [401, 200, 200]
+
+        # El logout cierra solo la sesión del token usado
+        cliente.credentials(HTTP_AUTHORIZATION=f"Bearer {accesos[2]}")
+        assert cliente.post("/api/users/logout").status_code == 200
+        assert [estado(access) for access in accesos[1:]] == [200, 401]
+        assert Token.objects.count() == 1
@@ -0,0 +1,150 @@
+import time
+import uuid
+import pytest
+from django.db import connection
+from trips.buffer_ubicaciones import BufferUbicaciones
+from trips.indice_espacial import obtener_indice
+from trips.models import DriverLocation
+from trips.ubicaciones import AlmacenUbicacionesPostGIS, AlmacenUbicacionesRedis
+
+
+@pytest.fixture
+def almacen_redis():
+    prefijo = f"test:ubicaciones:{uuid.uuid4().hex}"
+    almacen = AlmacenUbicacionesRedis(prefijo=prefijo)
+    yield almacen
+    almacen.redis.delete(almacen.clave, almacen.clave_pendientes)
+
+
+@pytest.mark.django_db
+class TestAlmacenUbicacionesRedis:
+    def test_cercanos_ordenados_y_con_exclusion(self, almacen_redis):
+        almacen_redis.guardar(1, 4.6097, -74.0817)
+        almacen_redis.guardar(2, 4.6197, -74.0917)
+        almacen_redis.guardar(3, 4.7097, -74.1817)
+
+        cercanos = almacen_redis.cercanos(4.6097, -74.0817, k=2)
+        assert [conductor_id for _, conductor_id in cercanos] == [1, 2]
+        assert cercanos[1][0] == pytest.approx(1.57, abs=0.01)
+
+        cercanos = almacen_redis.cercanos(4.6097, -74.0817, k=2, excluir={1})
+        assert [conductor_id for _, conductor_id in cercanos] == [2, 3]
+
+        almacen_redis.eliminar(2)
+        cercanos = almacen_redis.cercanos(4.6097, -74.0817, k=5)
+        assert [conductor_id for _, conductor_id in cercanos] == [1, 3]
+
+    def test_volcar_escribe_instantaneas(self, almacen_redis, crear_conductor):
+        conductor = crear_conductor("conductor@test.com")
+        almacen_redis.guardar(conductor.id, 4.6097, -74.0817)
+        almacen_redis.guardar(conductor.id, 4.6197, -74.0917)
+        almacen_redis.guardar(999999, 4.6, -74.0)  # conductor inexistente
+
+        assert not DriverLocation.objects.exists()
+        assert almacen_redis.volcar() == 1
+
+        ubicacion = DriverLocation.objects.get(conductor=conductor)
+        assert ubicacion.latitud == pytest.approx(4.6197, abs=1e-5)
+        assert ubicacion.longitud == pytest.approx(-74.0917, abs=1e-5)
+
+        # Sin cambios nuevos no hay nada que volcar
+        assert almacen_redis.volcar() == 0
+
+
+@pytest.mark.django_db
+class TestSincronizacionIndice:
+    def test_ve_lo_que_escribe_otro_proceso(self, settings, crear_conductor):
+        settings.TRIPS_INDICE_SINCRONIZACION_SEGUNDOS = 0
+        conductor = crear_conductor("conductor@test.com")
+        DriverLocation.objects.create(
+            conductor=conductor, latitud=4.6097, longitud=-74.0817
+        )
+        assert obtener_indice().posicion(conductor.id) == (4.6097, -74.0817)
+
+        # El upsert en lote de otro worker no dispara señales en este proceso
+        DriverLocation.objects.bulk_create(
+            [DriverLocation(conductor=conductor, latitud=6.2442, longitud=-75.5812)],
+            update_conflicts=True,
+            unique_fields=["conductor"],
+            update_fields=["latitud", "longitud", "timestamp"],
+        )
+        assert obtener_indice().posicion(conductor.id) == (6.2442, -75.5812)
+
+        # Una fila borrada por otro proceso sale con la recarga completa
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {DriverLocation._meta.db_table} WHERE conductor_id = %s",
+                [conductor.id],
+            )
+        assert conductor.id in obtener_indice()
+        settings.TRIPS_INDICE_RECARGA_SEGUNDOS = 0
+        assert conductor.id not in obtener_indice()
+
+
+def _hay_columna_geografica():
+    with connection.cursor() as cursor:
+        columnas = connection.introspection.get_table_description(
+            cursor, DriverLocation._meta.db_table
+        )
+    return any(columna.name == "ubicacion" for columna in columnas)
+
+
+@pytest.mark.django_db
+class TestAlmacenUbicacionesPostGIS:
+    def test_knn_en_una_consulta(self, django_assert_num_queries, crear_conductor):
+        if not _hay_columna_geografica():
+            pytest.skip("La base de datos no tiene PostGIS")
+
+        cercano = crear_conductor("cercano@test.com")
+        lejano = crear_conductor("lejano@test.com")
+        almacen = AlmacenUbicacionesPostGIS()
+        almacen.guardar(cercano.id, 4.6097, -74.0817)
+        almacen.guardar(lejano.id, 4.6197, -74.0917)
+
+        with django_assert_num_queries(1):
+            candidatos = almacen.candidatos(4.6097, -74.0817, k=1)
+        assert [conductor.id for _, conductor in candidatos] == [cercano.id]
+
+        candidatos = almacen.candidatos(4.6097, -74.0817, k=2, excluir={cercano.id})
+        assert [conductor.id for _, conductor in candidatos] == [lejano.id]
+        assert candidatos[0][0] == pytest.approx(1.57, abs=0.01)
+
+
+@pytest.mark.django_db(transaction=True)
+class TestBufferUbicaciones:
+    def test_conserva_la_ultima_posicion_y_vuelca_en_lote(self, crear_conductor):
+        conductores = [crear_conductor(f"c{i}@test.com") for i in range(3)]
+        buffer = BufferUbicaciones(intervalo_ms=60_000, max_entradas=100)
+
+        for paso in range(10):
+            for conductor in conductores:
+                buffer.agregar(conductor.id, 4.6 + paso / 100, -74.08)
+        buffer.agregar(999999, 4.6, -74.0)  # conductor inexistente
+
+        metricas = buffer.metricas()
+        assert metricas["pendientes"] == 4
+        assert metricas["escrituras_recibidas"] == 31
+        assert not DriverLocation.objects.exists()
+
+        assert buffer.volcar() == 3
+        for conductor in conductores:
+            ubicacion = DriverLocation.objects.get(conductor=conductor)
+            assert ubicacion.latitud == pytest.approx(4.69)
+
+        metricas = buffer.metricas()
+        assert metricas["pendientes"] == 0
+        assert metricas["volcados"] == 1
+        assert metricas["filas_escritas"] == 3
+        assert metricas["ultimo_volcado_lag_ms"] > 0
+
+    def test_vuelca_al_llenarse(self, crear_conductor):
+        conductores = [crear_conductor(f"c{i}@test.com") for i in range(2)]
+        buffer = BufferUbicaciones(intervalo_ms=60_000, max_entradas=2)
+        for conductor in conductores:
+            buffer.agregar(conductor.id, 4.6, -74.08)
+
+        for _ in range(50):
+            if DriverLocation.objects.count() == 2:
+                break
+            time.sleep(0.1)
+        assert DriverLocation.objects.count() == 2
@@ -0,0 +1,165 @@
+import atexit
+import logging
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections
+from .models import DriverLocation
+
+logger = logging.getLogger(__name__)
+
+
+class BufferUbicaciones:
+    """
+    Buffer de escritura diferida (write-behind) para DriverLocation.
+
+    Guarda en memoria solo la última posición de cada conductor y la escribe
+    con un único upsert masivo cada `intervalo_ms` milisegundos o en cuanto
+    hay `max_entradas` conductores pendientes. Un hilo propio hace el volcado,
+    así que `agregar` nunca toca la base de datos.
+    """
+
+    def __init__(self, intervalo_ms=500, max_entradas=500):
+        self.intervalo = intervalo_ms / 1000
+        self.max_entradas = max_entradas
+        self._pendientes = {}  # conductor_id -> (lat, lon, recibido_en)
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+
+        # Métricas
+        self.escrituras_recibidas = 0
+        self.filas_escritas = 0
+        self.volcados = 0
+        self.errores = 0
+        self.ultimo_volcado_en = None
+        self.ultimo_volcado_duracion_ms = 0.0
+        self.ultimo_volcado_lag_ms = 0.0
+
+    def agregar(self, conductor_id, lat, lon):
+        """Registrar una posición; reemplaza a la pendiente del mismo conductor."""
+        with self._lock:
+            anterior = self._pendientes.get(conductor_id)
+            # Conservar el instante del primer ping sin volcar para medir el lag
+            recibido_en = anterior[2] if anterior else time.monotonic()
+            self._pendientes[conductor_id] = (lat, lon, recibido_en)
+            self.escrituras_recibidas += 1
+            lleno = len(self._pendientes) >= self.max_entradas
+
+        self._asegurar_hilo()
+        if lleno:
+            self._despertar.set()
+
+    def descartar(self, conductor_id):
+        with self._lock:
+            self._pendientes.pop(conductor_id, None)
+
+    def volcar(self):
+        """Escribir lo pendiente en un solo upsert. Devuelve filas escritas."""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+        if not pendientes:
+            return 0
+
+        inicio = time.monotonic()
+        try:
+            ubicaciones = self._escribir(pendientes)
+        except Exception:
+            # Devolver al buffer lo que no fue reemplazado por un ping más nuevo
+            with self._lock:
+                for conductor_id, entrada in pendientes.items():
+                    self._pendientes.setdefault(conductor_id, entrada)
+            raise
+
+        fin = time.monotonic()
+        mas_antiguo = min(recibido_en for _, _, recibido_en in pendientes.values())
+        self.volcados += 1
+        self.filas_escritas += len(ubicaciones)
+        self.ultimo_volcado_en = time.time()
+        self.ultimo_volcado_duracion_ms = (fin - inicio) * 1000
+        self.ultimo_volcado_lag_ms = (fin - mas_antiguo) * 1000
+        return len(ubicaciones)
+
+    def _escribir(self, pendientes):
+        # Ignorar conductores borrados para no romper el lote por la FK
+        existentes = set(
+            get_user_model()
+            .objects.filter(id__in=pendientes.keys())
+            .values_list("id", flat=True)
+        )
+        ubicaciones = [
+            DriverLocation(conductor_id=conductor_id, latitud=lat, longitud=lon)
+            for conductor_id, (lat, lon, _) in pendientes.items()
+            if conductor_id in existentes
+        ]
+        DriverLocation.objects.bulk_create(
+            ubicaciones,
+            update_conflicts=True,
+            unique_fields=["conductor"],
+            update_fields=["latitud", "longitud", "timestamp"],
+        )
+        return ubicaciones
+
+    def metricas(self):
+        """Estado del buffer y lag de volcado, para monitoreo."""
+        with self._lock:
+            pendientes = len(self._pendientes)
+            mas_antiguo = min(
+                (recibido_en for _, _, recibido_en in self._pendientes.values()),
+                default=None,
+            )
+        return {
+            "pendientes": pendientes,
+            "edad_pendiente_mas_antigua_ms": (
+                (time.monotonic() - mas_antiguo) * 1000 if mas_antiguo else 0.0
+            ),
+            "escrituras_recibidas": self.escrituras_recibidas,
+            "filas_escritas": self.filas_escritas,
+            "volcados": self.volcados,
+            "errores": self.errores,
+            "ultimo_volcado_en": self.ultimo_volcado_en,
+            "ultimo_volcado_duracion_ms": self.ultimo_volcado_duracion_ms,
+            "ultimo_volcado_lag_ms": self.ultimo_volcado_lag_ms,
+        }
+
+    def _asegurar_hilo(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(
+                    target=self._bucle, name="buffer-ubicaciones", daemon=True
+                )
+                self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            try:
+                self.volcar()
+            except Exception:
+                self.errores += 1
+                logger.exception("Error al volcar ubicaciones")
+            finally:
+                # El hilo no pasa por el ciclo de request de Django
+                close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def obtener_buffer():
+    """Buffer del proceso según TRIPS_BUFFER_UBICACIONES, o None si está apagado."""
+    global _buffer
+    config = getattr(settings, "TRIPS_BUFFER_UBICACIONES", None)
+    if not config:
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = BufferUbicaciones(**config)
+                atexit.register(_buffer.volcar)
+    return _buffer
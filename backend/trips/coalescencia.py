@@ -0,0 +1,63 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tipos de evento del channel layer en los que solo importa el último valor:
+# tipo -> campo del evento que identifica la clave. Los demás (asignaciones,
+# timeouts) se entregan todos y en orden.
+TIPOS_COALESCENTES = {
+    "driver_location": "driver_id",
+}
+
+
+class BuzonUltimoValor:
+    """
+    Entrega con coalescencia de los eventos de un consumer.
+
+    Guarda a lo sumo un evento pendiente por clave: si llega otro antes de
+    que el anterior salga, lo reemplaza en su lugar. Un cliente lento recibe
+    entonces la última posición y no una cola creciente de posiciones viejas,
+    y la memoria por conexión queda acotada por la cantidad de claves.
+
+    Args:
+        entregar: Corrutina que procesa cada evento (p. ej. el dispatch del
+            consumer, que termina en send_json)
+    """
+
+    def __init__(self, entregar):
+        self._entregar = entregar
+        self._pendientes = {}  # clave -> evento, en orden de llegada
+        self._tarea = None
+        self.reemplazados = 0
+
+    def __len__(self):
+        return len(self._pendientes)
+
+    def poner(self, clave, evento):
+        """Encolar `evento` o pisar el pendiente de la misma clave."""
+        if clave in self._pendientes:
+            self.reemplazados += 1
+        # Reasignar una clave existente conserva su posición en el dict
+        self._pendientes[clave] = evento
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.ensure_future(self._vaciar())
+
+    async def _vaciar(self):
+        while self._pendientes:
+            clave = next(iter(self._pendientes))
+            evento = self._pendientes.pop(clave)
+            try:
+                await self._entregar(evento)
+            except Exception:
+                logger.exception(f"Error al entregar evento {evento['type']}")
+
+    async def cerrar(self):
+        """Descartar lo pendiente y detener la entrega."""
+        self._pendientes.clear()
+        if self._tarea is not None and not self._tarea.done():
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
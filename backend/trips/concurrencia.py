@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+
+def crear_executor(hilos):
+    return ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="trips-db")
+
+
+@lru_cache(maxsize=None)
+def obtener_executor():
+    """Pool de hilos de TRIPS_HILOS_DB, o None para el hilo único de asgiref."""
+    hilos = getattr(settings, "TRIPS_HILOS_DB", 8)
+    return crear_executor(hilos) if hilos else None
+
+
+def en_hilo(funcion, executor=None):
+    """
+    Versión async de `funcion` que corre en el pool de hilos de base de datos.
+
+    `sync_to_async` usa por defecto `thread_sensitive=True`: todo el trabajo
+    síncrono del proceso pasa por un mismo hilo y una consulta lenta frena a
+    los demás sockets. Aquí cada llamada toma un hilo del pool y cada hilo
+    conserva su conexión entre llamadas (CONN_MAX_AGE), así que el pool acota
+    y reutiliza las conexiones abiertas. Antes de cada llamada se cierran las
+    vencidas o rotas, como al empezar un request.
+    """
+    executor = executor or obtener_executor()
+    if executor is None:
+        return database_sync_to_async(funcion)
+
+    @wraps(funcion)
+    def con_conexiones(*args, **kwargs):
+        close_old_connections()
+        return funcion(*args, **kwargs)
+
+    return sync_to_async(con_conexiones, thread_sensitive=False, executor=executor)
@@ -1,16 +1,51 @@
 import json
-import asyncio
 import logging
+import msgpack
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from asgiref.sync import sync_to_async
-from .models import Trip, DriverLocation
-from .services import asignar_conductor
-from channels.db import database_sync_to_async
+from django.conf import settings
+from . import estados, tramas
+from .coalescencia import TIPOS_COALESCENTES, BuzonUltimoValor
+from .concurrencia import en_hilo
+from .models import Trip
+from .despacho import obtener_despacho
+from .disponibilidad import obtener_disponibilidad
+from .geo import coordenadas
+from .historial import registrar_lote, validar_puntos
+from .metricas import obtener_metricas
+from .presencia import obtener_presencia
+from .reasignacion import (
+    OFERTA_ABIERTA,
+    aceptar_oferta_abierta,
+    asignar_siguiente,
+    modo_oferta,
+    ofrecer_siguiente,
+    rechazar_oferta_abierta,
+)
+from .temporizadores import (
+    notificar_oferta_abierta,
+    notificar_reasignacion,
+    obtener_temporizadores,
+    retirar_oferta,
+)
+from .ubicaciones import obtener_almacen
 
 logger = logging.getLogger(__name__)
 
+# Subprotocolo WebSocket para tramas binarias MessagePack
+SUBPROTOCOLO_MSGPACK = "msgpack"
+
 
 class TripConsumer(AsyncJsonWebsocketConsumer):
+    # Subprotocolo negociado en connect; None es JSON en tramas de texto
+    subprotocolo = None
+    # Viaje aceptado por el conductor y pasajero que sigue su posición
+    viaje_en_curso = None
+    pasajero_en_curso = None
+    # Eventos pendientes de los TIPOS_COALESCENTES (ver dispatch)
+    buzon = None
+    # Rol contado en las conexiones abiertas de trips.metricas
+    rol_conectado = None
+
     async def connect(self):
         user = self.scope["user"]
         logger.info(f"Intento de conexión de usuario: {user}")
@@ -33,16 +68,22 @@ class TripConsumer(AsyncJsonWebsocketConsumer):
         if user.rol == "Conductor":
             self.group_name = f"drivers_{user.id}"  # Cambiado de drivers_ a driver_
             await self.channel_layer.group_add(self.group_name, self.channel_name)
-            await self.channel_layer.group_add("drivers", self.channel_name)
-            logger.info(
-                f"Conductor {user.id} añadido a los grupos '{self.group_name}' y 'drivers'"
-            )
-            await self.accept()
+            logger.info(f"Conductor {user.id} añadido al grupo '{self.group_name}'")
+            await en_hilo(obtener_disponibilidad().conectar)(user.id)
+            await en_hilo(obtener_presencia().latido)(user.id)
+            # Retomar los timeouts pendientes si el proceso se reinició
+            obtener_temporizadores().iniciar()
+            await self.accept(self.negociar_subprotocolo())
+            self.rol_conectado = user.rol
+            obtener_metricas().conexion(user.rol, 1)
             return
         elif user.rol == "Pasajero":
             self.group_name = f"passenger_{user.id}"
+            await self.channel_layer.group_add(self.group_name, self.channel_name)
             logger.info(f"Pasajero {user.id} conectado")
-            await self.accept()
+            await self.accept(self.negociar_subprotocolo())
+            self.rol_conectado = user.rol
+            obtener_metricas().conexion(user.rol, 1)
             return
 
         logger.warning(f"Rechazando conexión - Rol no válido: {user.rol}")
@@ -56,14 +97,75 @@ class TripConsumer(AsyncJsonWebsocketConsumer):
             await self.channel_layer.group_discard(
                 f"drivers_{user.id}", self.channel_name
             )
-            await self.channel_layer.group_discard("drivers", self.channel_name)
+            await en_hilo(obtener_disponibilidad().desconectar)(user.id)
+        elif user.is_authenticated and user.rol == "Pasajero":
+            await self.channel_layer.group_discard(
+                f"passenger_{user.id}", self.channel_name
+            )
+
+        if self.buzon is not None:
+            await self.buzon.cerrar()
+        if self.rol_conectado is not None:
+            obtener_metricas().conexion(self.rol_conectado, -1)
+            self.rol_conectado = None
+
+    async def dispatch(self, message):
+        # Las posiciones no hacen cola: si el cliente va lento, cada una pisa
+        # la pendiente de la misma clave. El resto se entrega en orden.
+        campo = TIPOS_COALESCENTES.get(message["type"])
+        if campo is None:
+            await super().dispatch(message)
+            return
+        if self.buzon is None:
+            self.buzon = BuzonUltimoValor(super().dispatch)
+        self.buzon.poner((message["type"], message[campo]), message)
+
+    def negociar_subprotocolo(self):
+        """Usar MessagePack si el cliente lo ofrece; si no, JSON como antes."""
+        if SUBPROTOCOLO_MSGPACK in self.scope.get("subprotocols", []):
+            self.subprotocolo = SUBPROTOCOLO_MSGPACK
+        return self.subprotocolo
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        # Las tramas binarias son MessagePack; las de texto siguen siendo JSON
+        if bytes_data is not None:
+            await self.receive_json(msgpack.unpackb(bytes_data), **kwargs)
+        else:
+            await super().receive(text_data, bytes_data, **kwargs)
+
+    async def send_json(self, content, close=False):
+        if self.subprotocolo == SUBPROTOCOLO_MSGPACK:
+            await self.send(bytes_data=msgpack.packb(content), close=close)
+        else:
+            await super().send_json(content, close)
+
+    async def enviar_tramas(self, event):
+        """
+        Reenviar al cliente las tramas que el evento ya trae codificadas (ver
+        trips.tramas). Devuelve False si el evento no las trae.
+        """
+        tramas_evento = event.get("tramas")
+        if tramas_evento is None:
+            return False
+        if self.subprotocolo == SUBPROTOCOLO_MSGPACK:
+            await self.send(bytes_data=tramas_evento["msgpack"])
+        else:
+            await self.send(text_data=tramas_evento["json"])
+        return True
 
     async def receive_json(self, content):
         action = content.get("action")
+        with obtener_metricas().medir(action):
+            await self.atender_accion(action, content)
 
+    async def atender_accion(self, action, content):
         # Manejo de acciones recibidas
         if action == "update_location":
             await self.update_driver_location(content)
+        elif action == "update_location_batch":
+            await self.update_driver_location_batch(content)
+        elif action == "heartbeat":
+            await self.heartbeat(content)
         elif action == "create_trip":
             await self.create_trip(content)
         elif action == "accept_trip":
@@ -72,19 +174,75 @@ class TripConsumer(AsyncJsonWebsocketConsumer):
             await self.reject_trip(content)
         elif action == "notify_trip_assigned":
             await self.notify_trip_assigned(content)
+        elif action == "complete_trip":
+            await self.complete_trip(content)
+        elif action == "cancel_trip":
+            await self.cancel_trip(content)
 
     async def update_driver_location(self, content):
         """Actualizar la ubicación del conductor."""
-        lat = content.get("lat")
-        lon = content.get("lon")
         user = self.scope["user"]
 
         if user.is_authenticated and user.rol == "Conductor":
-            await sync_to_async(DriverLocation.objects.update_or_create)(
-                conductor=user, defaults={"latitud": lat, "longitud": lon}
-            )
+            # Validar una vez antes del almacén y la presencia
+            try:
+                lat, lon = coordenadas(content.get("lat"), content.get("lon"))
+            except ValueError:
+                await self.send_json({"error": "Ubicación inválida"})
+                return
+            await en_hilo(obtener_almacen().guardar)(user.id, lat, lon)
+            await en_hilo(obtener_presencia().latido)(user.id, lat, lon)
+            await self.avisar_pasajero(lat, lon)
             await self.send_json({"status": "location_updated"})
 
+    async def update_driver_location_batch(self, content):
+        """Registrar un lote de puntos del conductor con un solo acuse."""
+        user = self.scope["user"]
+
+        if user.is_authenticated and user.rol == "Conductor":
+            puntos = validar_puntos(content.get("points"))
+            if not puntos:
+                await self.send_json({"error": "Lote de ubicaciones vacío o inválido"})
+                return
+            registrados = await en_hilo(registrar_lote)(user.id, puntos)
+            _, lat, lon = puntos[-1]
+            await en_hilo(obtener_presencia().latido)(user.id, lat, lon)
+            await self.avisar_pasajero(lat, lon)
+            await self.send_json(
+                {"status": "location_batch_updated", "count": registrados}
+            )
+
+    async def heartbeat(self, content):
+        """
+        Latido del cliente: el conductor sigue ahí aunque no se mueva. Debe
+        llegar más seguido que TRIPS_PRESENCIA_FRESCURA_SEGUNDOS.
+        """
+        user = self.scope["user"]
+
+        if user.is_authenticated and user.rol == "Conductor":
+            await en_hilo(obtener_presencia().latido)(user.id)
+        await self.send_json({"type": "heartbeat"})
+
+    async def avisar_pasajero(self, lat, lon):
+        """Enviar la posición al pasajero del viaje aceptado, si hay uno."""
+        if self.pasajero_en_curso is None:
+            return
+        driver_id = self.scope["user"].id
+        await self.channel_layer.group_send(
+            f"passenger_{self.pasajero_en_curso}",
+            tramas.evento(
+                "driver_location",
+                {
+                    "type": "driver_location",
+                    "driver_id": driver_id,
+                    "trip_id": self.viaje_en_curso,
+                    "lat": lat,
+                    "lon": lon,
+                },
+                driver_id=driver_id,
+            ),
+        )
+
     async def create_trip(self, content):
         """Crear un viaje y asignarlo a un conductor."""
         user = self.scope["user"]
@@ -92,14 +250,20 @@ class TripConsumer(AsyncJsonWebsocketConsumer):
 
         if user.is_authenticated and user.rol == "Pasajero":
             try:
-                trip = await sync_to_async(Trip.objects.create)(
+                trip = await Trip.objects.acreate(
                     cliente=user,
                     origen=content.get("origen"),
                     destino=content.get("destino"),
                     estado="pendiente",
                 )
                 logger.info(f"Viaje creado con ID: {trip.id}")
-                await self.assign_trip(trip)
+
+                modo = getattr(settings, "TRIPS_MODO_DESPACHO", "inmediato")
+                if modo == "lote" and modo_oferta() == "individual":
+                    # El motor asigna todos los viajes de la ventana juntos
+                    obtener_despacho().encolar(trip, self)
+                else:
+                    await self.assign_trip(trip)
             except Exception as e:
                 logger.error(f"Error al crear viaje: {str(e)}")
                 await self.send_json({"error": "Error al crear viaje"})
@@ -107,47 +271,22 @@ class TripConsumer(AsyncJsonWebsocketConsumer):
     async def assign_trip(self, trip):
         """Asignar el conductor más cercano a un viaje."""
         try:
-            conductor_asignado = await sync_to_async(asignar_conductor)(trip)
+            if modo_oferta() == "abierta":
+                # Ofrecerlo a los k más cercanos a la vez; el primero gana
+                conductores = await en_hilo(ofrecer_siguiente)(trip)
+                await notificar_oferta_abierta(trip, conductores)
+                return
+
+            # Solo asigna si el viaje sigue pendiente (ver trips.reasignacion)
+            conductor_asignado = await en_hilo(asignar_siguiente)(trip)
             logger.info(f"Conductor seleccionado: {conductor_asignado}")
 
             if conductor_asignado:
-                # Actualizar el viaje
-                trip.conductor_asignado = conductor_asignado
-                trip.estado = "asignado"
-                await sync_to_async(trip.save)()
                 logger.info(
                     f"Viaje {trip.id} actualizado con conductor {conductor_asignado.id}"
                 )
-
-                # Preparar mensaje de notificación
-                message = {
-                    "type": "notify_trip_assigned",
-                    "trip_id": str(trip.id),
-                    "origen": trip.origen,
-                    "destino": trip.destino,
-                }
-                logger.info(
-                    f"Enviando mensaje a grupo drivers_{conductor_asignado.id}: {message}"
-                )
-
-                # Enviar notificación al conductor
-                try:
-                    await self.channel_layer.group_send(
-                        f"drivers_{conductor_asignado.id}", message
-                    )
-                    logger.info("Mensaje enviado exitosamente al grupo del conductor")
-
-                    # Iniciar el temporizador de timeout
-                    asyncio.create_task(self.check_trip_response_timeout(trip))
-
-                except Exception as e:
-                    logger.error(f"Error al enviar mensaje al grupo: {str(e)}")
-
-                # Notificar al pasajero
-                await self.send_json(
-                    {"status": "trip_assigned", "driver_id": conductor_asignado.id}
-                )
-            else:
+                await self.notificar_asignacion(trip, conductor_asignado)
+            elif trip.estado == "cancelado":
                 logger.warning("No hay conductores disponibles")
                 await self.send_json({"status": "no_drivers_available"})
 
@@ -155,6 +294,32 @@ class TripConsumer(AsyncJsonWebsocketConsumer):
             logger.error(f"Error en assign_trip: {str(e)}")
             await self.send_json({"error": "Error al asignar conductor"})
 
+    async def notificar_asignacion(self, trip, conductor_asignado):
+        """Avisar al conductor y al pasajero de un viaje ya asignado."""
+        # Preparar mensaje de notificación, ya codificado para el cliente
+        message = tramas.evento_oferta(trip)
+        logger.info(
+            f"Enviando mensaje a grupo drivers_{conductor_asignado.id}: {message}"
+        )
+
+        # Enviar notificación al conductor
+        try:
+            await self.channel_layer.group_send(
+                f"drivers_{conductor_asignado.id}", message
+            )
+            logger.info("Mensaje enviado exitosamente al grupo del conductor")
+
+            # Programar el timeout de la oferta
+            await obtener_temporizadores().programar(trip.id, conductor_asignado.id)
+
+        except Exception as e:
+            logger.error(f"Error al enviar mensaje al grupo: {str(e)}")
+
+        # Notificar al pasajero
+        await self.send_json(
+            {"status": "trip_assigned", "driver_id": conductor_asignado.id}
+        )
+
     # async def assign_trip(self, trip):
     #     """Asignar el conductor más cercano a un viaje."""
     #     try:
@@ -206,6 +371,8 @@ class TripConsumer(AsyncJsonWebsocketConsumer):
         """Manejador para notificar al conductor sobre un viaje asignado."""
         logger.info(f"Ejecutando notify_trip_assigned con evento: {event}")
         try:
+            if await self.enviar_tramas(event):
+                return
             await self.send_json(
                 {
                     "type": "trip_assigned",
@@ -224,15 +391,40 @@ class TripConsumer(AsyncJsonWebsocketConsumer):
         user = self.scope["user"]
 
         if user.is_authenticated and user.rol == "Conductor":
-            try:
-                trip = await sync_to_async(Trip.objects.get)(id=trip_id)
-                if trip.conductor_asignado == user and trip.estado == "asignado":
-                    trip.estado = "aceptado"  # Cambiado de 'pendiente' a 'aceptado'
-                    await sync_to_async(trip.save)()
-                    logger.info(f"Viaje {trip_id} aceptado por conductor {user.id}")
-                    await self.send_json({"status": "trip_accepted"})
-            except Trip.DoesNotExist:
-                logger.error(f"Viaje {trip_id} no encontrado")
+            # Falla si el viaje ya no le pertenece (p. ej. venció la oferta)
+            if await en_hilo(estados.aceptar)(trip_id, user.id):
+                await obtener_temporizadores().cancelar(trip_id, user.id)
+                otros = None
+            else:
+                # Oferta abierta: gana el primero, a los demás se les retira
+                otros = await en_hilo(aceptar_oferta_abierta)(trip_id, user.id)
+                if otros is None:
+                    logger.warning(f"Viaje {trip_id} no disponible para {user.id}")
+                    return
+                await obtener_temporizadores().cancelar(trip_id, OFERTA_ABIERTA)
+
+            logger.info(f"Viaje {trip_id} aceptado por conductor {user.id}")
+            self.viaje_en_curso = str(trip_id)
+            self.pasajero_en_curso = (
+                await Trip.objects.filter(id=trip_id)
+                .values_list("cliente_id", flat=True)
+                .afirst()
+            )
+            await self.send_json({"status": "trip_accepted"})
+
+            if otros is not None:
+                await retirar_oferta(trip_id, otros)
+                await self.channel_layer.group_send(
+                    f"passenger_{self.pasajero_en_curso}",
+                    tramas.evento(
+                        "trip_status",
+                        {
+                            "status": "trip_assigned",
+                            "driver_id": user.id,
+                            "trip_id": str(trip_id),
+                        },
+                    ),
+                )
 
     async def reject_trip(self, content):
         """El conductor rechaza el viaje."""
@@ -240,17 +432,65 @@ class TripConsumer(AsyncJsonWebsocketConsumer):
         user = self.scope["user"]
 
         if user.is_authenticated and user.rol == "Conductor":
-            trip = await sync_to_async(Trip.objects.get)(id=trip_id)
-            if trip.conductor_asignado == user and trip.estado == "asignado":
-                trip.conductor_asignado = None
-                trip.estado = "pendiente"
-                await sync_to_async(trip.save)()
+            if await en_hilo(estados.rechazar)(trip_id, user.id):
+                await obtener_temporizadores().cancelar(trip_id, user.id)
+                await en_hilo(obtener_disponibilidad().liberar)(user.id)
+
+                # Reasignar el viaje a otro conductor y avisar al pasajero
+                trip = await Trip.objects.aget(id=trip_id)
+                conductor_asignado = await en_hilo(asignar_siguiente)(trip)
+                await notificar_reasignacion(trip, conductor_asignado)
+            elif await en_hilo(rechazar_oferta_abierta)(trip_id, user.id):
+                # Todos los ofertados la rechazaron: abrir la siguiente
+                await obtener_temporizadores().cancelar(trip_id, OFERTA_ABIERTA)
+                trip = await Trip.objects.aget(id=trip_id)
+                conductores = await en_hilo(ofrecer_siguiente)(trip)
+                await notificar_oferta_abierta(trip, conductores)
+
+    async def complete_trip(self, content):
+        """El conductor termina el viaje que aceptó."""
+        trip_id = content.get("trip_id")
+        user = self.scope["user"]
+
+        if user.is_authenticated and user.rol == "Conductor":
+            # Queda libre y su consumer recibe trip_finished (ver trips.estados)
+            if not await en_hilo(estados.completar)(trip_id, user.id):
+                logger.warning(f"Viaje {trip_id} no está en curso para {user.id}")
+                await self.send_json({"error": "Viaje no disponible"})
+                return
+
+            logger.info(f"Viaje {trip_id} completado por conductor {user.id}")
+            cliente_id = (
+                await Trip.objects.filter(id=trip_id)
+                .values_list("cliente_id", flat=True)
+                .afirst()
+            )
+            await self.channel_layer.group_send(
+                f"passenger_{cliente_id}",
+                tramas.evento(
+                    "trip_status",
+                    {"status": "trip_completed", "trip_id": str(trip_id)},
+                ),
+            )
+
+    async def cancel_trip(self, content):
+        """El pasajero cancela su viaje, en el estado que esté."""
+        trip_id = content.get("trip_id")
+        user = self.scope["user"]
+
+        if user.is_authenticated and user.rol == "Pasajero":
+            # Si tenía conductor, trips.estados lo libera y le avisa
+            if not await en_hilo(estados.cancelar)(trip_id, cliente_id=user.id):
+                await self.send_json({"error": "Viaje no disponible"})
+                return
 
-                # Reasignar el viaje a otro conductor
-                await self.assign_trip(trip)
+            logger.info(f"Viaje {trip_id} cancelado por pasajero {user.id}")
+            await self.send_json({"status": "trip_cancelled", "trip_id": str(trip_id)})
 
     async def trip_assigned(self, event):
         """Notificar a los conductores sobre un viaje asignado."""
+        if await self.enviar_tramas(event):
+            return
         await self.send_json(
             {
                 "type": "trip_assigned",
@@ -260,68 +500,10 @@ class TripConsumer(AsyncJsonWebsocketConsumer):
             }
         )
 
-    async def check_trip_response_timeout(self, trip):
-        """Verificar si el conductor responde en el tiempo límite."""
-        logger.info(f"Iniciando temporizador de timeout para viaje {trip.id}")
-        try:
-            await asyncio.sleep(30)  # Esperar 30 segundos
-
-            # Recargar el viaje desde la base de datos usando select_related
-            trip = await database_sync_to_async(
-                lambda: Trip.objects.select_related("conductor_asignado").get(
-                    id=trip.id
-                )
-            )()
-            logger.info(f"Verificando estado del viaje {trip.id} después de timeout")
-
-            if trip.estado == "asignado":
-                logger.info(f"Timeout alcanzado para viaje {trip.id}. Reasignando...")
-
-                # Guardar referencia al conductor anterior
-                conductor_anterior = trip.conductor_asignado
-
-                # Resetear el viaje
-                trip.conductor_asignado = None
-                trip.estado = "pendiente"
-                await database_sync_to_async(trip.save)()
-
-                # Notificar al conductor anterior que perdió el viaje
-                if conductor_anterior:
-                    await self.channel_layer.group_send(
-                        f"drivers_{conductor_anterior.id}",
-                        {"type": "notify_trip_timeout", "trip_id": str(trip.id)},
-                    )
-
-                # Intentar reasignar el viaje excluyendo al conductor anterior
-                logger.info("Intentando reasignar el viaje...")
-                conductor_asignado = await database_sync_to_async(
-                    lambda: asignar_conductor(
-                        trip, excluir_conductor=conductor_anterior
-                    )
-                )()
-
-                if conductor_asignado:
-                    trip.conductor_asignado = conductor_asignado
-                    trip.estado = "asignado"
-                    await database_sync_to_async(trip.save)()
-
-                    # Enviar notificación al nuevo conductor
-                    await self.channel_layer.group_send(
-                        f"drivers_{conductor_asignado.id}",
-                        {
-                            "type": "notify_trip_assigned",
-                            "trip_id": str(trip.id),
-                            "origen": trip.origen,
-                            "destino": trip.destino,
-                        },
-                    )
-
-        except Exception as e:
-            logger.error(f"Error en check_trip_response_timeout: {str(e)}")
-            logger.exception("Traceback completo:")
-
     async def notify_trip_timeout(self, event):
         """Notificar al conductor que perdió el viaje por timeout."""
+        if await self.enviar_tramas(event):
+            return
         await self.send_json(
             {
                 "type": "trip_timeout",
@@ -329,3 +511,32 @@ class TripConsumer(AsyncJsonWebsocketConsumer):
                 "message": "Viaje reasignado por falta de respuesta",
             }
         )
+
+    async def driver_location(self, event):
+        """Posición del conductor del viaje, para el pasajero (coalescente)."""
+        if await self.enviar_tramas(event):
+            return
+        await self.send_json(
+            {
+                "type": "driver_location",
+                "driver_id": event["driver_id"],
+                "trip_id": event["trip_id"],
+                "lat": event["lat"],
+                "lon": event["lon"],
+            }
+        )
+
+    async def trip_finished(self, event):
+        """El viaje en curso terminó: dejar de enviar la posición al pasajero."""
+        if event["trip_id"] == self.viaje_en_curso:
+            self.viaje_en_curso = None
+            self.pasajero_en_curso = None
+        await self.send_json({"type": "trip_finished", "trip_id": event["trip_id"]})
+
+    async def trip_status(self, event):
+        """Novedades del viaje para el pasajero (reasignado, sin conductores)."""
+        await self.enviar_tramas(event)
+
+    async def notify_trip_withdrawn(self, event):
+        """Retirar una oferta abierta que tomó otro conductor o se venció."""
+        await self.enviar_tramas(event)
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+from django.conf import settings
+from . import estados
+from .concurrencia import en_hilo
+from .disponibilidad import obtener_disponibilidad
+from .models import Trip
+from .reasignacion import sin_conductores, radios_busqueda
+from .services import candidatos_conductor
+
+logger = logging.getLogger(__name__)
+
+# Costo de los pares viaje-conductor no permitidos (el conductor no está entre
+# los candidatos del viaje). Es mayor que cualquier suma de distancias reales,
+# así el algoritmo siempre prefiere asignar más viajes.
+PROHIBIDO = 1e9
+
+
+def hungaro(costos):
+    """
+    Asignación de costo mínimo (algoritmo húngaro, O(n²·m)).
+
+    Args:
+        costos: Matriz (lista de listas) de n filas por m columnas
+
+    Returns:
+        list: Pares (fila, columna); cada fila y columna aparece a lo sumo una vez
+    """
+    if not costos or not costos[0]:
+        return []
+
+    transpuesta = len(costos) > len(costos[0])
+    if transpuesta:
+        costos = [list(columna) for columna in zip(*costos)]
+    n, m = len(costos), len(costos[0])
+
+    infinito = float("inf")
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)  # p[j]: fila asignada a la columna j (1-indexado)
+    camino = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [infinito] * (m + 1)
+        usada = [False] * (m + 1)
+        while True:
+            usada[j0] = True
+            i0 = p[j0]
+            delta = infinito
+            j1 = 0
+            fila = costos[i0 - 1]
+            for j in range(1, m + 1):
+                if not usada[j]:
+                    actual = fila[j - 1] - u[i0] - v[j]
+                    if actual < minv[j]:
+                        minv[j] = actual
+                        camino[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if usada[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = camino[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    pares = [(p[j] - 1, j - 1) for j in range(1, m + 1) if p[j]]
+    if transpuesta:
+        pares = [(columna, fila) for fila, columna in pares]
+    return sorted(pares)
+
+
+def asignar_lote(trip_ids, k=5):
+    """
+    Asignar conductores a un lote de viajes pendientes minimizando la suma de
+    distancias de recogida.
+
+    Cada viaje busca con la misma política que `asignar_siguiente`: sin los
+    conductores que ya lo rechazaron, con el radio de su intento y hasta
+    TRIPS_MAX_INTENTOS_ASIGNACION intentos.
+
+    Returns:
+        tuple: (asignaciones, sin_candidatos, en_espera). asignaciones son
+        pares (trip, conductor) ya guardados, sin_candidatos los viajes
+        cancelados por no tener ningún conductor cerca o agotar sus intentos
+        y en_espera los que perdieron a sus candidatos frente a otros viajes
+        del lote y deben reintentarse.
+    """
+    trips = list(Trip.objects.filter(id__in=trip_ids, estado="pendiente"))
+    if not trips:
+        return [], [], []
+
+    maximo = getattr(settings, "TRIPS_MAX_INTENTOS_ASIGNACION", 5)
+    candidatos = {}
+    for trip in trips:
+        candidatos[trip.id] = []
+        if trip.intentos_asignacion >= maximo:
+            logger.warning(f"Viaje {trip.id} agotó sus {maximo} intentos de asignación")
+            continue
+        for radio_km in radios_busqueda(trip.intentos_asignacion):
+            candidatos[trip.id] = candidatos_conductor(
+                trip, k=k, excluir=trip.conductores_excluidos, radio_km=radio_km
+            )
+            if candidatos[trip.id]:
+                break
+
+    conductores = {
+        conductor.id: conductor
+        for lista in candidatos.values()
+        for _, conductor in lista
+    }
+    columnas = list(conductores)
+    columna_de = {conductor_id: j for j, conductor_id in enumerate(columnas)}
+
+    costos = [[PROHIBIDO] * len(columnas) for _ in trips]
+    for i, trip in enumerate(trips):
+        for distancia, conductor in candidatos[trip.id]:
+            costos[i][columna_de[conductor.id]] = distancia
+
+    disponibilidad = obtener_disponibilidad()
+    asignaciones = []
+    elegidos = set()
+    for i, j in hungaro(costos):
+        if costos[i][j] >= PROHIBIDO:
+            continue
+        trip, conductor = trips[i], conductores[columnas[j]]
+
+        # Si otro despacho reservó al conductor, el viaje vuelve a la cola
+        if not disponibilidad.ocupar(conductor.id):
+            continue
+        elegidos.add(trip.id)
+
+        # Solo si el viaje sigue pendiente (otro proceso pudo tomarlo)
+        if estados.asignar(trip.id, conductor.id):
+            trip.conductor_asignado = conductor
+            trip.estado = "asignado"
+            trip.intentos_asignacion += 1
+            asignaciones.append((trip, conductor))
+        else:
+            disponibilidad.liberar(conductor.id)
+
+    # Se cancelan como en `asignar_siguiente` (si siguen pendientes)
+    sin_candidatos = []
+    for trip in trips:
+        if not candidatos[trip.id]:
+            sin_conductores(trip)
+            if trip.estado == "cancelado":
+                sin_candidatos.append(trip)
+    en_espera = [
+        trip for trip in trips if candidatos[trip.id] and trip.id not in elegidos
+    ]
+    logger.info(
+        f"Lote de {len(trips)} viajes: {len(asignaciones)} asignados, "
+        f"{len(sin_candidatos)} sin conductores, {len(en_espera)} en espera"
+    )
+    return asignaciones, sin_candidatos, en_espera
+
+
+class DespachoPorLotes:
+    """
+    Acumula los viajes creados durante una ventana corta y los asigna juntos
+    con `asignar_lote`. Cada viaje recuerda el consumer del pasajero que lo
+    creó, que es quien notifica al conductor y al pasajero.
+    """
+
+    def __init__(self, ventana_ms=1000, candidatos_por_viaje=5):
+        self.ventana = ventana_ms / 1000
+        self.candidatos_por_viaje = candidatos_por_viaje
+        self._cola = {}  # trip_id -> consumer del pasajero
+        self._tarea = None
+
+    def encolar(self, trip, consumer):
+        self._cola[trip.id] = consumer
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def _bucle(self):
+        while self._cola:
+            await asyncio.sleep(self.ventana)
+            lote, self._cola = self._cola, {}
+            await self._despachar(lote)
+
+    async def _despachar(self, lote):
+        try:
+            asignaciones, sin_candidatos, en_espera = await en_hilo(asignar_lote)(
+                list(lote), self.candidatos_por_viaje
+            )
+        except Exception as e:
+            logger.error(f"Error en despacho por lotes: {str(e)}")
+            await asyncio.gather(
+                *(
+                    consumer.send_json({"error": "Error al asignar conductor"})
+                    for consumer in lote.values()
+                ),
+                return_exceptions=True,
+            )
+            return
+
+        # Notificaciones del lote en paralelo
+        await asyncio.gather(
+            *(
+                lote[trip.id].notificar_asignacion(trip, conductor)
+                for trip, conductor in asignaciones
+            ),
+            *(
+                lote[trip.id].send_json({"status": "no_drivers_available"})
+                for trip in sin_candidatos
+            ),
+            return_exceptions=True,
+        )
+
+        # Los que compitieron por los mismos conductores vuelven a la cola
+        for trip in en_espera:
+            self._cola.setdefault(trip.id, lote[trip.id])
+
+
+_motores = {}
+
+
+def obtener_despacho():
+    """Motor de despacho por lotes del event loop actual."""
+    loop = asyncio.get_running_loop()
+    motor = _motores.get(loop)
+    if motor is None:
+        # Descartar motores de loops ya cerrados
+        for anterior in [otro for otro in _motores if otro.is_closed()]:
+            del _motores[anterior]
+        motor = _motores[loop] = DespachoPorLotes(
+            getattr(settings, "TRIPS_VENTANA_DESPACHO_MS", 1000),
+            getattr(settings, "TRIPS_CANDIDATOS_POR_VIAJE", 5),
+        )
+    return motor
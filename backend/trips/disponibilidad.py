@@ -0,0 +1,178 @@
+import threading
+from collections import Counter
+from functools import lru_cache
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .models import Trip
+
+# Estados en los que un viaje mantiene ocupado a su conductor
+ESTADOS_OCUPADO = ("asignado", "aceptado")
+
+
+def conductor_ocupado(conductor_id):
+    """Si el conductor tiene un viaje asignado o aceptado en la base."""
+    return Trip.objects.filter(
+        conductor_asignado_id=conductor_id, estado__in=ESTADOS_OCUPADO
+    ).exists()
+
+
+class Disponibilidad:
+    """
+    Conjunto de conductores conectados y libres.
+
+    TripConsumer lo mantiene al conectar/desconectar y en cada transición de
+    viaje; el despacho solo busca entre `disponibles()`. El backend activo se
+    elige con `TRIPS_DISPONIBILIDAD`.
+    """
+
+    def conectar(self, conductor_id):
+        """Registrar una conexión; queda libre si no tiene viajes en curso."""
+        raise NotImplementedError
+
+    def desconectar(self, conductor_id):
+        raise NotImplementedError
+
+    def ocupar(self, conductor_id):
+        """Marcar ocupado. Devuelve True si estaba disponible (reserva)."""
+        raise NotImplementedError
+
+    def liberar(self, conductor_id):
+        """Marcar libre; vuelve a estar disponible si sigue conectado."""
+        raise NotImplementedError
+
+    def disponibles(self):
+        """Conjunto de ids de conductores conectados y libres."""
+        raise NotImplementedError
+
+    def disponibles_entre(self, ids):
+        """Los de `ids` que están conectados y libres, sin leer todo el registro."""
+        raise NotImplementedError
+
+
+class DisponibilidadMemoria(Disponibilidad):
+    """Registro del proceso; sirve cuando hay un solo worker ASGI."""
+
+    def __init__(self):
+        self._conexiones = Counter()  # un conductor puede abrir varios sockets
+        self._ocupados = set()
+        self._disponibles = set()
+        self._lock = threading.Lock()
+
+    def conectar(self, conductor_id):
+        ocupado = conductor_ocupado(conductor_id)
+        with self._lock:
+            self._conexiones[conductor_id] += 1
+            if ocupado:
+                self._ocupados.add(conductor_id)
+                self._disponibles.discard(conductor_id)
+            elif conductor_id not in self._ocupados:
+                self._disponibles.add(conductor_id)
+
+    def desconectar(self, conductor_id):
+        with self._lock:
+            self._conexiones[conductor_id] -= 1
+            if self._conexiones[conductor_id] <= 0:
+                del self._conexiones[conductor_id]
+                self._disponibles.discard(conductor_id)
+
+    def ocupar(self, conductor_id):
+        with self._lock:
+            estaba_disponible = conductor_id in self._disponibles
+            self._disponibles.discard(conductor_id)
+            self._ocupados.add(conductor_id)
+            return estaba_disponible
+
+    def liberar(self, conductor_id):
+        with self._lock:
+            self._ocupados.discard(conductor_id)
+            if conductor_id in self._conexiones:
+                self._disponibles.add(conductor_id)
+
+    def disponibles(self):
+        with self._lock:
+            return set(self._disponibles)
+
+    def disponibles_entre(self, ids):
+        with self._lock:
+            return {
+                conductor_id
+                for conductor_id in ids
+                if conductor_id in self._disponibles
+            }
+
+
+class DisponibilidadRedis(Disponibilidad):
+    """
+    Registro compartido por todos los workers en el Redis de CHANNEL_LAYERS.
+    Las transiciones que leen y escriben varias claves usan scripts Lua para
+    ser atómicas.
+    """
+
+    CONECTAR = """
+        redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+        if ARGV[2] == '1' then
+            redis.call('SADD', KEYS[2], ARGV[1])
+            redis.call('SREM', KEYS[3], ARGV[1])
+        elseif redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 0 then
+            redis.call('SADD', KEYS[3], ARGV[1])
+        end
+    """
+    DESCONECTAR = """
+        if redis.call('HINCRBY', KEYS[1], ARGV[1], -1) <= 0 then
+            redis.call('HDEL', KEYS[1], ARGV[1])
+            redis.call('SREM', KEYS[3], ARGV[1])
+        end
+    """
+    LIBERAR = """
+        redis.call('SREM', KEYS[2], ARGV[1])
+        if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 1 then
+            redis.call('SADD', KEYS[3], ARGV[1])
+        end
+    """
+
+    def __init__(self, url=None, prefijo="trips:disponibilidad"):
+        self.redis = redis.Redis.from_url(url or settings.TRIPS_REDIS_URL)
+        self.claves = [
+            f"{prefijo}:conexiones",
+            f"{prefijo}:ocupados",
+            f"{prefijo}:disponibles",
+        ]
+        self._conectar = self.redis.register_script(self.CONECTAR)
+        self._desconectar = self.redis.register_script(self.DESCONECTAR)
+        self._liberar = self.redis.register_script(self.LIBERAR)
+
+    def conectar(self, conductor_id):
+        ocupado = "1" if conductor_ocupado(conductor_id) else "0"
+        self._conectar(keys=self.claves, args=[conductor_id, ocupado])
+
+    def desconectar(self, conductor_id):
+        self._desconectar(keys=self.claves, args=[conductor_id])
+
+    def ocupar(self, conductor_id):
+        pipe = self.redis.pipeline()
+        pipe.sadd(self.claves[1], conductor_id)
+        pipe.srem(self.claves[2], conductor_id)
+        return bool(pipe.execute()[1])
+
+    def liberar(self, conductor_id):
+        self._liberar(keys=self.claves, args=[conductor_id])
+
+    def disponibles(self):
+        return {int(miembro) for miembro in self.redis.smembers(self.claves[2])}
+
+    def disponibles_entre(self, ids):
+        ids = list(ids)
+        if not ids:
+            return set()
+        libres = self.redis.smismember(self.claves[2], ids)
+        return {conductor_id for conductor_id, libre in zip(ids, libres) if libre}
+
+
+@lru_cache(maxsize=None)
+def obtener_disponibilidad():
+    """Instancia del registro configurado en TRIPS_DISPONIBILIDAD."""
+    ruta = getattr(
+        settings, "TRIPS_DISPONIBILIDAD", "trips.disponibilidad.DisponibilidadRedis"
+    )
+    return import_string(ruta)()
@@ -0,0 +1,199 @@
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db.models import F, Func, JSONField, Value
+from .disponibilidad import obtener_disponibilidad
+from .models import Trip
+
+logger = logging.getLogger(__name__)
+
+# Transiciones permitidas: estado actual -> estados siguientes
+TRANSICIONES = {
+    # pendiente -> aceptado: oferta abierta a varios conductores
+    "pendiente": {"asignado", "aceptado", "cancelado"},
+    "asignado": {"aceptado", "pendiente", "cancelado"},
+    "aceptado": {"completado", "cancelado"},
+    "completado": set(),
+    "cancelado": set(),
+}
+
+
+class AgregarAJSON(Func):
+    """Agregar elementos a una lista JSON en el mismo UPDATE (jsonb ||)."""
+
+    arg_joiner = " || "
+    template = "(%(expressions)s)"
+    output_field = JSONField()
+
+    def __init__(self, campo, *elementos):
+        super().__init__(F(campo), Value(list(elementos), output_field=JSONField()))
+
+
+def transicion(trip_id, desde, hacia, conductor_id=None, **cambios):
+    """
+    Cambiar el estado de un viaje con un único UPDATE condicional.
+
+    El UPDATE solo afecta la fila si el viaje sigue en `desde` (y asignado a
+    `conductor_id`, si se indica), así dos workers que compiten por el mismo
+    viaje no pueden pisarse: solo uno ve la transición aplicada.
+
+    Args:
+        trip_id: Id del viaje
+        desde: Estado actual esperado
+        hacia: Estado nuevo; debe estar permitido en TRANSICIONES
+        conductor_id: Conductor asignado esperado
+        **cambios: Otros campos a escribir en el mismo UPDATE
+
+    Returns:
+        bool: True si la transición se aplicó
+    """
+    if hacia not in TRANSICIONES[desde]:
+        raise ValueError(f"Transición no permitida: {desde} -> {hacia}")
+
+    viajes = Trip.objects.filter(id=trip_id, estado=desde)
+    if conductor_id is not None:
+        viajes = viajes.filter(conductor_asignado_id=conductor_id)
+    return viajes.update(estado=hacia, **cambios) == 1
+
+
+def asignar(trip_id, conductor_id):
+    """Ofrecer un viaje pendiente a un conductor (cuenta como un intento)."""
+    return transicion(
+        trip_id,
+        "pendiente",
+        "asignado",
+        conductor_asignado_id=conductor_id,
+        intentos_asignacion=F("intentos_asignacion") + 1,
+    )
+
+
+def aceptar(trip_id, conductor_id):
+    """El conductor acepta el viaje que tiene ofrecido."""
+    return transicion(trip_id, "asignado", "aceptado", conductor_id)
+
+
+def rechazar(trip_id, conductor_id):
+    """
+    Devolver a pendiente un viaje ofrecido, por rechazo o por timeout, y
+    excluir al conductor de las próximas ofertas del viaje. Falla si el
+    conductor ya no lo tiene (lo aceptó, se venció o se reasignó).
+    """
+    return transicion(
+        trip_id,
+        "asignado",
+        "pendiente",
+        conductor_id,
+        conductor_asignado=None,
+        conductores_excluidos=AgregarAJSON("conductores_excluidos", conductor_id),
+    )
+
+
+def ofrecer(trip_id, conductor_ids):
+    """
+    Abrir una oferta del viaje pendiente a varios conductores a la vez
+    (cuenta como un intento). El viaje sigue pendiente hasta que uno acepta.
+    """
+    return (
+        Trip.objects.filter(id=trip_id, estado="pendiente").update(
+            conductores_ofertados=list(conductor_ids),
+            intentos_asignacion=F("intentos_asignacion") + 1,
+        )
+        == 1
+    )
+
+
+def aceptar_oferta(trip_id, conductor_id):
+    """
+    Tomar un viaje de una oferta abierta. Solo el primero gana: el UPDATE
+    exige que siga pendiente y que el conductor esté entre los ofertados y no
+    lo haya rechazado.
+    """
+    return (
+        Trip.objects.filter(
+            id=trip_id,
+            estado="pendiente",
+            conductores_ofertados__contains=[conductor_id],
+        )
+        .exclude(conductores_excluidos__contains=[conductor_id])
+        .update(estado="aceptado", conductor_asignado_id=conductor_id)
+        == 1
+    )
+
+
+def rechazar_oferta(trip_id, conductor_id):
+    """Rechazar una oferta abierta: el conductor queda excluido del viaje."""
+    return (
+        Trip.objects.filter(
+            id=trip_id,
+            estado="pendiente",
+            conductores_ofertados__contains=[conductor_id],
+        )
+        .exclude(conductores_excluidos__contains=[conductor_id])
+        .update(
+            conductores_excluidos=AgregarAJSON("conductores_excluidos", conductor_id)
+        )
+        == 1
+    )
+
+
+def cerrar_oferta(trip_id, conductor_ids):
+    """
+    Cerrar una oferta abierta que nadie aceptó: excluir a los ofertados y
+    dejar el viaje listo para la próxima. Falla si la oferta ya cambió.
+    """
+    return (
+        Trip.objects.filter(
+            id=trip_id, estado="pendiente", conductores_ofertados=list(conductor_ids)
+        ).update(
+            conductores_ofertados=[],
+            conductores_excluidos=AgregarAJSON("conductores_excluidos", *conductor_ids),
+        )
+        == 1
+    )
+
+
+def liberar_conductor(trip_id, conductor_id):
+    """
+    Devolver a los disponibles al conductor de un viaje terminado o cancelado
+    y avisar a su consumer, que deja de enviar su posición al pasajero.
+    """
+    obtener_disponibilidad().liberar(conductor_id)
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f"drivers_{conductor_id}",
+            {"type": "trip_finished", "trip_id": str(trip_id)},
+        )
+    except Exception as e:
+        logger.error(f"Error al avisar fin del viaje {trip_id}: {e}")
+
+
+def completar(trip_id, conductor_id):
+    """El conductor termina el viaje aceptado y queda libre."""
+    if not transicion(trip_id, "aceptado", "completado", conductor_id):
+        return False
+    liberar_conductor(trip_id, conductor_id)
+    return True
+
+
+def cancelar(trip_id, cliente_id=None):
+    """
+    Cancelar un viaje en curso, en el estado que esté, y liberar a su
+    conductor. Si el viaje cambia entre la lectura y el UPDATE se reintenta
+    con el estado nuevo. Con `cliente_id` solo se cancela si el viaje es de
+    ese pasajero.
+    """
+    viajes = Trip.objects.filter(
+        id=trip_id, estado__in=["pendiente", "asignado", "aceptado"]
+    )
+    if cliente_id is not None:
+        viajes = viajes.filter(cliente_id=cliente_id)
+    while True:
+        viaje = viajes.values("estado", "conductor_asignado_id").first()
+        if viaje is None:
+            return False
+        conductor_id = viaje["conductor_asignado_id"]
+        if transicion(trip_id, viaje["estado"], "cancelado", conductor_id):
+            break
+    if conductor_id is not None:
+        liberar_conductor(trip_id, conductor_id)
+    return True
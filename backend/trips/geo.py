@@ -0,0 +1,78 @@
+import numpy as np
+
+# Radio de la Tierra en kilómetros
+RADIO_TIERRA_KM = 6371.0
+
+# Kilómetros por grado de latitud (constante en la esfera)
+KM_POR_GRADO = 111.195
+
+
+def coordenadas(lat, lon):
+    """
+    Validar una posición recibida del cliente.
+
+    Acepta números o texto numérico, como hacía el `update_or_create` de
+    DriverLocation, y los devuelve como float.
+
+    Returns:
+        tuple: (latitud, longitud)
+
+    Raises:
+        ValueError: Si falta alguna o está fuera de [-90, 90] / [-180, 180]
+    """
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        raise ValueError(f"Coordenadas inválidas: {lat!r}, {lon!r}")
+    # NaN no cumple ninguna de las comparaciones
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"Coordenadas fuera de rango: {lat}, {lon}")
+    return lat, lon
+
+
+def distancias_km(origen, latitudes, longitudes):
+    """
+    Distancias Haversine (sin redondeo) desde un origen a muchos puntos.
+
+    Args:
+        origen: Tupla (latitud, longitud) del punto de partida
+        latitudes: Secuencia o arreglo de latitudes de destino
+        longitudes: Secuencia o arreglo de longitudes de destino
+
+    Returns:
+        numpy.ndarray: Distancias en kilómetros, en el mismo orden
+    """
+    lat1 = np.radians(origen[0])
+    lon1 = np.radians(origen[1])
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon2 = np.radians(np.asarray(longitudes, dtype=np.float64))
+
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * RADIO_TIERRA_KM * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def k_mas_cercanos(origen, latitudes, longitudes, k=1):
+    """
+    Índices y distancias de los `k` puntos más cercanos al origen.
+
+    Usa `argpartition` para separar los k menores y solo ordena esos k, en
+    lugar de ordenar todas las distancias.
+
+    Returns:
+        tuple: (indices, distancias) como arreglos ordenados por distancia
+    """
+    distancias = distancias_km(origen, latitudes, longitudes)
+    k = min(k, distancias.size)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+
+    if k < distancias.size:
+        indices = np.argpartition(distancias, k - 1)[:k]
+    else:
+        indices = np.arange(distancias.size)
+    orden = np.argsort(distancias[indices], kind="stable")
+    indices = indices[orden]
+    return indices, distancias[indices]
@@ -0,0 +1,13 @@
+from math import floor
+from django.conf import settings
+
+
+def tamano_celda():
+    """Lado (en grados) de las celdas de las zonas de conductores."""
+    return getattr(settings, "TRIPS_TAMANO_CELDA_GRUPOS_GRADOS", 0.05)
+
+
+def celda(lat, lon):
+    """Celda (fila, columna) de la grilla de zonas que contiene el punto."""
+    lado = tamano_celda()
+    return (floor(lat / lado), floor(lon / lado))
@@ -0,0 +1,74 @@
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from django.conf import settings
+from .geo import coordenadas
+from .models import DriverLocationHistory
+from .ubicaciones import obtener_almacen
+
+logger = logging.getLogger(__name__)
+
+# Tolerancia (ms) para relojes de clientes adelantados
+ADELANTO_MAXIMO_MS = 5 * 60 * 1000
+
+
+def validar_puntos(puntos):
+    """
+    Puntos válidos de un lote, del más viejo al más nuevo.
+
+    Cada punto es {"lat", "lon", "ts"} con `ts` en milisegundos desde epoch
+    (Date.now() en el cliente). Los puntos mal formados se descartan, también
+    los de `ts` no finito o fuera de la ventana que va desde
+    TRIPS_ANTIGUEDAD_MAXIMA_PUNTOS_SEGUNDOS atrás hasta ADELANTO_MAXIMO_MS
+    adelante. Si el lote supera TRIPS_MAX_PUNTOS_LOTE, se quedan los más
+    nuevos.
+
+    Returns:
+        list: Tuplas (ts_ms, lat, lon)
+    """
+    ahora = time.time() * 1000
+    antiguedad = getattr(settings, "TRIPS_ANTIGUEDAD_MAXIMA_PUNTOS_SEGUNDOS", 86400)
+    desde, hasta = ahora - antiguedad * 1000, ahora + ADELANTO_MAXIMO_MS
+
+    validos = []
+    for punto in puntos if isinstance(puntos, list) else ():
+        try:
+            ts = float(punto["ts"])
+            if not (math.isfinite(ts) and desde <= ts <= hasta):
+                raise ValueError(f"ts fuera de rango: {ts}")
+            validos.append((ts, *coordenadas(punto["lat"], punto["lon"])))
+        except (KeyError, TypeError, ValueError):
+            logger.debug(f"Punto descartado: {punto}")
+    validos.sort()
+    maximo = getattr(settings, "TRIPS_MAX_PUNTOS_LOTE", 500)
+    return validos[-maximo:]
+
+
+def registrar_lote(conductor_id, puntos):
+    """
+    Aplicar un lote de puntos ya validados (ver `validar_puntos`).
+
+    Solo el más nuevo pasa a la posición en vivo, con una única escritura en
+    el almacén de ubicaciones; los anteriores van al recorrido en un solo
+    INSERT.
+
+    Returns:
+        int: Cantidad de puntos registrados
+    """
+    if not puntos:
+        return 0
+
+    *anteriores, (_, lat, lon) = puntos
+    if anteriores:
+        DriverLocationHistory.objects.bulk_create(
+            DriverLocationHistory(
+                conductor_id=conductor_id,
+                latitud=lat_punto,
+                longitud=lon_punto,
+                timestamp=datetime.fromtimestamp(ts / 1000, tz=timezone.utc),
+            )
+            for ts, lat_punto, lon_punto in anteriores
+        )
+    obtener_almacen().guardar(conductor_id, lat, lon)
+    return len(puntos)
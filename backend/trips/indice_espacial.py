@@ -0,0 +1,280 @@
+import heapq
+import threading
+import time
+from datetime import timedelta
+from math import radians, cos, floor
+from django.conf import settings
+from django.utils import timezone
+from .geo import distancias_km, KM_POR_GRADO
+
+
+class IndiceEspacial:
+    """
+    Grilla uniforme en memoria con las posiciones de los conductores.
+
+    Cada conductor se guarda en la celda de `tamano_celda` grados que contiene
+    su posición. La búsqueda de los k más cercanos recorre anillos de celdas
+    alrededor del origen y se detiene en cuanto ningún anillo posterior puede
+    contener un punto más cercano que el k-ésimo encontrado, por lo que el
+    costo depende de la densidad local y no del tamaño de la flota.
+    """
+
+    # Con `solo` de hasta este tamaño se mide directo contra esos conductores
+    MAX_SOLO_DIRECTO = 256
+
+    def __init__(self, tamano_celda=0.01):
+        self.tamano_celda = tamano_celda
+        self._posiciones = {}  # conductor_id -> (lat, lon, celda)
+        self._celdas = {}  # celda -> set(conductor_id)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._posiciones)
+
+    def __contains__(self, conductor_id):
+        return conductor_id in self._posiciones
+
+    def celda(self, lat, lon):
+        """Celda (fila, columna) de la grilla que contiene el punto."""
+        return (floor(lat / self.tamano_celda), floor(lon / self.tamano_celda))
+
+    def actualizar(self, conductor_id, lat, lon):
+        """Registrar o mover la posición de un conductor."""
+        nueva_celda = self.celda(lat, lon)
+        with self._lock:
+            anterior = self._posiciones.get(conductor_id)
+            if anterior is not None and anterior[2] != nueva_celda:
+                self._quitar_de_celda(conductor_id, anterior[2])
+            if anterior is None or anterior[2] != nueva_celda:
+                self._celdas.setdefault(nueva_celda, set()).add(conductor_id)
+            self._posiciones[conductor_id] = (lat, lon, nueva_celda)
+
+    def eliminar(self, conductor_id):
+        """Quitar a un conductor del índice, si está."""
+        with self._lock:
+            anterior = self._posiciones.pop(conductor_id, None)
+            if anterior is not None:
+                self._quitar_de_celda(conductor_id, anterior[2])
+
+    def limpiar(self):
+        with self._lock:
+            self._posiciones.clear()
+            self._celdas.clear()
+
+    def ids(self):
+        """Conjunto de ids de los conductores indexados."""
+        with self._lock:
+            return set(self._posiciones)
+
+    def posicion(self, conductor_id):
+        """Tupla (latitud, longitud) del conductor o None."""
+        entrada = self._posiciones.get(conductor_id)
+        return entrada[:2] if entrada else None
+
+    def k_mas_cercanos(self, lat, lon, k=1, excluir=None, solo=None):
+        """
+        Devuelve hasta `k` tuplas (distancia_km, conductor_id) ordenadas por
+        distancia creciente, ignorando los ids de `excluir` y, si se indica
+        `solo`, cualquier id que no esté en ese conjunto.
+        """
+        excluir = excluir or ()
+        with self._lock:
+            if not self._posiciones or k <= 0:
+                return []
+
+            if solo is not None and len(solo) <= self.MAX_SOLO_DIRECTO:
+                # Pocos permitidos: medir solo contra ellos, sin recorrer celdas
+                mejores = []
+                self._medir(lat, lon, solo, excluir, None, k, mejores)
+                return sorted((-d, cid) for d, cid in mejores)
+
+            fila0, col0 = self.celda(lat, lon)
+            mejores = []  # heap de máximos: (-distancia, conductor_id)
+            vistos = 0
+            celdas_recorridas = 0
+            total = len(self._posiciones)
+            radio = 0
+
+            while vistos < total:
+                # Si los anillos ya recorrieron más celdas de las que hay
+                # ocupadas, es más barato revisar las ocupadas directamente.
+                if celdas_recorridas > len(self._celdas):
+                    self._considerar(
+                        lat,
+                        lon,
+                        self._celdas_fuera_de(fila0, col0, radio),
+                        excluir,
+                        solo,
+                        k,
+                        mejores,
+                    )
+                    break
+
+                if len(mejores) >= k and radio > 0:
+                    cota = self._cota_inferior_km(lat, radio)
+                    if cota >= -mejores[0][0]:
+                        break
+
+                anillo = self._anillo(fila0, col0, radio)
+                celdas_recorridas += len(anillo)
+                vistos += self._considerar(lat, lon, anillo, excluir, solo, k, mejores)
+                radio += 1
+
+            return sorted((-d, cid) for d, cid in mejores)
+
+    # Auxiliares internos (se llaman con el lock tomado)
+
+    def _quitar_de_celda(self, conductor_id, celda):
+        ocupantes = self._celdas.get(celda)
+        if ocupantes is not None:
+            ocupantes.discard(conductor_id)
+            if not ocupantes:
+                del self._celdas[celda]
+
+    def _anillo(self, fila0, col0, radio):
+        if radio == 0:
+            return [(fila0, col0)]
+        celdas = []
+        for col in range(col0 - radio, col0 + radio + 1):
+            celdas.append((fila0 - radio, col))
+            celdas.append((fila0 + radio, col))
+        for fila in range(fila0 - radio + 1, fila0 + radio):
+            celdas.append((fila, col0 - radio))
+            celdas.append((fila, col0 + radio))
+        return celdas
+
+    def _celdas_fuera_de(self, fila0, col0, radio):
+        return [
+            celda
+            for celda in self._celdas
+            if max(abs(celda[0] - fila0), abs(celda[1] - col0)) >= radio
+        ]
+
+    def _considerar(self, lat, lon, celdas, excluir, solo, k, mejores):
+        ids = []
+        for celda in celdas:
+            ids.extend(self._celdas.get(celda, ()))
+        self._medir(lat, lon, ids, excluir, solo, k, mejores)
+        return len(ids)
+
+    def _medir(self, lat, lon, ids, excluir, solo, k, mejores):
+        ids = [
+            conductor_id
+            for conductor_id in ids
+            if conductor_id in self._posiciones
+            and conductor_id not in excluir
+            and (solo is None or conductor_id in solo)
+        ]
+        if not ids:
+            return
+
+        # Una sola pasada vectorizada por anillo
+        posiciones = [self._posiciones[conductor_id] for conductor_id in ids]
+        distancias = distancias_km(
+            (lat, lon), [p[0] for p in posiciones], [p[1] for p in posiciones]
+        )
+        for conductor_id, distancia in zip(ids, distancias.tolist()):
+            if len(mejores) < k:
+                heapq.heappush(mejores, (-distancia, conductor_id))
+            elif distancia < -mejores[0][0]:
+                heapq.heapreplace(mejores, (-distancia, conductor_id))
+
+    def _cota_inferior_km(self, lat, radio):
+        """
+        Distancia mínima a cualquier punto del anillo `radio`: está al menos a
+        `radio - 1` celdas completas en latitud o en longitud. La longitud se
+        escala con el coseno de la latitud más extrema que cubre el anillo,
+        lo que hace la cota conservadora.
+        """
+        grados = (radio - 1) * self.tamano_celda
+        if grados <= 0:
+            return 0.0
+        lat_extrema = min(abs(lat) + (radio + 1) * self.tamano_celda, 90.0)
+        return grados * KM_POR_GRADO * max(cos(radians(lat_extrema)), 0.0)
+
+
+class SincronizacionIndice:
+    """
+    Mantiene el índice del proceso al día con DriverLocation.
+
+    Las señales del modelo solo llegan al proceso que guarda la fila: los
+    upserts en lote del buffer de escritura diferida y las posiciones que
+    reciben otros workers no pasan por ellas. Por eso cada
+    TRIPS_INDICE_SINCRONIZACION_SEGUNDOS se leen las filas cambiadas desde
+    la lectura anterior y cada TRIPS_INDICE_RECARGA_SEGUNDOS se recarga todo,
+    lo que también quita a los conductores cuya fila se borró en otro lado.
+    """
+
+    # Solapamiento entre lecturas, por transacciones que confirman tarde o
+    # relojes apenas desfasados entre los workers que escriben `timestamp`
+    MARGEN = timedelta(seconds=2)
+
+    def __init__(self, indice):
+        self.indice = indice
+        self.cargado = False
+        self._desde = None
+        self._ultima = 0.0
+        self._ultima_recarga = 0.0
+        self._lock = threading.Lock()
+
+    def al_dia(self):
+        """Sincronizar si venció el intervalo. Solo la primera carga espera."""
+        if self.cargado and not self._vencida():
+            return
+        # Si otro hilo ya está leyendo, se busca con el índice como está
+        if not self._lock.acquire(blocking=not self.cargado):
+            return
+        try:
+            if not self.cargado or self._vencida():
+                recarga = getattr(settings, "TRIPS_INDICE_RECARGA_SEGUNDOS", 60)
+                self.sincronizar(
+                    completa=not self.cargado
+                    or time.monotonic() - self._ultima_recarga >= recarga
+                )
+        finally:
+            self._lock.release()
+
+    def _vencida(self):
+        intervalo = getattr(settings, "TRIPS_INDICE_SINCRONIZACION_SEGUNDOS", 1)
+        return intervalo is not None and time.monotonic() - self._ultima >= intervalo
+
+    def sincronizar(self, completa=False):
+        """Aplicar al índice las filas cambiadas (o todas, con `completa`)."""
+        from .models import DriverLocation
+
+        inicio = timezone.now()
+        antes = self.indice.ids() if completa else None
+        filas = DriverLocation.objects.values_list(
+            "conductor_id", "latitud", "longitud"
+        )
+        if not completa:
+            filas = filas.filter(timestamp__gte=self._desde - self.MARGEN)
+
+        vistos = set()
+        for conductor_id, lat, lon in filas.iterator():
+            self.indice.actualizar(conductor_id, lat, lon)
+            vistos.add(conductor_id)
+        if completa:
+            for conductor_id in antes - vistos:
+                self.indice.eliminar(conductor_id)
+
+        self._desde = inicio
+        self._ultima = time.monotonic()
+        if completa:
+            self._ultima_recarga = self._ultima
+        self.cargado = True
+
+
+# Índice del proceso. Se mantiene al día con las señales de DriverLocation
+# (ver trips/signals.py) y con SincronizacionIndice para lo que escriben otros
+# procesos; se carga desde la base de datos en el primer uso.
+indice_conductores = IndiceEspacial(
+    getattr(settings, "TRIPS_TAMANO_CELDA_GRADOS", 0.01)
+)
+sincronizacion_indice = SincronizacionIndice(indice_conductores)
+
+
+def obtener_indice():
+    """Devuelve el índice del proceso, cargado y sincronizado con la base."""
+    sincronizacion_indice.al_dia()
+    return indice_conductores
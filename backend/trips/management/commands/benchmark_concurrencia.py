@@ -0,0 +1,78 @@
+import asyncio
+import statistics
+import time
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connection
+from trips.concurrencia import crear_executor, en_hilo
+from trips.models import Trip
+
+
+def consulta(latencia):
+    """Una consulta de la base con `latencia` segundos de espera del servidor."""
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT pg_sleep(%s)", [latencia])
+        else:
+            time.sleep(latencia)
+    return Trip.objects.filter(estado="pendiente").exists()
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide cuántas operaciones de base de datos por segundo atiende el "
+        "consumer según la cantidad de hilos del pool (0 = hilo único)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hilos",
+            default="0,1,2,4,8,16",
+            help="Tamaños de pool a comparar, separados por coma.",
+        )
+        parser.add_argument(
+            "--operaciones",
+            type=int,
+            default=400,
+            help="Operaciones concurrentes por corrida.",
+        )
+        parser.add_argument(
+            "--latencia-ms",
+            type=float,
+            default=5,
+            help="Latencia simulada de cada consulta en milisegundos.",
+        )
+
+    def handle(self, *args, **options):
+        latencia = options["latencia_ms"] / 1000
+        self.stdout.write(f"{'hilos':>6} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+        for hilos in (int(h) for h in options["hilos"].split(",")):
+            tiempos, total = asyncio.run(
+                self._corrida(hilos, options["operaciones"], latencia)
+            )
+            tiempos.sort()
+            p99 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.99))]
+            self.stdout.write(
+                f"{hilos:>6} {len(tiempos) / total:>10.1f} "
+                f"{statistics.median(tiempos) * 1000:>10.1f} {p99 * 1000:>10.1f}"
+            )
+
+    async def _corrida(self, hilos, operaciones, latencia):
+        executor = crear_executor(hilos) if hilos else None
+        if executor is None:
+            # El modo anterior, aunque TRIPS_HILOS_DB tenga un pool
+            operacion = database_sync_to_async(consulta)
+        else:
+            operacion = en_hilo(consulta, executor=executor)
+
+        async def medir():
+            inicio = time.perf_counter()
+            await operacion(latencia)
+            return time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        tiempos = await asyncio.gather(*(medir() for _ in range(operaciones)))
+        total = time.perf_counter() - inicio
+        if executor is not None:
+            executor.shutdown()
+        return list(tiempos), total
@@ -0,0 +1,288 @@
+import heapq
+import json
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+import redis
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from trips.indice_espacial import IndiceEspacial
+from trips.management.medicion import percentil, punto_cercano
+from trips.models import DriverLocation
+from trips.services import calcular_distancia
+from trips.ubicaciones import (
+    AlmacenUbicaciones,
+    AlmacenUbicacionesDB,
+    AlmacenUbicacionesPostGIS,
+    AlmacenUbicacionesRedis,
+    AlmacenUbicacionesSQL,
+)
+
+# Dominio de los emails de los conductores sintéticos
+DOMINIO = "benchmark.local"
+
+
+class AlmacenBucle(AlmacenUbicaciones):
+    """
+    La búsqueda original de `asignar_conductor`: recorrer todas las filas de
+    DriverLocation y medir cada una con `calcular_distancia`.
+    """
+
+    def cercanos(self, lat, lon, k=1, excluir=None, solo=None):
+        excluir = excluir or ()
+        distancias = (
+            (calcular_distancia((lat, lon), (latitud, longitud)), conductor_id)
+            for conductor_id, latitud, longitud in DriverLocation.objects.values_list(
+                "conductor_id", "latitud", "longitud"
+            )
+            if conductor_id not in excluir and (solo is None or conductor_id in solo)
+        )
+        return heapq.nsmallest(k, distancias)
+
+    def sembrar(self, filas):
+        pass
+
+
+class AlmacenIndice(AlmacenUbicacionesDB):
+    """AlmacenUbicacionesDB con un índice propio, sin tocar el del proceso."""
+
+    def __init__(self):
+        self.indice = IndiceEspacial(
+            getattr(settings, "TRIPS_TAMANO_CELDA_GRADOS", 0.01)
+        )
+
+    def cercanos(self, lat, lon, k=1, excluir=None, solo=None):
+        return self.indice.k_mas_cercanos(lat, lon, k=k, excluir=excluir, solo=solo)
+
+    def sembrar(self, filas):
+        for conductor_id, lat, lon in filas:
+            self.indice.actualizar(conductor_id, lat, lon)
+
+
+class AlmacenSQL(AlmacenUbicacionesSQL):
+    def sembrar(self, filas):
+        pass
+
+
+class AlmacenPostGIS(AlmacenUbicacionesPostGIS):
+    def sembrar(self, filas):
+        # Sin PostGIS (migración 0002 sin aplicar) la consulta falla
+        with transaction.atomic():
+            self.candidatos(0, 0)
+
+
+class AlmacenRedis(AlmacenUbicacionesRedis):
+    """AlmacenUbicacionesRedis en claves propias, que se borran al terminar."""
+
+    def __init__(self):
+        super().__init__(prefijo="trips:benchmark:ubicaciones")
+        self.redis.delete(self.clave, self.clave_pendientes)
+
+    def sembrar(self, filas, lote=5000):
+        for inicio in range(0, len(filas), lote):
+            valores = []
+            for conductor_id, lat, lon in filas[inicio : inicio + lote]:
+                valores.extend((lon, lat, conductor_id))
+            self.redis.geoadd(self.clave, valores)
+
+    def cerrar(self):
+        self.redis.delete(self.clave, self.clave_pendientes)
+
+
+ALMACENES = {
+    "bucle": AlmacenBucle,
+    "indice": AlmacenIndice,
+    "sql": AlmacenSQL,
+    "postgis": AlmacenPostGIS,
+    "redis": AlmacenRedis,
+}
+
+
+def sembrar_conductores(desde, hasta, rng, centro, radio_km):
+    """
+    Crear los conductores sintéticos `desde`..`hasta`-1 con su DriverLocation.
+    Devuelve las filas (conductor_id, lat, lon) creadas.
+    """
+    User = get_user_model()
+    usuarios = User.objects.bulk_create(
+        [
+            User(
+                username=f"bench{i}@{DOMINIO}",
+                email=f"bench{i}@{DOMINIO}",
+                password="!",
+                rol="Conductor",
+            )
+            for i in range(desde, hasta)
+        ],
+        batch_size=5000,
+    )
+    filas = [(u.id, *punto_cercano(rng, *centro, radio_km)) for u in usuarios]
+    DriverLocation.objects.bulk_create(
+        [
+            DriverLocation(conductor_id=conductor_id, latitud=lat, longitud=lon)
+            for conductor_id, lat, lon in filas
+        ],
+        batch_size=5000,
+    )
+    return filas
+
+
+def commit_actual():
+    """Hash del commit del árbol, para comparar corridas; None fuera de git."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide la búsqueda del conductor más cercano (`candidatos` del almacén "
+        "de ubicaciones) con flotas sintéticas de distinto tamaño en cada "
+        "backend, con las consultas SQL por llamada. Los datos sembrados se "
+        "descartan al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tamanos",
+            default="100,1000,10000,100000",
+            help="Cantidades de conductores a comparar, separadas por coma.",
+        )
+        parser.add_argument(
+            "--almacenes",
+            default=",".join(ALMACENES),
+            help=f"Backends a medir, separados por coma ({', '.join(ALMACENES)}).",
+        )
+        parser.add_argument(
+            "--llamadas",
+            type=int,
+            default=50,
+            help="Búsquedas medidas por almacén y tamaño.",
+        )
+        parser.add_argument("--k", type=int, default=5, help="Candidatos por búsqueda.")
+        parser.add_argument(
+            "--limite-bucle",
+            type=int,
+            default=10000,
+            help="Tamaño máximo en el que se mide el almacén 'bucle'.",
+        )
+        parser.add_argument("--lat", type=float, default=4.6097)
+        parser.add_argument("--lon", type=float, default=-74.0817)
+        parser.add_argument(
+            "--radio-km",
+            type=float,
+            default=15,
+            help="Radio de la ciudad donde se siembran conductores y orígenes.",
+        )
+        parser.add_argument("--semilla", type=int, default=0)
+        parser.add_argument(
+            "--salida",
+            help="Archivo JSON donde guardar los resultados.",
+        )
+
+    def handle(self, *args, **options):
+        tamanos = sorted(int(t) for t in options["tamanos"].split(","))
+        nombres = options["almacenes"].split(",")
+        desconocidos = set(nombres) - set(ALMACENES)
+        if desconocidos:
+            raise CommandError(f"Almacenes desconocidos: {', '.join(desconocidos)}")
+        rng = random.Random(options["semilla"])
+        centro = (options["lat"], options["lon"])
+
+        almacenes = {}
+        for nombre in nombres:
+            try:
+                almacenes[nombre] = ALMACENES[nombre]()
+            except redis.RedisError as e:
+                self.stderr.write(f"Se omite {nombre}: {e}")
+
+        resultados = []
+        self.stdout.write(
+            f"{'almacén':<8} {'conductores':>11} {'p50 ms':>9} {'p95 ms':>9} "
+            f"{'media ms':>9} {'SQL/llamada':>11}"
+        )
+        try:
+            # Todo lo sembrado en la base se revierte al final
+            with transaction.atomic():
+                sembrados = 0
+                for tamano in tamanos:
+                    filas = sembrar_conductores(
+                        sembrados, tamano, rng, centro, options["radio_km"]
+                    )
+                    sembrados = max(sembrados, tamano)
+                    for nombre, almacen in list(almacenes.items()):
+                        try:
+                            almacen.sembrar(filas)
+                        except (DatabaseError, redis.RedisError) as e:
+                            motivo = str(e).splitlines()[0]
+                            self.stderr.write(f"Se omite {nombre}: {motivo}")
+                            del almacenes[nombre]
+                            continue
+                        if nombre == "bucle" and tamano > options["limite_bucle"]:
+                            continue
+                        resultado = self.medir(almacen, tamano, rng, options)
+                        resultado["almacen"] = nombre
+                        resultados.append(resultado)
+                        self.reportar(resultado)
+                transaction.set_rollback(True)
+        finally:
+            for almacen in almacenes.values():
+                if hasattr(almacen, "cerrar"):
+                    almacen.cerrar()
+
+        if options["salida"]:
+            with open(options["salida"], "w") as archivo:
+                json.dump(
+                    {
+                        "commit": commit_actual(),
+                        "fecha": datetime.now(timezone.utc).isoformat(),
+                        "base": connection.vendor,
+                        "k": options["k"],
+                        "llamadas": options["llamadas"],
+                        "resultados": resultados,
+                    },
+                    archivo,
+                    indent=2,
+                )
+            self.stdout.write(f"Resultados guardados en {options['salida']}")
+
+    def medir(self, almacen, tamano, rng, options):
+        origenes = [
+            punto_cercano(rng, options["lat"], options["lon"], options["radio_km"])
+            for _ in range(options["llamadas"])
+        ]
+        almacen.candidatos(*origenes[0], k=options["k"])  # calentar
+
+        tiempos = []
+        with CaptureQueriesContext(connection) as consultas:
+            for lat, lon in origenes:
+                inicio = time.perf_counter()
+                almacen.candidatos(lat, lon, k=options["k"])
+                tiempos.append(time.perf_counter() - inicio)
+        tiempos.sort()
+        return {
+            "conductores": tamano,
+            "p50_ms": percentil(tiempos, 50) * 1000,
+            "p95_ms": percentil(tiempos, 95) * 1000,
+            "media_ms": statistics.mean(tiempos) * 1000,
+            "consultas_por_llamada": len(consultas) / len(origenes),
+        }
+
+    def reportar(self, resultado):
+        self.stdout.write(
+            f"{resultado['almacen']:<8} {resultado['conductores']:>11} "
+            f"{resultado['p50_ms']:>9.2f} {resultado['p95_ms']:>9.2f} "
+            f"{resultado['media_ms']:>9.2f} "
+            f"{resultado['consultas_por_llamada']:>11.1f}"
+        )
@@ -0,0 +1,44 @@
+import time
+from django.core.management.base import BaseCommand
+from trips.presencia import obtener_presencia
+from trips.ubicaciones import obtener_almacen
+
+
+class Command(BaseCommand):
+    help = (
+        "Muestra los conductores vistos por región y, con --purgar, borra las "
+        "posiciones en vivo de los que dejaron de mandar latidos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--purgar",
+            action="store_true",
+            help="Olvidar a los conductores sin latidos y sacar sus posiciones.",
+        )
+        parser.add_argument(
+            "--intervalo",
+            type=float,
+            default=0,
+            help="Segundos entre pasadas. Con 0 se hace una sola.",
+        )
+
+    def handle(self, *args, **options):
+        presencia = obtener_presencia()
+        intervalo = options["intervalo"]
+
+        while True:
+            if options["purgar"]:
+                vencidos = presencia.purgar()
+                almacen = obtener_almacen()
+                for conductor_id in vencidos:
+                    almacen.eliminar(conductor_id)
+                self.stdout.write(f"Conductores sin latidos purgados: {len(vencidos)}")
+
+            regiones = presencia.por_region()
+            self.stdout.write(f"Conductores vistos: {sum(regiones.values())}")
+            for nombre, cantidad in regiones.most_common():
+                self.stdout.write(f"  {nombre}: {cantidad}")
+            if intervalo <= 0:
+                return
+            time.sleep(intervalo)
@@ -0,0 +1,14 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from trips.temporizadores import obtener_temporizadores
+
+
+class Command(BaseCommand):
+    help = "Dispara los timeouts de ofertas de viaje guardados en el almacén."
+
+    def handle(self, *args, **options):
+        self.stdout.write("Procesando timeouts de ofertas (Ctrl+C para salir)")
+        asyncio.run(self._ejecutar())
+
+    async def _ejecutar(self):
+        await obtener_temporizadores().ejecutar()
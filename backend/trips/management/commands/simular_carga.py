@@ -0,0 +1,352 @@
+import asyncio
+import logging
+import random
+import time
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from backend.asgi import application
+from trips.buffer_ubicaciones import obtener_buffer
+from trips.concurrencia import en_hilo
+from trips.disponibilidad import obtener_disponibilidad
+from trips.management.medicion import percentil, punto_cercano
+from trips.metricas import obtener_metricas
+from trips.presencia import obtener_presencia
+from trips.temporizadores import obtener_almacen_temporizadores, obtener_temporizadores
+from trips.ubicaciones import obtener_almacen
+from users.models import Conductor, Pasajero, Token
+
+# Dominio de los emails de los usuarios simulados, para borrarlos al terminar
+DOMINIO = "carga.local"
+
+# Primera respuesta que recibe el pasajero tras create_trip
+RESPUESTAS_VIAJE = {"trip_assigned", "trip_offered", "no_drivers_available"}
+
+# Capa en memoria: toda la simulación corre en este proceso
+CAPA_MEMORIA = {
+    "CHANNEL_LAYERS": {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    "TRIPS_ALMACEN_TEMPORIZADORES": "trips.temporizadores.AlmacenTemporizadoresMemoria",
+    "TRIPS_DISPONIBILIDAD": "trips.disponibilidad.DisponibilidadMemoria",
+    "TRIPS_PRESENCIA": "trips.presencia.PresenciaMemoria",
+    "TRIPS_METRICAS": "trips.metricas.MetricasMemoria",
+}
+
+# Backends cacheados que dependen de CAPA_MEMORIA
+REGISTROS = (
+    obtener_almacen_temporizadores,
+    obtener_disponibilidad,
+    obtener_presencia,
+    obtener_metricas,
+)
+
+
+def crear_usuarios(modelo, prefijo, cantidad):
+    """Usuarios simulados con su sesión registrada. Devuelve sus access tokens."""
+    tokens, sesiones = [], []
+    with transaction.atomic():
+        for i in range(cantidad):
+            email = f"{prefijo}{i}@{DOMINIO}"
+            usuario = modelo(username=email, email=email, rol=modelo.rol)
+            usuario.set_unusable_password()
+            usuario.save()
+            refresh = RefreshToken.for_user(usuario)
+            access = refresh.access_token
+            sesiones.append(
+                Token(
+                    user=usuario, access_jti=access["jti"], refresh_jti=refresh["jti"]
+                )
+            )
+            tokens.append(str(access))
+        Token.objects.bulk_create(sesiones)
+    return tokens
+
+
+def borrar_usuarios():
+    """Borrar los usuarios simulados, sus viajes y sus posiciones."""
+    usuarios = get_user_model().objects.filter(email__endswith=f"@{DOMINIO}")
+    almacen = obtener_almacen()
+    for conductor_id in usuarios.filter(rol="Conductor").values_list("id", flat=True):
+        almacen.eliminar(conductor_id)
+    return usuarios.delete()[0]
+
+
+class Simulacion:
+    """
+    Conductores y pasajeros simulados contra la aplicación ASGI completa
+    (autenticación por token incluida), cada uno con su WebsocketCommunicator.
+    Guarda las latencias de cada operación en `medidas` (segundos).
+    """
+
+    def __init__(self, opciones):
+        self.opciones = opciones
+        self.rng = random.Random(opciones["semilla"])
+        self.centro = (opciones["lat"], opciones["lon"])
+        self.medidas = {
+            "conexion": [],
+            "update_location": [],
+            "create_trip": [],
+            "accept_trip": [],
+        }
+        self.duraciones = {}
+        self.ofertas = 0
+        self.sin_conductores = 0
+        self.sin_respuesta = 0
+
+    def posicion(self):
+        return punto_cercano(self.rng, *self.centro, self.opciones["radio_km"])
+
+    async def conectar(self, token, handshakes):
+        async with handshakes:
+            return await self._conectar(token)
+
+    async def _conectar(self, token):
+        socket = WebsocketCommunicator(
+            application,
+            f"/ws/trip/?token={token}",
+            headers=[(b"origin", b"http://localhost")],
+        )
+        inicio = time.perf_counter()
+        conectado, _ = await socket.connect(timeout=self.opciones["espera"])
+        if not conectado:
+            raise RuntimeError("La aplicación rechazó la conexión simulada")
+        self.medidas["conexion"].append(time.perf_counter() - inicio)
+        return socket
+
+    async def fase(self, nombre, corrutinas):
+        inicio = time.perf_counter()
+        resultado = await asyncio.gather(*corrutinas)
+        self.duraciones[nombre] = time.perf_counter() - inicio
+        return resultado
+
+    async def mover(self, socket):
+        """Mandar las actualizaciones de un conductor, esperando cada acuse."""
+        for _ in range(self.opciones["actualizaciones"]):
+            lat, lon = self.posicion()
+            inicio = time.perf_counter()
+            await socket.send_json_to(
+                {"action": "update_location", "lat": lat, "lon": lon}
+            )
+            await socket.receive_json_from(timeout=self.opciones["espera"])
+            self.medidas["update_location"].append(time.perf_counter() - inicio)
+
+    async def atender(self, socket):
+        """Aceptar cada oferta que llegue al conductor; corre hasta cancelarla."""
+        aceptando = None
+        while True:
+            mensaje = await socket.receive_json_from(timeout=None)
+            if mensaje.get("type") == "trip_assigned":
+                self.ofertas += 1
+                aceptando = time.perf_counter()
+                await socket.send_json_to(
+                    {"action": "accept_trip", "trip_id": mensaje["trip_id"]}
+                )
+            elif mensaje.get("status") == "trip_accepted" and aceptando:
+                self.medidas["accept_trip"].append(time.perf_counter() - aceptando)
+                aceptando = None
+
+    async def pedir(self, socket, indice):
+        """El pasajero pide un viaje y espera la primera respuesta."""
+        if self.opciones["ritmo"]:
+            await asyncio.sleep(indice / self.opciones["ritmo"])
+        lat, lon = self.posicion()
+        destino_lat, destino_lon = self.posicion()
+        inicio = time.perf_counter()
+        await socket.send_json_to(
+            {
+                "action": "create_trip",
+                "origen": {"lat": lat, "lng": lon},
+                "destino": {"lat": destino_lat, "lng": destino_lon},
+            }
+        )
+        try:
+            while True:
+                mensaje = await socket.receive_json_from(
+                    timeout=self.opciones["espera"]
+                )
+                if mensaje.get("status") in RESPUESTAS_VIAJE:
+                    break
+        except asyncio.TimeoutError:
+            self.sin_respuesta += 1
+            return
+        if mensaje["status"] == "no_drivers_available":
+            self.sin_conductores += 1
+        else:
+            self.medidas["create_trip"].append(time.perf_counter() - inicio)
+
+    async def ejecutar(self, tokens_conductores, tokens_pasajeros):
+        # Abrir las conexiones de a poco, como al arrancar la ciudad
+        handshakes = asyncio.Semaphore(self.opciones["conexiones_simultaneas"])
+        sockets = await self.fase(
+            "conexion",
+            (
+                self.conectar(token, handshakes)
+                for token in [*tokens_conductores, *tokens_pasajeros]
+            ),
+        )
+        conductores = sockets[: len(tokens_conductores)]
+        pasajeros = sockets[len(tokens_conductores) :]
+        atendiendo = []
+        try:
+            await self.fase("update_location", (self.mover(s) for s in conductores))
+            # El despacho busca en las posiciones ya persistidas
+            if obtener_buffer() is not None:
+                await en_hilo(obtener_buffer().volcar)()
+
+            atendiendo = [asyncio.create_task(self.atender(s)) for s in conductores]
+            inicio = time.perf_counter()
+            await self.fase(
+                "create_trip", (self.pedir(s, i) for i, s in enumerate(pasajeros))
+            )
+
+            # Dar tiempo a que lleguen las aceptaciones en curso
+            limite = time.monotonic() + self.opciones["espera"]
+            while (
+                len(self.medidas["accept_trip"]) < self.ofertas
+                and time.monotonic() < limite
+            ):
+                await asyncio.sleep(0.05)
+            self.duraciones["accept_trip"] = time.perf_counter() - inicio
+        finally:
+            for tarea in atendiendo:
+                tarea.cancel()
+            await asyncio.gather(*atendiendo, return_exceptions=True)
+            await obtener_temporizadores().detener()
+            await asyncio.gather(
+                *(s.disconnect() for s in sockets), return_exceptions=True
+            )
+
+
+class Command(BaseCommand):
+    help = (
+        "Simula una ciudad de conductores y pasajeros conectados por WebSocket "
+        "a la aplicación ASGI y reporta throughput y latencias p50/p95/p99 de "
+        "update_location, create_trip→trip_assigned y accept_trip."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--conductores",
+            type=int,
+            default=1000,
+            help="Conductores simulados.",
+        )
+        parser.add_argument(
+            "--pasajeros",
+            type=int,
+            default=100,
+            help="Pasajeros simulados; cada uno pide un viaje.",
+        )
+        parser.add_argument(
+            "--actualizaciones",
+            type=int,
+            default=5,
+            help="update_location que manda cada conductor antes de los viajes.",
+        )
+        parser.add_argument(
+            "--ritmo",
+            type=float,
+            default=0,
+            help="Viajes pedidos por segundo. Con 0 se piden todos a la vez.",
+        )
+        parser.add_argument(
+            "--conexiones-simultaneas",
+            type=int,
+            default=50,
+            help="Handshakes WebSocket en curso a la vez durante la conexión.",
+        )
+        parser.add_argument(
+            "--capa",
+            choices=["memoria", "configurada"],
+            default="memoria",
+            help=(
+                "memoria usa InMemoryChannelLayer y registros de temporizadores "
+                "y conductores en memoria; "
+                "configurada, CHANNEL_LAYERS y los backends de los settings "
+                "(p. ej. un Redis local)."
+            ),
+        )
+        parser.add_argument("--lat", type=float, default=4.6097)
+        parser.add_argument("--lon", type=float, default=-74.0817)
+        parser.add_argument(
+            "--radio-km",
+            type=float,
+            default=5,
+            help="Radio de la ciudad alrededor de --lat/--lon.",
+        )
+        parser.add_argument(
+            "--espera",
+            type=float,
+            default=10,
+            help="Segundos máximos de espera por cada respuesta.",
+        )
+        parser.add_argument("--semilla", type=int, default=0)
+        parser.add_argument(
+            "--conservar",
+            action="store_true",
+            help="No borrar los usuarios y viajes simulados al terminar.",
+        )
+
+    def handle(self, *args, **options):
+        if options["verbosity"] < 2:
+            # Los logs por mensaje del consumer dominarían el tiempo medido
+            for nombre in ("trips", "backend.token_auth_middleware"):
+                logging.getLogger(nombre).setLevel(logging.WARNING)
+
+        borrar_usuarios()
+        self.stdout.write(
+            f"Creando {options['conductores']} conductores y "
+            f"{options['pasajeros']} pasajeros..."
+        )
+        tokens_conductores = crear_usuarios(
+            Conductor, "conductor", options["conductores"]
+        )
+        tokens_pasajeros = crear_usuarios(Pasajero, "pasajero", options["pasajeros"])
+
+        simulacion = Simulacion(options)
+        ajustes = CAPA_MEMORIA if options["capa"] == "memoria" else {}
+        try:
+            with override_settings(**ajustes):
+                for registro in REGISTROS:
+                    registro.cache_clear()
+                asyncio.run(simulacion.ejecutar(tokens_conductores, tokens_pasajeros))
+        except asyncio.TimeoutError:
+            raise CommandError(
+                f"La aplicación no respondió en {options['espera']} s; probar con "
+                "menos conexiones simultáneas o un --espera mayor."
+            )
+        finally:
+            for registro in REGISTROS:
+                registro.cache_clear()
+            if obtener_buffer() is not None:
+                obtener_buffer().volcar()
+            if not options["conservar"]:
+                borrar_usuarios()
+
+        self.reportar(simulacion)
+
+    def reportar(self, simulacion):
+        self.stdout.write(
+            f"{'operación':<16} {'total':>7} {'ops/s':>9} "
+            f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+        )
+        for nombre, tiempos in simulacion.medidas.items():
+            if not tiempos:
+                self.stdout.write(f"{nombre:<16} {0:>7}")
+                continue
+            tiempos.sort()
+            self.stdout.write(
+                f"{nombre:<16} {len(tiempos):>7} "
+                f"{len(tiempos) / simulacion.duraciones[nombre]:>9.1f} "
+                f"{percentil(tiempos, 50) * 1000:>9.1f} "
+                f"{percentil(tiempos, 95) * 1000:>9.1f} "
+                f"{percentil(tiempos, 99) * 1000:>9.1f}"
+            )
+        self.stdout.write(
+            f"Viajes sin conductores: {simulacion.sin_conductores}, "
+            f"sin respuesta: {simulacion.sin_respuesta}, "
+            f"ofertas sin aceptar: "
+            f"{simulacion.ofertas - len(simulacion.medidas['accept_trip'])}"
+        )
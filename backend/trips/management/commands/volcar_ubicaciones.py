@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from trips.ubicaciones import obtener_almacen
+
+
+class Command(BaseCommand):
+    help = "Vuelca a DriverLocation las posiciones en vivo del almacén configurado."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--intervalo",
+            type=float,
+            default=0,
+            help="Segundos entre volcados. Con 0 se vuelca una sola vez.",
+        )
+
+    def handle(self, *args, **options):
+        almacen = obtener_almacen()
+        intervalo = options["intervalo"]
+
+        while True:
+            escritas = almacen.volcar()
+            self.stdout.write(f"Ubicaciones volcadas: {escritas}")
+            if intervalo <= 0:
+                return
+            time.sleep(intervalo)
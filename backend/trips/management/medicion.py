@@ -0,0 +1,16 @@
+import math
+
+
+def percentil(tiempos, p):
+    """Percentil `p` (0-100) de una lista ya ordenada."""
+    return tiempos[min(len(tiempos) - 1, int(len(tiempos) * p / 100))]
+
+
+def punto_cercano(rng, lat, lon, radio_km):
+    """Posición al azar, uniforme en el círculo de `radio_km` km alrededor."""
+    distancia = radio_km * math.sqrt(rng.random()) / 111.32
+    angulo = rng.uniform(0, 2 * math.pi)
+    return (
+        lat + distancia * math.sin(angulo),
+        lon + distancia * math.cos(angulo) / math.cos(math.radians(lat)),
+    )
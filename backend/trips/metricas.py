@@ -0,0 +1,374 @@
+import contextvars
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Acciones de TripConsumer.receive_json; cualquier otra se cuenta como
+# "desconocida" para no crear series con lo que mande el cliente
+ACCIONES = {
+    "update_location",
+    "update_location_batch",
+    "heartbeat",
+    "create_trip",
+    "accept_trip",
+    "reject_trip",
+    "notify_trip_assigned",
+    "complete_trip",
+    "cancel_trip",
+}
+
+# Familias exportadas: nombre -> (tipo Prometheus, ayuda)
+FAMILIAS = {
+    "trips_acciones_total": ("counter", "Acciones recibidas por TripConsumer."),
+    "trips_acciones_errores_total": (
+        "counter",
+        "Acciones que terminaron con una excepción.",
+    ),
+    "trips_accion_duracion_segundos": ("histogram", "Duración de cada acción."),
+    "trips_accion_db_segundos_total": (
+        "counter",
+        "Tiempo en consultas SQL durante las acciones.",
+    ),
+    "trips_accion_consultas_total": ("counter", "Consultas SQL de las acciones."),
+    "trips_conexiones_abiertas": ("gauge", "Conexiones WebSocket abiertas por rol."),
+    "trips_temporizadores_pendientes": (
+        "gauge",
+        "Timeouts de ofertas programados que todavía no vencieron.",
+    ),
+    "trips_buffer_ubicaciones_pendientes": (
+        "gauge",
+        "Ubicaciones en el buffer de cada worker sin escribir en la base.",
+    ),
+    "trips_buffer_ubicaciones_antiguedad_segundos": (
+        "gauge",
+        "Edad de la ubicación pendiente más antigua del buffer.",
+    ),
+    "trips_buffer_ubicaciones_lag_segundos": (
+        "gauge",
+        "Lag del último volcado del buffer (primer ping hasta escrito).",
+    ),
+}
+
+# Consultas y tiempo de base de la acción en curso (ver `medir_consultas`)
+_medicion = contextvars.ContextVar("trips_medicion", default=None)
+
+
+class Medicion:
+    __slots__ = ("consultas", "segundos_db")
+
+    def __init__(self):
+        self.consultas = 0
+        self.segundos_db = 0.0
+
+
+def medir_consultas(execute, sql, params, many, context):
+    """
+    Execute wrapper de Django que suma cada consulta a la acción en curso.
+
+    El contexto viaja con `sync_to_async`, así que también cuenta lo que la
+    acción ejecuta en los hilos de `en_hilo`.
+    """
+    medicion = _medicion.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicion.consultas += 1
+        medicion.segundos_db += time.perf_counter() - inicio
+
+
+def limites_histograma():
+    """Límites (segundos) de los buckets de duración."""
+    return getattr(
+        settings,
+        "TRIPS_METRICAS_LIMITES_SEGUNDOS",
+        [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5],
+    )
+
+
+def _numero(valor):
+    valor = float(valor)
+    return str(int(valor)) if valor.is_integer() else repr(valor)
+
+
+def _muestra(nombre, etiquetas, valor):
+    if etiquetas:
+        texto = ",".join(f'{clave}="{dato}"' for clave, dato in etiquetas)
+        nombre = f"{nombre}{{{texto}}}"
+    return f"{nombre} {_numero(valor)}"
+
+
+def worker():
+    """Identificador del proceso en los gauges por worker."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def medidores_globales():
+    """Gauges compartidos por todos los workers: el backlog de timeouts."""
+    from .temporizadores import obtener_almacen_temporizadores
+
+    try:
+        pendientes = obtener_almacen_temporizadores().pendientes()
+    except redis.RedisError as e:
+        logger.error(f"No se pudo leer el backlog de temporizadores: {e}")
+        return {}
+    return {("trips_temporizadores_pendientes", ()): pendientes}
+
+
+def medidores_proceso():
+    """Gauges de este worker: cola y lag del buffer de ubicaciones."""
+    from .buffer_ubicaciones import obtener_buffer
+
+    buffer = obtener_buffer()
+    if buffer is None:
+        return {}
+    estado = buffer.metricas()
+    etiquetas = (("worker", worker()),)
+    return {
+        ("trips_buffer_ubicaciones_pendientes", etiquetas): estado["pendientes"],
+        ("trips_buffer_ubicaciones_antiguedad_segundos", etiquetas): (
+            estado["edad_pendiente_mas_antigua_ms"] / 1000
+        ),
+        ("trips_buffer_ubicaciones_lag_segundos", etiquetas): (
+            estado["ultimo_volcado_lag_ms"] / 1000
+        ),
+    }
+
+
+class Metricas:
+    """
+    Contadores e histogramas de TripConsumer en formato de texto Prometheus.
+
+    Cada serie es un par (nombre, etiquetas) con un valor que solo se suma:
+    los contadores, los buckets acumulados del histograma y el gauge de
+    conexiones, que sube y baja de a uno. Los demás gauges (`medidores`) se
+    leen al exportar. El backend activo se elige con `TRIPS_METRICAS` y se
+    sirve en /metrics.
+    """
+
+    def __init__(self):
+        self.limites = [float(limite) for limite in limites_histograma()]
+
+    def _sumar(self, deltas):
+        raise NotImplementedError
+
+    def valores(self):
+        """Counter {(nombre, etiquetas): valor} con todas las series."""
+        raise NotImplementedError
+
+    @contextmanager
+    def medir(self, accion):
+        """Medir una acción: duración, error y consultas SQL que hace."""
+        # `accion` viene del JSON del cliente: puede ser una lista o un dict
+        conocida = isinstance(accion, str) and accion in ACCIONES
+        etiquetas = (("accion", accion if conocida else "desconocida"),)
+        medicion = Medicion()
+        token = _medicion.set(medicion)
+        inicio = time.perf_counter()
+        error = False
+        try:
+            yield medicion
+        except BaseException:
+            error = True
+            raise
+        finally:
+            _medicion.reset(token)
+            self.observar(etiquetas, time.perf_counter() - inicio, medicion, error)
+
+    def observar(self, etiquetas, segundos, medicion, error=False):
+        deltas = Counter(
+            {
+                ("trips_acciones_total", etiquetas): 1,
+                ("trips_accion_duracion_segundos_count", etiquetas): 1,
+                ("trips_accion_duracion_segundos_sum", etiquetas): segundos,
+                ("trips_accion_consultas_total", etiquetas): medicion.consultas,
+                ("trips_accion_db_segundos_total", etiquetas): medicion.segundos_db,
+            }
+        )
+        if error:
+            deltas[("trips_acciones_errores_total", etiquetas)] = 1
+        for limite in self.limites:
+            if segundos <= limite:
+                serie = etiquetas + (("le", _numero(limite)),)
+                deltas[("trips_accion_duracion_segundos_bucket", serie)] = 1
+        self._sumar(deltas)
+
+    def medidores(self):
+        """Gauges leídos en el momento: backlog de timeouts y buffers."""
+        return {**medidores_globales(), **self.medidores_workers()}
+
+    def medidores_workers(self):
+        """Gauges por worker (etiqueta `worker`)."""
+        return medidores_proceso()
+
+    def conexion(self, rol, delta):
+        """Sumar `delta` (1 al conectar, -1 al desconectar) a las del rol."""
+        self._sumar(Counter({("trips_conexiones_abiertas", (("rol", rol),)): delta}))
+
+    def exportar(self):
+        """Todas las series en el formato de texto de Prometheus."""
+        valores = self.valores()
+        valores.update(self.medidores())
+        lineas = []
+        for familia, (tipo, ayuda) in FAMILIAS.items():
+            lineas.append(f"# HELP {familia} {ayuda}")
+            lineas.append(f"# TYPE {familia} {tipo}")
+            if tipo != "histogram":
+                for (nombre, etiquetas), valor in sorted(valores.items()):
+                    if nombre == familia:
+                        lineas.append(_muestra(nombre, etiquetas, valor))
+                continue
+
+            # Buckets en orden y completos; +Inf es el total de observaciones
+            cuentas = {
+                etiquetas: valor
+                for (nombre, etiquetas), valor in valores.items()
+                if nombre == f"{familia}_count"
+            }
+            for etiquetas, cuenta in sorted(cuentas.items()):
+                for limite in self.limites:
+                    serie = etiquetas + (("le", _numero(limite)),)
+                    valor = valores.get((f"{familia}_bucket", serie), 0)
+                    lineas.append(_muestra(f"{familia}_bucket", serie, valor))
+                serie = etiquetas + (("le", "+Inf"),)
+                lineas.append(_muestra(f"{familia}_bucket", serie, cuenta))
+                suma = valores.get((f"{familia}_sum", etiquetas), 0)
+                lineas.append(_muestra(f"{familia}_sum", etiquetas, suma))
+                lineas.append(_muestra(f"{familia}_count", etiquetas, cuenta))
+        return "\n".join(lineas) + "\n"
+
+
+class MetricasMemoria(Metricas):
+    """Series del proceso; sirve cuando hay un solo worker ASGI."""
+
+    def __init__(self):
+        super().__init__()
+        self._valores = Counter()
+        self._lock = threading.Lock()
+
+    def _sumar(self, deltas):
+        with self._lock:
+            self._valores.update(deltas)
+
+    def valores(self):
+        with self._lock:
+            return Counter(self._valores)
+
+
+class MetricasRedis(MetricasMemoria):
+    """
+    Series sumadas entre todos los workers en un hash de Redis.
+
+    Cada proceso acumula en memoria y un hilo propio vuelca los incrementos
+    con HINCRBYFLOAT cada `intervalo` segundos, así medir una acción nunca
+    espera a Redis. Si un worker muere sin desconectar sus sockets, sus
+    conexiones quedan contadas hasta que se borre la clave. Sus gauges de
+    proceso, en cambio, van en una clave propia que vence a los `vigencia`
+    segundos sin volcados.
+    """
+
+    def __init__(self, url=None, clave="trips:metricas", intervalo=1.0, vigencia=10):
+        super().__init__()
+        self.redis = redis.Redis.from_url(url or settings.TRIPS_REDIS_URL)
+        self.clave = clave
+        self.clave_procesos = f"{clave}:proceso:"
+        self.intervalo = intervalo
+        self.vigencia = max(vigencia, 2 * intervalo)
+        self._hilo = None
+
+    @staticmethod
+    def _campo(serie):
+        nombre, etiquetas = serie
+        return json.dumps([nombre, etiquetas])
+
+    @staticmethod
+    def _serie(campo):
+        nombre, etiquetas = json.loads(campo)
+        return nombre, tuple(tuple(par) for par in etiquetas)
+
+    def _sumar(self, deltas):
+        super()._sumar(deltas)
+        self._asegurar_hilo()
+
+    def volcar(self):
+        """Pasar a Redis lo acumulado en el proceso y sus gauges."""
+        with self._lock:
+            pendientes, self._valores = self._valores, Counter()
+        medidores = medidores_proceso()
+        if not pendientes and not medidores:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for serie, valor in pendientes.items():
+            pipe.hincrbyfloat(self.clave, self._campo(serie), valor)
+        if medidores:
+            pipe.set(
+                self.clave_procesos + worker(),
+                json.dumps(
+                    {self._campo(serie): valor for serie, valor in medidores.items()}
+                ),
+                ex=int(self.vigencia),
+            )
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            with self._lock:
+                self._valores.update(pendientes)
+            raise
+
+    def valores(self):
+        self.volcar()
+        return Counter(
+            {
+                self._serie(campo): float(valor)
+                for campo, valor in self.redis.hgetall(self.clave).items()
+            }
+        )
+
+    def medidores_workers(self):
+        """Los gauges que publicó cada worker vivo en su último volcado."""
+        claves = list(self.redis.scan_iter(match=f"{self.clave_procesos}*"))
+        medidores = {}
+        for publicado in self.redis.mget(claves) if claves else ():
+            if publicado is None:
+                continue
+            for campo, valor in json.loads(publicado).items():
+                medidores[self._serie(campo)] = valor
+        return medidores
+
+    def _asegurar_hilo(self):
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(
+                    target=self._bucle, name="metricas", daemon=True
+                )
+                self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.volcar()
+            except Exception:
+                logger.exception("Error al volcar métricas")
+
+
+@lru_cache(maxsize=None)
+def obtener_metricas():
+    """Instancia del registro configurado en TRIPS_METRICAS."""
+    ruta = getattr(settings, "TRIPS_METRICAS", "trips.metricas.MetricasMemoria")
+    return import_string(ruta)()
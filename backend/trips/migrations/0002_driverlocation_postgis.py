@@ -0,0 +1,78 @@
+import logging
+from django.db import migrations, transaction
+from django.db.utils import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+# Columna geography mantenida por un trigger a partir de latitud/longitud, de
+# modo que el ORM (update_or_create, bulk_create) no necesita conocerla.
+CREAR_COLUMNA = """
+ALTER TABLE trips_driverlocation
+    ADD COLUMN IF NOT EXISTS ubicacion geography(Point, 4326);
+
+UPDATE trips_driverlocation
+    SET ubicacion = ST_SetSRID(ST_MakePoint(longitud, latitud), 4326)::geography;
+
+CREATE INDEX IF NOT EXISTS trips_driverlocation_ubicacion_gist
+    ON trips_driverlocation USING GIST (ubicacion);
+
+CREATE OR REPLACE FUNCTION trips_driverlocation_sync_ubicacion() RETURNS trigger AS $$
+BEGIN
+    NEW.ubicacion := ST_SetSRID(ST_MakePoint(NEW.longitud, NEW.latitud), 4326)::geography;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trips_driverlocation_sync_ubicacion ON trips_driverlocation;
+CREATE TRIGGER trips_driverlocation_sync_ubicacion
+    BEFORE INSERT OR UPDATE OF latitud, longitud ON trips_driverlocation
+    FOR EACH ROW EXECUTE FUNCTION trips_driverlocation_sync_ubicacion();
+"""
+
+BORRAR_COLUMNA = """
+DROP TRIGGER IF EXISTS trips_driverlocation_sync_ubicacion ON trips_driverlocation;
+DROP FUNCTION IF EXISTS trips_driverlocation_sync_ubicacion();
+DROP INDEX IF EXISTS trips_driverlocation_ubicacion_gist;
+ALTER TABLE trips_driverlocation DROP COLUMN IF EXISTS ubicacion;
+"""
+
+
+def postgis_disponible(schema_editor):
+    """Activa PostGIS si el servidor lo ofrece. Devuelve si quedó activo."""
+    if schema_editor.connection.vendor != "postgresql":
+        return False
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'postgis'")
+        if cursor.fetchone() is None:
+            return False
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+        except DatabaseError as e:
+            logger.warning(f"No se pudo activar PostGIS: {e}")
+            return False
+    return True
+
+
+def crear_columna_geografica(apps, schema_editor):
+    if postgis_disponible(schema_editor):
+        schema_editor.execute(CREAR_COLUMNA)
+    else:
+        logger.info("PostGIS no disponible; se omite la columna geográfica")
+
+
+def borrar_columna_geografica(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(BORRAR_COLUMNA)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_columna_geografica, borrar_columna_geografica),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0002_driverlocation_postgis"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="trip",
+            name="estado",
+            field=models.CharField(
+                choices=[
+                    ("pendiente", "Pendiente"),
+                    ("asignado", "Asignado"),
+                    ("aceptado", "Aceptado"),
+                    ("cancelado", "Cancelado"),
+                    ("completado", "Completado"),
+                ],
+                default="pendiente",
+                max_length=15,
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0004_driverlocationhistory"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trip",
+            name="conductores_excluidos",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="trip",
+            name="intentos_asignacion",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0005_trip_reasignacion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trip",
+            name="conductores_ofertados",
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
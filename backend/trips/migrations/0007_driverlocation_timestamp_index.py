@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-18 16:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trips", "0006_trip_conductores_ofertados"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="driverlocation",
+            name="timestamp",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -6,6 +6,7 @@ class Trip(models.Model):
     ESTADOS = [
         ("pendiente", "Pendiente"),
         ("asignado", "Asignado"),
+        ("aceptado", "Aceptado"),
         ("cancelado", "Cancelado"),
         ("completado", "Completado"),
     ]
@@ -26,6 +27,12 @@ class Trip(models.Model):
         related_name="viajes_conductor",
     )
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Ofertas hechas y conductores que ya la rechazaron o dejaron vencer
+    # (ver trips.reasignacion)
+    intentos_asignacion = models.PositiveSmallIntegerField(default=0)
+    conductores_excluidos = models.JSONField(default=list, blank=True)
+    # Conductores con la oferta abierta vigente (TRIPS_MODO_OFERTA "abierta")
+    conductores_ofertados = models.JSONField(default=list, blank=True)
 
     def __str__(self):
         return f"Viaje {self.id}: {self.cliente} - {self.estado}"
@@ -37,7 +44,26 @@ class DriverLocation(models.Model):
     )
     latitud = models.FloatField()
     longitud = models.FloatField()
-    timestamp = models.DateTimeField(auto_now=True)
+    # Indexado para que cada proceso relea solo lo que cambió (ver
+    # trips.indice_espacial.SincronizacionIndice)
+    timestamp = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Ubicación de {self.conductor}: ({self.latitud}, {self.longitud})"
+
+
+class DriverLocationHistory(models.Model):
+    """Recorrido de un conductor: puntos con la hora en que los tomó el GPS."""
+
+    conductor = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="recorrido"
+    )
+    latitud = models.FloatField()
+    longitud = models.FloatField()
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=["conductor", "timestamp"])]
+
+    def __str__(self):
+        return f"{self.conductor} ({self.latitud}, {self.longitud}) {self.timestamp}"
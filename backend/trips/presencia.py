@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+from . import grupos
+
+
+def ventana_frescura():
+    """Segundos sin latidos tras los que un conductor deja de contar como visto."""
+    return getattr(settings, "TRIPS_PRESENCIA_FRESCURA_SEGUNDOS", 60)
+
+
+def region(lat, lon):
+    """Región de una posición para los conteos: la celda de trips.grupos."""
+    fila, columna = grupos.celda(lat, lon)
+    return f"{fila}:{columna}"
+
+
+class Presencia:
+    """
+    Última vez que se vio a cada conductor y en qué región.
+
+    TripConsumer registra un latido al conectar, con cada ubicación y con
+    cada frame "heartbeat" del cliente. El despacho solo considera a los
+    conductores vistos dentro de la ventana de frescura, así un teléfono
+    apagado sin cerrar el socket no recibe ofertas. El backend activo se
+    elige con `TRIPS_PRESENCIA`.
+    """
+
+    def latido(self, conductor_id, lat=None, lon=None):
+        """Marcar al conductor como visto ahora (y su región, si hay posición)."""
+        raise NotImplementedError
+
+    def frescos(self, ventana=None):
+        """Ids de los conductores vistos en los últimos `ventana` segundos."""
+        raise NotImplementedError
+
+    def frescos_entre(self, ids, ventana=None):
+        """Los de `ids` vistos en la ventana, sin leer todo el registro."""
+        raise NotImplementedError
+
+    def purgar(self, ventana=None):
+        """Olvidar a los conductores no vistos en la ventana. Devuelve sus ids."""
+        raise NotImplementedError
+
+    def por_region(self, ventana=None):
+        """Conteo de conductores frescos por región, para monitorear capacidad."""
+        raise NotImplementedError
+
+    def _limite(self, ventana):
+        return time.time() - (ventana_frescura() if ventana is None else ventana)
+
+
+class PresenciaMemoria(Presencia):
+    """Registro del proceso; sirve cuando hay un solo worker ASGI."""
+
+    def __init__(self):
+        self._vistos = {}  # conductor_id -> (visto_en, region)
+        self._lock = threading.Lock()
+
+    def latido(self, conductor_id, lat=None, lon=None):
+        ahora = time.time()
+        with self._lock:
+            if lat is not None and lon is not None:
+                self._vistos[conductor_id] = (ahora, region(lat, lon))
+            else:
+                anterior = self._vistos.get(conductor_id, (None, None))
+                self._vistos[conductor_id] = (ahora, anterior[1])
+
+    def frescos(self, ventana=None):
+        limite = self._limite(ventana)
+        with self._lock:
+            return {
+                conductor_id
+                for conductor_id, (visto_en, _) in self._vistos.items()
+                if visto_en >= limite
+            }
+
+    def frescos_entre(self, ids, ventana=None):
+        limite = self._limite(ventana)
+        with self._lock:
+            return {
+                conductor_id
+                for conductor_id in ids
+                if self._vistos.get(conductor_id, (limite - 1,))[0] >= limite
+            }
+
+    def purgar(self, ventana=None):
+        limite = self._limite(ventana)
+        with self._lock:
+            vencidos = [
+                conductor_id
+                for conductor_id, (visto_en, _) in self._vistos.items()
+                if visto_en < limite
+            ]
+            for conductor_id in vencidos:
+                del self._vistos[conductor_id]
+        return vencidos
+
+    def por_region(self, ventana=None):
+        limite = self._limite(ventana)
+        with self._lock:
+            return Counter(
+                region_conductor
+                for visto_en, region_conductor in self._vistos.values()
+                if visto_en >= limite and region_conductor is not None
+            )
+
+
+class PresenciaRedis(Presencia):
+    """
+    Registro compartido por todos los workers: un ZSET con la hora del último
+    latido de cada conductor y un hash con su región.
+    """
+
+    PURGAR = """
+        local vencidos = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])
+        if #vencidos > 0 then
+            redis.call('ZREM', KEYS[1], unpack(vencidos))
+            redis.call('HDEL', KEYS[2], unpack(vencidos))
+        end
+        return vencidos
+    """
+
+    def __init__(self, url=None, prefijo="trips:presencia"):
+        self.redis = redis.Redis.from_url(url or settings.TRIPS_REDIS_URL)
+        self.claves = [f"{prefijo}:vistos", f"{prefijo}:regiones"]
+        self._purgar = self.redis.register_script(self.PURGAR)
+
+    def latido(self, conductor_id, lat=None, lon=None):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zadd(self.claves[0], {conductor_id: time.time()})
+        if lat is not None and lon is not None:
+            pipe.hset(self.claves[1], conductor_id, region(lat, lon))
+        pipe.execute()
+
+    def frescos(self, ventana=None):
+        return {
+            int(miembro)
+            for miembro in self.redis.zrangebyscore(
+                self.claves[0], self._limite(ventana), "+inf"
+            )
+        }
+
+    def frescos_entre(self, ids, ventana=None):
+        ids = list(ids)
+        if not ids:
+            return set()
+        limite = self._limite(ventana)
+        vistos = self.redis.zmscore(self.claves[0], ids)
+        return {
+            conductor_id
+            for conductor_id, visto_en in zip(ids, vistos)
+            if visto_en is not None and visto_en >= limite
+        }
+
+    def purgar(self, ventana=None):
+        vencidos = self._purgar(keys=self.claves, args=[self._limite(ventana)])
+        return [int(miembro) for miembro in vencidos]
+
+    def por_region(self, ventana=None):
+        frescos = list(self.frescos(ventana))
+        if not frescos:
+            return Counter()
+        regiones = self.redis.hmget(self.claves[1], frescos)
+        return Counter(r.decode() for r in regiones if r is not None)
+
+
+@lru_cache(maxsize=None)
+def obtener_presencia():
+    """Instancia del registro configurado en TRIPS_PRESENCIA."""
+    ruta = getattr(settings, "TRIPS_PRESENCIA", "trips.presencia.PresenciaRedis")
+    return import_string(ruta)()
@@ -0,0 +1,208 @@
+import logging
+from django.conf import settings
+from . import estados
+from .disponibilidad import obtener_disponibilidad
+from .models import Trip
+from .presencia import region
+from .services import asignar_conductor, candidatos_conductor
+
+logger = logging.getLogger(__name__)
+
+# conductor_id de los temporizadores de ofertas abiertas (toda la ronda)
+OFERTA_ABIERTA = 0
+
+
+def modo_oferta():
+    """
+    "individual": un conductor por vez, con su timeout. "abierta": los k más
+    cercanos a la vez y el primero que acepta se lo lleva.
+    """
+    return getattr(settings, "TRIPS_MODO_OFERTA", "individual")
+
+
+def k_oferta(trip):
+    """Conductores por oferta abierta en la región del origen del viaje."""
+    por_region = getattr(settings, "TRIPS_OFERTA_K_POR_REGION", {})
+    defecto = getattr(settings, "TRIPS_OFERTA_K", 3)
+    return por_region.get(region(trip.origen["lat"], trip.origen["lng"]), defecto)
+
+
+def radios_busqueda(intento):
+    """
+    Radios (km) a probar para la oferta número `intento` (0 es la primera).
+
+    Cada intento arranca con un radio TRIPS_FACTOR_RADIO veces mayor que el
+    anterior; si ahí no hay nadie se sigue ampliando hasta
+    TRIPS_RADIO_MAXIMO_KM sin gastar un intento. Sin radio inicial se busca
+    sin límite de distancia.
+    """
+    inicial = getattr(settings, "TRIPS_RADIO_INICIAL_KM", None)
+    if inicial is None:
+        return [None]
+    factor = getattr(settings, "TRIPS_FACTOR_RADIO", 2)
+    maximo = getattr(settings, "TRIPS_RADIO_MAXIMO_KM", 20)
+
+    radio = min(inicial * factor**intento, maximo)
+    radios = [radio]
+    while radio < maximo and factor > 1:
+        radio = min(radio * factor, maximo)
+        radios.append(radio)
+    return radios
+
+
+def asignar_siguiente(trip):
+    """
+    Ofrecer un viaje pendiente al siguiente conductor según la política de
+    reasignación.
+
+    Se excluye a todos los conductores que ya lo rechazaron o dejaron vencer
+    (`trip.conductores_excluidos`) y el radio de búsqueda crece con cada
+    intento. Agotados TRIPS_MAX_INTENTOS_ASIGNACION, o si no hay nadie ni en
+    el radio máximo, el viaje se cancela para que deje de ocupar al despacho.
+
+    Args:
+        trip: Viaje en estado pendiente, leído de la base después del último
+            rechazo (para tener intentos y exclusiones al día)
+
+    Returns:
+        Conductor asignado, o None si el viaje se canceló o ya no estaba
+        pendiente
+    """
+    maximo = getattr(settings, "TRIPS_MAX_INTENTOS_ASIGNACION", 5)
+    if trip.intentos_asignacion >= maximo:
+        logger.warning(f"Viaje {trip.id} agotó sus {maximo} intentos de asignación")
+        return sin_conductores(trip)
+
+    excluidos = set(trip.conductores_excluidos)
+    for radio_km in radios_busqueda(trip.intentos_asignacion):
+        conductor = asignar_conductor(trip, excluir=excluidos, radio_km=radio_km)
+        if conductor is not None:
+            break
+    else:
+        logger.warning(f"Viaje {trip.id} sin conductores en el radio máximo")
+        return sin_conductores(trip)
+
+    # Solo si sigue pendiente (el pasajero pudo cancelarlo mientras tanto)
+    if not estados.asignar(trip.id, conductor.id):
+        logger.warning(f"Viaje {trip.id} ya no está pendiente")
+        obtener_disponibilidad().liberar(conductor.id)
+        return None
+
+    trip.conductor_asignado = conductor
+    trip.estado = "asignado"
+    trip.intentos_asignacion += 1
+    return conductor
+
+
+def sin_conductores(trip):
+    """
+    Cancelar el viaje si sigue pendiente: no quedan conductores o intentos.
+    Devuelve None, como una asignación sin conductor.
+    """
+    if estados.transicion(trip.id, "pendiente", "cancelado"):
+        trip.estado = "cancelado"
+    return None
+
+
+def ofrecer_siguiente(trip):
+    """
+    Abrir una oferta del viaje pendiente a los `k_oferta` conductores libres
+    más cercanos, con las mismas exclusiones, radio creciente y máximo de
+    intentos que `asignar_siguiente`. Ningún conductor queda reservado hasta
+    que acepta (ver `aceptar_oferta_abierta`).
+
+    Returns:
+        list: Conductores ofertados; vacía si el viaje se canceló o ya no
+        estaba pendiente
+    """
+    maximo = getattr(settings, "TRIPS_MAX_INTENTOS_ASIGNACION", 5)
+    if trip.intentos_asignacion >= maximo:
+        logger.warning(f"Viaje {trip.id} agotó sus {maximo} intentos de asignación")
+        sin_conductores(trip)
+        return []
+
+    k = k_oferta(trip)
+    excluidos = set(trip.conductores_excluidos)
+    for radio_km in radios_busqueda(trip.intentos_asignacion):
+        conductores = [
+            conductor
+            for _, conductor in candidatos_conductor(
+                trip, k=k, excluir=excluidos, radio_km=radio_km
+            )
+        ]
+        if conductores:
+            break
+    else:
+        logger.warning(f"Viaje {trip.id} sin conductores en el radio máximo")
+        sin_conductores(trip)
+        return []
+
+    ids = [conductor.id for conductor in conductores]
+    if not estados.ofrecer(trip.id, ids):
+        logger.warning(f"Viaje {trip.id} ya no está pendiente")
+        return []
+    trip.conductores_ofertados = ids
+    trip.intentos_asignacion += 1
+    return conductores
+
+
+def aceptar_oferta_abierta(trip_id, conductor_id):
+    """
+    El conductor toma el viaje de una oferta abierta, si nadie lo hizo antes.
+
+    Returns:
+        list: Los demás conductores ofertados (a los que hay que retirarles la
+        oferta), o None si no se lo llevó
+    """
+    ofertados = (
+        Trip.objects.filter(id=trip_id)
+        .values_list("conductores_ofertados", flat=True)
+        .first()
+    )
+    if not ofertados or conductor_id not in ofertados:
+        return None
+
+    # Reservarlo primero: pudo aceptar otra oferta abierta al mismo tiempo
+    disponibilidad = obtener_disponibilidad()
+    if not disponibilidad.ocupar(conductor_id):
+        return None
+    if not estados.aceptar_oferta(trip_id, conductor_id):
+        disponibilidad.liberar(conductor_id)
+        return None
+    return [otro for otro in ofertados if otro != conductor_id]
+
+
+def rechazar_oferta_abierta(trip_id, conductor_id):
+    """
+    Excluir al conductor de la oferta abierta. Si todos los ofertados la
+    rechazaron, la cierra.
+
+    Returns:
+        bool: True si la oferta quedó cerrada y hay que abrir la siguiente
+    """
+    if not estados.rechazar_oferta(trip_id, conductor_id):
+        return False
+    trip = Trip.objects.get(id=trip_id)
+    if not set(trip.conductores_ofertados) <= set(trip.conductores_excluidos):
+        return False
+    return estados.cerrar_oferta(trip_id, trip.conductores_ofertados)
+
+
+def expirar_oferta_abierta(trip_id):
+    """
+    Cerrar la oferta abierta que nadie aceptó a tiempo y abrir la siguiente.
+
+    Returns:
+        tuple: (trip, ofertados_antes, ofertados_ahora), o None si la oferta
+        ya no estaba vigente
+    """
+    trip = Trip.objects.filter(id=trip_id, estado="pendiente").first()
+    if trip is None or not trip.conductores_ofertados:
+        return None
+    anteriores = trip.conductores_ofertados
+    if not estados.cerrar_oferta(trip_id, anteriores):
+        return None
+    logger.info(f"Oferta abierta del viaje {trip_id} vencida. Ofreciendo a otros...")
+
+    trip.refresh_from_db()
+    return trip, anteriores, ofrecer_siguiente(trip)
@@ -1,7 +1,9 @@
 import logging
-from math import radians, sin, cos, sqrt, atan2
-from .models import DriverLocation
 from django.contrib.auth import get_user_model
+from .disponibilidad import obtener_disponibilidad
+from .geo import distancias_km
+from .presencia import obtener_presencia, ventana_frescura
+from .ubicaciones import obtener_almacen
 
 # Definir el modelo de usuario
 Conductor = get_user_model()
@@ -13,40 +15,17 @@ def calcular_distancia(punto1, punto2):
     """
     Calcula la distancia en kilómetros entre dos puntos usando la fórmula de Haversine.
 
+    Se mantiene por compatibilidad; para muchos puntos usar `distancias_km`.
+
     Args:
         punto1: Tupla (latitud, longitud) del primer punto
         punto2: Tupla (latitud, longitud) del segundo punto
 
     Returns:
-        float: Distancia en kilómetros
+        float: Distancia en kilómetros, redondeada a 2 decimales
     """
-    import math
-
-    lat1, lon1 = punto1
     lat2, lon2 = punto2
-
-    # Radio de la Tierra en kilómetros
-    R = 6371.0
-
-    # Convertir latitudes y longitudes de grados a radianes
-    lat1 = math.radians(lat1)
-    lon1 = math.radians(lon1)
-    lat2 = math.radians(lat2)
-    lon2 = math.radians(lon2)
-
-    # Diferencias en coordenadas
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-
-    # Fórmula de Haversine
-    a = (
-        math.sin(dlat / 2) ** 2
-        + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-    )
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    distancia = R * c
-
-    return round(distancia, 2)
+    return round(float(distancias_km(punto1, [lat2], [lon2])[0]), 2)
 
 
 # def asignar_conductor(trip):
@@ -82,50 +61,88 @@ def calcular_distancia(punto1, punto2):
 #         return None
 
 
-def asignar_conductor(trip, excluir_conductor=None):
-    """Asignar el conductor más cercano a un viaje."""
-    logger.info(f"Iniciando asignación de conductor para viaje {trip.id}")
-
-    # Obtener conductores disponibles, excluyendo el conductor anterior si existe
-    conductores = Conductor.objects.filter(rol="Conductor")
-    if excluir_conductor:
-        conductores = conductores.exclude(id=excluir_conductor.id)
+def candidatos_conductor(trip, k=1, excluir=None, radio_km=None):
+    """
+    Conductores conectados, libres y vistos dentro de la ventana de frescura
+    (TRIPS_PRESENCIA_FRESCURA_SEGUNDOS) más cercanos al origen del viaje, de
+    menor a mayor distancia.
 
-    logger.info(f"Conductores disponibles: {conductores.count()}")
+    Pide al almacén los más cercanos en tandas que se duplican y consulta la
+    disponibilidad y la presencia solo de esos ids, sin leer los registros de
+    toda la flota.
 
-    if not conductores.exists():
-        return None
+    Args:
+        trip: Viaje con `origen` {'lat': ..., 'lng': ...}
+        k: Cantidad máxima de candidatos
+        excluir: Ids de conductores que no se deben considerar
+        radio_km: Distancia máxima al origen (None: sin límite)
 
+    Returns:
+        list: Tuplas (distancia_km, conductor)
+    """
     origen = (trip.origen["lat"], trip.origen["lng"])
-    logger.info(f"Origen del viaje: {origen}")
-
-    # Encontrar el conductor más cercano
-    conductor_mas_cercano = None
-    menor_distancia = float("inf")
-
-    for conductor in conductores:
-        try:
-            ubicacion = DriverLocation.objects.get(conductor=conductor)
-            punto_conductor = (ubicacion.latitud, ubicacion.longitud)
-
-            distancia = calcular_distancia(origen, punto_conductor)
-            logger.info(f"Conductor {conductor.email} a {distancia:.2f} km")
+    almacen = obtener_almacen()
+    disponibilidad = obtener_disponibilidad()
+    presencia = obtener_presencia() if ventana_frescura() else None
+
+    vistos = set(excluir or ())
+    candidatos = []
+    tanda = 2 * k
+    while len(candidatos) < k:
+        cercanos = almacen.candidatos(*origen, k=tanda, excluir=vistos)
+        if not cercanos:
+            break
+        # Vienen ordenados: pasado el radio no quedan más
+        dentro = [c for c in cercanos if radio_km is None or c[0] <= radio_km]
+
+        libres = disponibilidad.disponibles_entre([c.id for _, c in dentro])
+        if presencia is not None:
+            libres = presencia.frescos_entre(libres)
+        candidatos.extend(c for c in dentro if c[1].id in libres)
+
+        if len(dentro) < len(cercanos):
+            break
+        vistos.update(conductor.id for _, conductor in cercanos)
+        tanda *= 2
+    return candidatos[:k]
+
+
+def asignar_conductor(trip, excluir_conductor=None, k=5, excluir=None, radio_km=None):
+    """
+    Asignar el conductor libre más cercano a un viaje.
 
-            if distancia < menor_distancia:
-                menor_distancia = distancia
-                conductor_mas_cercano = conductor
+    El conductor elegido queda reservado en el registro de disponibilidad;
+    si otro viaje lo reservó antes se prueba con el siguiente candidato.
+    `excluir` son ids de conductores a descartar además de `excluir_conductor`
+    y `radio_km` limita la distancia al origen.
+    """
+    logger.info(f"Iniciando asignación de conductor para viaje {trip.id}")
+    logger.info(f"Origen del viaje: {(trip.origen['lat'], trip.origen['lng'])}")
 
-        except DriverLocation.DoesNotExist:
+    # Buscar en el almacén de ubicaciones, excluyendo el conductor anterior
+    excluidos = set(excluir or ())
+    if excluir_conductor:
+        excluidos.add(excluir_conductor.id)
+    disponibilidad = obtener_disponibilidad()
+    while True:
+        candidatos = candidatos_conductor(
+            trip, k=k, excluir=excluidos, radio_km=radio_km
+        )
+        if not candidatos:
+            logger.warning("No hay conductores disponibles")
+            return None
+
+        for distancia, conductor in candidatos:
+            if disponibilidad.ocupar(conductor.id):
+                break
+            excluidos.add(conductor.id)
+        else:
             continue
 
-    if conductor_mas_cercano:
-        logger.info(
-            f"""
+        logger.info(f"""
 === Conductor Seleccionado ===
-ID: {conductor_mas_cercano.id}
-Email: {conductor_mas_cercano.email}
-Distancia: {menor_distancia:.2f} km
-============================="""
-        )
-
-    return conductor_mas_cercano
+ID: {conductor.id}
+Email: {conductor.email}
+Distancia: {distancia:.2f} km
+=============================""")
+        return conductor
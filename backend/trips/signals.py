@@ -0,0 +1,43 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from . import estados
+from .models import DriverLocation, Trip
+from .indice_espacial import indice_conductores
+from .metricas import medir_consultas
+from .ubicaciones import obtener_almacen
+
+
+@receiver(connection_created)
+def medir_consultas_de_acciones(sender, connection, **kwargs):
+    """Contar en trips.metricas las consultas de cada conexión nueva."""
+    if medir_consultas not in connection.execute_wrappers:
+        connection.execute_wrappers.append(medir_consultas)
+
+
+@receiver(post_save, sender=DriverLocation)
+def actualizar_indice(sender, instance, **kwargs):
+    """Reflejar en el índice espacial cada ubicación guardada."""
+    if not obtener_almacen().usa_indice:
+        return
+    indice_conductores.actualizar(
+        instance.conductor_id, instance.latitud, instance.longitud
+    )
+
+
+@receiver(post_delete, sender=DriverLocation)
+def quitar_del_indice(sender, instance, **kwargs):
+    if not obtener_almacen().usa_indice:
+        return
+    indice_conductores.eliminar(instance.conductor_id)
+
+
+@receiver(post_save, sender=Trip)
+def liberar_conductor(sender, instance, **kwargs):
+    """Un viaje terminado o cancelado devuelve su conductor a los disponibles."""
+    if (
+        instance.estado in ("completado", "cancelado")
+        and instance.conductor_asignado_id
+    ):
+        # Las transiciones de trips.estados usan UPDATE y liberan por su cuenta
+        estados.liberar_conductor(instance.id, instance.conductor_asignado_id)
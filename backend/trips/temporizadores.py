@@ -0,0 +1,354 @@
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from functools import lru_cache
+import redis
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils.module_loading import import_string
+from . import estados, tramas
+from .concurrencia import en_hilo
+from .disponibilidad import obtener_disponibilidad
+from .models import Trip
+from .reasignacion import (
+    OFERTA_ABIERTA,
+    asignar_siguiente,
+    expirar_oferta_abierta,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AlmacenTemporizadores:
+    """
+    Interfaz de los almacenes de vencimientos de ofertas de `Temporizadores`.
+
+    Cada temporizador es un miembro "trip_id:conductor_id" con su vencimiento
+    en epoch. El backend activo se elige con `TRIPS_ALMACEN_TEMPORIZADORES`.
+    """
+
+    def guardar(self, miembro, vence):
+        raise NotImplementedError
+
+    def quitar(self, miembro):
+        """Borrar un temporizador. Devuelve True si existía (lo reclama)."""
+        raise NotImplementedError
+
+    def proximos(self, hasta):
+        """Pares (miembro, vence) que vencen antes de `hasta`."""
+        raise NotImplementedError
+
+    def pendientes(self):
+        raise NotImplementedError
+
+
+class AlmacenTemporizadoresMemoria(AlmacenTemporizadores):
+    """Temporizadores del proceso; se pierden al reiniciar."""
+
+    def __init__(self):
+        self._vencimientos = {}  # miembro -> vence (epoch)
+        self._lock = threading.Lock()
+
+    def guardar(self, miembro, vence):
+        with self._lock:
+            self._vencimientos[miembro] = vence
+
+    def quitar(self, miembro):
+        with self._lock:
+            return self._vencimientos.pop(miembro, None) is not None
+
+    def proximos(self, hasta):
+        with self._lock:
+            return [(m, v) for m, v in self._vencimientos.items() if v <= hasta]
+
+    def pendientes(self):
+        with self._lock:
+            return len(self._vencimientos)
+
+
+class AlmacenTemporizadoresRedis(AlmacenTemporizadores):
+    """
+    Temporizadores en un sorted set de Redis con el vencimiento como score.
+    Sobreviven a reinicios y los comparten todos los workers: el que logra
+    el ZREM es el único que dispara el vencimiento.
+    """
+
+    def __init__(self, url=None, clave="trips:temporizadores"):
+        self.redis = redis.Redis.from_url(url or settings.TRIPS_REDIS_URL)
+        self.clave = clave
+
+    def guardar(self, miembro, vence):
+        self.redis.zadd(self.clave, {miembro: vence})
+
+    def quitar(self, miembro):
+        return bool(self.redis.zrem(self.clave, miembro))
+
+    def proximos(self, hasta):
+        return [
+            (miembro.decode(), vence)
+            for miembro, vence in self.redis.zrangebyscore(
+                self.clave, "-inf", hasta, withscores=True
+            )
+        ]
+
+    def pendientes(self):
+        return self.redis.zcard(self.clave)
+
+
+@lru_cache(maxsize=None)
+def obtener_almacen_temporizadores():
+    """Instancia del almacén configurado en TRIPS_ALMACEN_TEMPORIZADORES."""
+    ruta = getattr(
+        settings,
+        "TRIPS_ALMACEN_TEMPORIZADORES",
+        "trips.temporizadores.AlmacenTemporizadoresRedis",
+    )
+    return import_string(ruta)()
+
+
+class Temporizadores:
+    """
+    Programador de vencimientos de ofertas de viaje.
+
+    Un heap en memoria ordena los vencimientos de este proceso y una sola
+    tarea duerme hasta el próximo, en lugar de una corrutina dormida por
+    oferta. Cada temporizador se guarda también en el almacén, de donde se
+    recuperan cada `intervalo_recuperacion` segundos los que programaron
+    otros procesos o un proceso ya reiniciado.
+    """
+
+    def __init__(self, almacen, al_vencer, intervalo_recuperacion=5):
+        self.almacen = almacen
+        self.al_vencer = al_vencer  # corrutina (trip_id, conductor_id)
+        self.intervalo_recuperacion = intervalo_recuperacion
+        self._heap = []  # (vence, miembro)
+        self._vigentes = {}  # miembro -> vence; lo demás en el heap está anulado
+        self._despertar = asyncio.Event()
+        self._tarea = None
+        self._disparos = set()
+
+        # Métricas
+        self.programados = 0
+        self.cancelados = 0
+        self.disparados = 0
+
+    @staticmethod
+    def _miembro(trip_id, conductor_id):
+        return f"{trip_id}:{conductor_id}"
+
+    async def programar(self, trip_id, conductor_id, segundos=None):
+        """Vencer la oferta del viaje al conductor dentro de `segundos`."""
+        if segundos is None:
+            segundos = getattr(settings, "TRIPS_TIMEOUT_OFERTA_SEGUNDOS", 30)
+        miembro = self._miembro(trip_id, conductor_id)
+        vence = time.time() + segundos
+        await en_hilo(self.almacen.guardar)(miembro, vence)
+        self._agendar(miembro, vence)
+        self.programados += 1
+        self.iniciar()
+
+    async def cancelar(self, trip_id, conductor_id):
+        """Anular la oferta (el conductor respondió). Devuelve si existía."""
+        miembro = self._miembro(trip_id, conductor_id)
+        self._vigentes.pop(miembro, None)
+        existia = await en_hilo(self.almacen.quitar)(miembro)
+        if existia:
+            self.cancelados += 1
+        return existia
+
+    def pendientes(self):
+        """Temporizadores vigentes en todo el almacén."""
+        return self.almacen.pendientes()
+
+    def metricas(self):
+        return {
+            "pendientes_proceso": len(self._vigentes),
+            "programados": self.programados,
+            "cancelados": self.cancelados,
+            "disparados": self.disparados,
+        }
+
+    def iniciar(self):
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.create_task(self.ejecutar())
+
+    async def detener(self):
+        if self._tarea is not None and not self._tarea.done():
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+
+    def _agendar(self, miembro, vence):
+        adelanta = not self._heap or vence < self._heap[0][0]
+        self._vigentes[miembro] = vence
+        heapq.heappush(self._heap, (vence, miembro))
+        if adelanta:
+            self._despertar.set()
+
+    async def _recuperar(self, ahora):
+        proximos = await en_hilo(self.almacen.proximos)(
+            ahora + self.intervalo_recuperacion
+        )
+        for miembro, vence in proximos:
+            if self._vigentes.get(miembro) != vence:
+                self._agendar(miembro, vence)
+
+    async def ejecutar(self):
+        """Bucle principal; corre hasta que se cancela la tarea."""
+        siguiente_recuperacion = 0
+        while True:
+            ahora = time.time()
+            if ahora >= siguiente_recuperacion:
+                try:
+                    await self._recuperar(ahora)
+                except Exception:
+                    logger.exception("Error al recuperar temporizadores")
+                siguiente_recuperacion = ahora + self.intervalo_recuperacion
+
+            while self._heap and self._heap[0][0] <= ahora:
+                vence, miembro = heapq.heappop(self._heap)
+                if self._vigentes.get(miembro) != vence:
+                    continue  # cancelado o reprogramado
+                del self._vigentes[miembro]
+                tarea = asyncio.create_task(self._disparar(miembro))
+                self._disparos.add(tarea)
+                tarea.add_done_callback(self._disparos.discard)
+
+            espera = siguiente_recuperacion - ahora
+            if self._heap:
+                espera = min(espera, self._heap[0][0] - ahora)
+            self._despertar.clear()
+            try:
+                await asyncio.wait_for(self._despertar.wait(), max(espera, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _disparar(self, miembro):
+        try:
+            # Otro proceso pudo dispararlo o el conductor respondió
+            if not await en_hilo(self.almacen.quitar)(miembro):
+                return
+            self.disparados += 1
+            trip_id, conductor_id = (int(parte) for parte in miembro.split(":"))
+            await self.al_vencer(trip_id, conductor_id)
+        except Exception:
+            logger.exception(f"Error al vencer la oferta {miembro}")
+
+
+def expirar_oferta(trip_id, conductor_id):
+    """
+    Quitar el viaje al conductor que no respondió y ofrecerlo a otro.
+
+    Returns:
+        tuple: (trip, nuevo_conductor o None), o None si la oferta ya no
+        estaba vigente
+    """
+    # Solo si sigue asignado al mismo conductor (pudo aceptar justo ahora)
+    if not estados.rechazar(trip_id, conductor_id):
+        return None
+    logger.info(f"Timeout alcanzado para viaje {trip_id}. Reasignando...")
+    obtener_disponibilidad().liberar(conductor_id)
+
+    # Releer el viaje: el rechazo sumó al conductor a las exclusiones
+    trip = Trip.objects.get(id=trip_id)
+    return trip, asignar_siguiente(trip)
+
+
+async def vencer_oferta(trip_id, conductor_id):
+    """Acción por defecto al vencer una oferta: reasignar y notificar."""
+    if conductor_id == OFERTA_ABIERTA:
+        resultado = await en_hilo(expirar_oferta_abierta)(trip_id)
+        if resultado is None:
+            return
+        trip, anteriores, conductores = resultado
+        await retirar_oferta(trip.id, anteriores)
+        await notificar_oferta_abierta(trip, conductores)
+        return
+
+    resultado = await en_hilo(expirar_oferta)(trip_id, conductor_id)
+    if resultado is None:
+        return
+    trip, conductor_asignado = resultado
+
+    # Notificar al conductor anterior que perdió el viaje
+    await get_channel_layer().group_send(
+        f"drivers_{conductor_id}", tramas.evento_timeout(trip.id)
+    )
+    await notificar_reasignacion(trip, conductor_asignado)
+
+
+async def notificar_reasignacion(trip, conductor_asignado):
+    """
+    Avisar el resultado de `asignar_siguiente`: la oferta al conductor nuevo
+    (con su timeout) y la novedad al pasajero, que recibe
+    "no_drivers_available" si el viaje se canceló.
+    """
+    channel_layer = get_channel_layer()
+    if conductor_asignado:
+        await channel_layer.group_send(
+            f"drivers_{conductor_asignado.id}", tramas.evento_oferta(trip)
+        )
+        await obtener_temporizadores().programar(trip.id, conductor_asignado.id)
+        novedad = {"status": "trip_assigned", "driver_id": conductor_asignado.id}
+    elif trip.estado == "cancelado":
+        novedad = {"status": "no_drivers_available"}
+    else:
+        return
+
+    await channel_layer.group_send(
+        f"passenger_{trip.cliente_id}",
+        tramas.evento("trip_status", {**novedad, "trip_id": str(trip.id)}),
+    )
+
+
+async def notificar_oferta_abierta(trip, conductores):
+    """
+    Avisar el resultado de `ofrecer_siguiente`: la misma oferta (codificada
+    una vez) a todos los conductores, un único timeout para la ronda y la
+    novedad al pasajero.
+    """
+    channel_layer = get_channel_layer()
+    if conductores:
+        evento = tramas.evento_oferta(trip)
+        for conductor in conductores:
+            await channel_layer.group_send(f"drivers_{conductor.id}", evento)
+        await obtener_temporizadores().programar(trip.id, OFERTA_ABIERTA)
+        novedad = {"status": "trip_offered", "drivers": len(conductores)}
+    elif trip.estado == "cancelado":
+        novedad = {"status": "no_drivers_available"}
+    else:
+        return
+
+    await channel_layer.group_send(
+        f"passenger_{trip.cliente_id}",
+        tramas.evento("trip_status", {**novedad, "trip_id": str(trip.id)}),
+    )
+
+
+async def retirar_oferta(trip_id, conductor_ids):
+    """Avisar a los conductores que la oferta abierta ya no está."""
+    channel_layer = get_channel_layer()
+    evento = tramas.evento_retiro(trip_id)
+    for conductor_id in conductor_ids:
+        await channel_layer.group_send(f"drivers_{conductor_id}", evento)
+
+
+_programadores = {}
+
+
+def obtener_temporizadores():
+    """Programador de timeouts del event loop actual."""
+    loop = asyncio.get_running_loop()
+    programador = _programadores.get(loop)
+    if programador is None:
+        # Descartar programadores de loops ya cerrados
+        for anterior in [otro for otro in _programadores if otro.is_closed()]:
+            del _programadores[anterior]
+        programador = _programadores[loop] = Temporizadores(
+            obtener_almacen_temporizadores(), vencer_oferta
+        )
+    return programador
@@ -0,0 +1,57 @@
+import json
+import msgpack
+
+
+def codificar(contenido):
+    """
+    Tramas WebSocket de un mensaje, en los dos formatos que hablan los
+    clientes: texto JSON y binario MessagePack (ver TripConsumer).
+    """
+    return {"json": json.dumps(contenido), "msgpack": msgpack.packb(contenido)}
+
+
+def evento(tipo, contenido, **campos):
+    """
+    Evento del channel layer que lleva `contenido` ya codificado.
+
+    Para un aviso a muchos conductores el mensaje se serializa una sola vez
+    acá y cada consumer reenvía los bytes sin volver a armar ni codificar el
+    dict. `campos` son los datos que el consumer necesita leer del evento.
+    """
+    return {"type": tipo, **campos, "tramas": codificar(contenido)}
+
+
+def evento_oferta(trip):
+    """Oferta de un viaje a un conductor (handler notify_trip_assigned)."""
+    return evento(
+        "notify_trip_assigned",
+        {
+            "type": "trip_assigned",
+            "trip_id": str(trip.id),
+            "origen": trip.origen,
+            "destino": trip.destino,
+        },
+        trip_id=str(trip.id),
+    )
+
+
+def evento_timeout(trip_id):
+    """Aviso al conductor que perdió el viaje por no responder a tiempo."""
+    return evento(
+        "notify_trip_timeout",
+        {
+            "type": "trip_timeout",
+            "trip_id": str(trip_id),
+            "message": "Viaje reasignado por falta de respuesta",
+        },
+        trip_id=str(trip_id),
+    )
+
+
+def evento_retiro(trip_id):
+    """Oferta abierta retirada: otro conductor tomó el viaje o se venció."""
+    return evento(
+        "notify_trip_withdrawn",
+        {"type": "trip_withdrawn", "trip_id": str(trip_id)},
+        trip_id=str(trip_id),
+    )
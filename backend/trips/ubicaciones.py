@@ -0,0 +1,300 @@
+import logging
+import redis
+from functools import lru_cache
+from math import radians, cos
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+from django.utils.module_loading import import_string
+from .buffer_ubicaciones import obtener_buffer
+from .geo import RADIO_TIERRA_KM
+from .indice_espacial import obtener_indice
+from .models import DriverLocation
+
+logger = logging.getLogger(__name__)
+
+
+class AlmacenUbicaciones:
+    """
+    Interfaz de los almacenes de posiciones en vivo de los conductores.
+
+    El consumer escribe cada ping con `guardar` y el despacho consulta con
+    `cercanos`. El backend activo se elige con `TRIPS_ALMACEN_UBICACIONES`.
+    `usa_indice` indica si busca en el índice espacial del proceso, que solo
+    entonces se alimenta con las señales de DriverLocation.
+    """
+
+    usa_indice = False
+
+    def guardar(self, conductor_id, lat, lon):
+        raise NotImplementedError
+
+    def eliminar(self, conductor_id):
+        raise NotImplementedError
+
+    def cercanos(self, lat, lon, k=1, excluir=None, solo=None):
+        """
+        Hasta `k` tuplas (distancia_km, conductor_id), de menor a mayor. Con
+        `solo` se consideran únicamente los ids de ese conjunto.
+        """
+        raise NotImplementedError
+
+    def volcar(self):
+        """Persistir en DriverLocation lo pendiente. Devuelve filas escritas."""
+        return 0
+
+    def candidatos(self, lat, lon, k=1, excluir=None, solo=None):
+        """
+        Hasta `k` tuplas (distancia_km, conductor) ya validadas contra
+        users.User. Las entradas obsoletas (usuario borrado o que dejó de ser
+        conductor) se eliminan del almacén.
+        """
+        excluir = set(excluir or ())
+        while True:
+            cercanos = self.cercanos(lat, lon, k=k, excluir=excluir, solo=solo)
+            if not cercanos:
+                return []
+
+            # Una sola consulta para validar a todos los candidatos
+            conductores = (
+                get_user_model()
+                .objects.filter(rol="Conductor")
+                .in_bulk([conductor_id for _, conductor_id in cercanos])
+            )
+
+            validos = []
+            for distancia, conductor_id in cercanos:
+                conductor = conductores.get(conductor_id)
+                if conductor is None:
+                    self.eliminar(conductor_id)
+                    excluir.add(conductor_id)
+                    continue
+                validos.append((distancia, conductor))
+            if validos:
+                return validos
+
+
+class AlmacenUbicacionesDB(AlmacenUbicaciones):
+    """
+    Escribe cada posición en DriverLocation y busca en el índice espacial del
+    proceso, que se mantiene al día con las señales del modelo y relee la
+    tabla cada TRIPS_INDICE_SINCRONIZACION_SEGUNDOS. Si
+    TRIPS_BUFFER_UBICACIONES está activo, las filas se escriben en lote desde
+    el buffer de escritura diferida.
+    """
+
+    usa_indice = True
+
+    def guardar(self, conductor_id, lat, lon):
+        buffer = obtener_buffer()
+        if buffer is None:
+            DriverLocation.objects.update_or_create(
+                conductor_id=conductor_id, defaults={"latitud": lat, "longitud": lon}
+            )
+            return
+
+        # Con escritura diferida el índice se actualiza ya y la fila después
+        obtener_indice().actualizar(conductor_id, lat, lon)
+        buffer.agregar(conductor_id, lat, lon)
+
+    def eliminar(self, conductor_id):
+        buffer = obtener_buffer()
+        if buffer is not None:
+            buffer.descartar(conductor_id)
+        DriverLocation.objects.filter(conductor_id=conductor_id).delete()
+        obtener_indice().eliminar(conductor_id)
+
+    def cercanos(self, lat, lon, k=1, excluir=None, solo=None):
+        return obtener_indice().k_mas_cercanos(
+            lat, lon, k=k, excluir=excluir, solo=solo
+        )
+
+
+def distancia_haversine_sql(lat, lon, campo_lat="latitud", campo_lon="longitud"):
+    """
+    Expresión ORM con la distancia Haversine (km) desde (lat, lon) hasta los
+    campos indicados, para usar en `annotate` y `order_by`.
+    """
+    lat_campo = Radians(F(campo_lat), output_field=FloatField())
+    dlat = lat_campo - Value(radians(lat))
+    dlon = Radians(F(campo_lon), output_field=FloatField()) - Value(radians(lon))
+    a = Power(Sin(dlat / 2), 2) + Value(cos(radians(lat))) * Cos(lat_campo) * Power(
+        Sin(dlon / 2), 2
+    )
+    # Least evita errores de dominio en ASin por redondeo en puntos antípodas
+    return Value(2 * RADIO_TIERRA_KM) * ASin(Sqrt(Least(a, Value(1.0))))
+
+
+class AlmacenUbicacionesSQL(AlmacenUbicacionesDB):
+    """
+    Igual que AlmacenUbicacionesDB para escribir, pero calcula la distancia en
+    la base: une users.User con DriverLocation, filtra y ordena por Haversine
+    con LIMIT k en una sola consulta. No necesita PostGIS ni índice en memoria,
+    así que no lo alimenta.
+    """
+
+    usa_indice = False
+
+    def guardar(self, conductor_id, lat, lon):
+        buffer = obtener_buffer()
+        if buffer is None:
+            DriverLocation.objects.update_or_create(
+                conductor_id=conductor_id, defaults={"latitud": lat, "longitud": lon}
+            )
+        else:
+            buffer.agregar(conductor_id, lat, lon)
+
+    def eliminar(self, conductor_id):
+        buffer = obtener_buffer()
+        if buffer is not None:
+            buffer.descartar(conductor_id)
+        DriverLocation.objects.filter(conductor_id=conductor_id).delete()
+
+    def candidatos(self, lat, lon, k=1, excluir=None, solo=None):
+        conductores = get_user_model().objects.filter(
+            rol="Conductor", ubicacion__isnull=False
+        )
+        if solo is not None:
+            conductores = conductores.filter(id__in=solo)
+        if excluir:
+            conductores = conductores.exclude(id__in=excluir)
+        conductores = conductores.annotate(
+            distancia=distancia_haversine_sql(
+                lat, lon, "ubicacion__latitud", "ubicacion__longitud"
+            )
+        ).order_by("distancia")[:k]
+        return [(conductor.distancia, conductor) for conductor in conductores]
+
+    def cercanos(self, lat, lon, k=1, excluir=None, solo=None):
+        return [
+            (distancia, conductor.id)
+            for distancia, conductor in self.candidatos(lat, lon, k, excluir, solo)
+        ]
+
+
+class AlmacenUbicacionesPostGIS(AlmacenUbicacionesSQL):
+    """
+    Igual que AlmacenUbicacionesSQL para escribir, pero resuelve la búsqueda en
+    Postgres ordenando por `<->` sobre la columna geography `ubicacion` y su
+    índice GiST (migración 0002, solo aplicada si el servidor tiene PostGIS).
+    """
+
+    CONSULTA = """
+        SELECT u.*, ST_Distance(dl.ubicacion, p.punto) / 1000.0 AS distancia
+        FROM {ubicaciones} dl
+        JOIN {usuarios} u ON u.id = dl.conductor_id,
+        (SELECT ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography AS punto) p
+        WHERE u.rol = 'Conductor'
+            AND NOT (dl.conductor_id = ANY(%s::bigint[]))
+            AND (%s::bigint[] IS NULL OR dl.conductor_id = ANY(%s::bigint[]))
+        ORDER BY dl.ubicacion <-> p.punto
+        LIMIT %s
+    """
+
+    def candidatos(self, lat, lon, k=1, excluir=None, solo=None):
+        User = get_user_model()
+        consulta = self.CONSULTA.format(
+            ubicaciones=DriverLocation._meta.db_table, usuarios=User._meta.db_table
+        )
+        solo = list(solo) if solo is not None else None
+        filas = User.objects.raw(
+            consulta, [lon, lat, list(excluir or ()), solo, solo, k]
+        )
+        return [(fila.distancia, fila) for fila in filas]
+
+
+class AlmacenUbicacionesRedis(AlmacenUbicaciones):
+    """
+    Mantiene las posiciones en un geo set de Redis (GEOADD/GEOSEARCH) y solo
+    toca Postgres al volcar instantáneas con `volcar`, que se ejecuta
+    periódicamente con `manage.py volcar_ubicaciones`.
+    """
+
+    def __init__(self, url=None, prefijo="trips:ubicaciones", radio_km=None):
+        self.redis = redis.Redis.from_url(url or settings.TRIPS_REDIS_URL)
+        self.clave = prefijo
+        self.clave_pendientes = f"{prefijo}:pendientes"
+        self.radio_km = radio_km or getattr(settings, "TRIPS_RADIO_BUSQUEDA_KM", 50)
+
+    def guardar(self, conductor_id, lat, lon):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.geoadd(self.clave, (lon, lat, conductor_id))
+        pipe.sadd(self.clave_pendientes, conductor_id)
+        pipe.execute()
+
+    def eliminar(self, conductor_id):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrem(self.clave, conductor_id)
+        pipe.srem(self.clave_pendientes, conductor_id)
+        pipe.execute()
+
+    def cercanos(self, lat, lon, k=1, excluir=None, solo=None):
+        excluir = excluir or ()
+        cantidad = k + len(excluir)
+        while True:
+            resultados = self.redis.geosearch(
+                self.clave,
+                longitude=lon,
+                latitude=lat,
+                radius=self.radio_km,
+                unit="km",
+                sort="ASC",
+                count=cantidad,
+                withdist=True,
+            )
+            cercanos = []
+            for miembro, distancia in resultados:
+                conductor_id = int(miembro)
+                if conductor_id in excluir:
+                    continue
+                if solo is not None and conductor_id not in solo:
+                    continue
+                cercanos.append((distancia, conductor_id))
+                if len(cercanos) == k:
+                    return cercanos
+
+            # Si se filtraron demasiados, pedir más hasta agotar el radio
+            if len(resultados) < cantidad:
+                return cercanos
+            cantidad *= 4
+
+    def volcar(self, lote=500):
+        """Escribir en DriverLocation las posiciones que cambiaron."""
+        total = 0
+        while True:
+            miembros = self.redis.spop(self.clave_pendientes, lote)
+            if not miembros:
+                return total
+
+            posiciones = self.redis.geopos(self.clave, *miembros)
+            ids = [int(miembro) for miembro in miembros]
+
+            # Ignorar conductores borrados para no romper el lote por la FK
+            existentes = set(
+                get_user_model().objects.filter(id__in=ids).values_list("id", flat=True)
+            )
+            ubicaciones = [
+                DriverLocation(
+                    conductor_id=conductor_id, longitud=pos[0], latitud=pos[1]
+                )
+                for conductor_id, pos in zip(ids, posiciones)
+                if pos is not None and conductor_id in existentes
+            ]
+            DriverLocation.objects.bulk_create(
+                ubicaciones,
+                update_conflicts=True,
+                unique_fields=["conductor"],
+                update_fields=["latitud", "longitud", "timestamp"],
+            )
+            total += len(ubicaciones)
+            logger.debug(f"Volcadas {len(ubicaciones)} ubicaciones a la base")
+
+
+@lru_cache(maxsize=None)
+def obtener_almacen():
+    """Instancia del almacén configurado en TRIPS_ALMACEN_UBICACIONES."""
+    ruta = getattr(
+        settings, "TRIPS_ALMACEN_UBICACIONES", "trips.ubicaciones.AlmacenUbicacionesDB"
+    )
+    return import_string(ruta)()
@@ -0,0 +1,6 @@
+from django.urls import path
+from .views import metricas
+
+urlpatterns = [
+    path("metrics", metricas, name="metrics"),
+]
@@ -1,3 +1,19 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from .metricas import obtener_metricas
 
-# Create your views here.
+
+@require_GET
+def metricas(request):
+    """
+    Métricas de TripConsumer en formato de texto Prometheus. Si está definido
+    TRIPS_METRICAS_TOKEN, se exige como `Authorization: Bearer <token>`.
+    """
+    token = getattr(settings, "TRIPS_METRICAS_TOKEN", None)
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponse(status=401)
+    return HttpResponse(
+        obtener_metricas().exportar(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
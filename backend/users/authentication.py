@@ -1,25 +1,29 @@
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import AuthenticationFailed
-from .models import Token
+from rest_framework_simplejwt.settings import api_settings
+from .cache_tokens import sesion_activa
 
 
 class CustomJWTAuthentication(JWTAuthentication):
     def authenticate(self, request):
-        # Llama al método original de autenticación para validar el token
-        response = super().authenticate(request)
+        header = self.get_header(request)
+        if header is None:
+            return None
 
-        if response is not None:
-            user, validated_token = response
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
 
-            # Obtener el access token en formato de cadena
-            access_token_str = str(validated_token)
+        # Firma y vencimiento se validan localmente, sin la base
+        validated_token = self.get_validated_token(raw_token)
 
-            # Verificar si el token existe en la base de datos
-            if not Token.objects.filter(
-                user=user, access_token=access_token_str
-            ).exists():
-                raise AuthenticationFailed("Token is invalid or user is logged out.")
+        # Verificar que la sesión sigue registrada (cacheado por jti)
+        user = sesion_activa(
+            validated_token[api_settings.JTI_CLAIM],
+            validated_token[api_settings.USER_ID_CLAIM],
+            validated_token["exp"],
+        )
+        if user is None:
+            raise AuthenticationFailed("Token is invalid or user is logged out.")
 
-            return (user, validated_token)
-
-        return None
+        return (user, validated_token)
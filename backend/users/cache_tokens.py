@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from .models import Token
+
+# Distingue "no está en la cache" de un valor guardado
+FALTA = object()
+
+
+class CacheTTL:
+    """
+    Cache LRU acotada en entradas y con vencimiento por entrada.
+
+    Es del proceso: una invalidación solo alcanza a este worker y los demás
+    ven el cambio cuando vence la entrada, así que el TTL acota cuánto tarda
+    en propagarse una revocación.
+    """
+
+    def __init__(self, max_entradas=10000, ttl_segundos=60):
+        self.max_entradas = max_entradas
+        self.ttl = ttl_segundos
+        self._entradas = OrderedDict()  # clave -> (vence, valor)
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return FALTA
+            vence, valor = entrada
+            if vence <= time.monotonic():
+                del self._entradas[clave]
+                return FALTA
+            self._entradas.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def borrar(self, clave):
+        with self._lock:
+            self._entradas.pop(clave, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+# Sesiones validadas: jti del access token -> campos del usuario (ver
+# CAMPOS_USUARIO), o False si está revocada o el usuario inactivo
+cache_sesiones = CacheTTL(
+    getattr(settings, "TOKENS_CACHE_MAX_ENTRADAS", 10000),
+    getattr(settings, "TOKENS_CACHE_TTL_SEGUNDOS", 60),
+)
+
+# Segundo nivel en la cache de Django (Redis en producción), compartido por
+# todos los workers; las invalidaciones lo borran explícitamente.
+PREFIJO_COMPARTIDA = "users:sesion:"
+
+# Lo que se cachea del usuario: lo que leen TripConsumer, las vistas, los
+# permisos de DRF y su __str__. Cualquier otro campo se lee de la base al usarlo.
+CAMPOS_USUARIO = (
+    "id",
+    "email",
+    "first_name",
+    "last_name",
+    "rol",
+    "is_active",
+    "is_staff",
+    "is_superuser",
+)
+
+
+def usuario_cacheado(datos):
+    """
+    Usuario armado con los campos cacheados, sin consultar la base (los demás
+    quedan diferidos). None si la sesión no es válida.
+    """
+    if not datos:
+        return None
+    User = get_user_model()
+    # from_db espera los valores en el orden de los campos del modelo
+    campos = [
+        campo.attname for campo in User._meta.concrete_fields if campo.attname in datos
+    ]
+    return User.from_db(DEFAULT_DB_ALIAS, campos, [datos[c] for c in campos])
+
+
+def sesion_activa(jti, user_id, vence=None):
+    """
+    Usuario dueño del access token `jti` si su sesión sigue en users.Token y
+    está activo.
+
+    Busca primero en `cache_sesiones`, luego en la cache de Django y por
+    último en la base (por el índice único de `access_jti`); el resultado
+    (también el negativo) queda en ambas caches. `vence` es el `exp` del
+    JWT: ninguna entrada lo sobrevive. Se cachean solo CAMPOS_USUARIO, no el
+    objeto; guardar al usuario invalida sus sesiones (ver users.signals), así
+    que un usuario desactivado deja de autenticar en el acto.
+    """
+    datos = cache_sesiones.obtener(jti)
+    if datos is not FALTA:
+        return usuario_cacheado(datos)
+
+    ttl = None if vence is None else vence - time.time()
+    datos = cache.get(PREFIJO_COMPARTIDA + jti, FALTA)
+    if datos is FALTA:
+        sesion = (
+            Token.objects.select_related("user")
+            .filter(access_jti=jti, user_id=user_id)
+            .first()
+        )
+        datos = False
+        if sesion and sesion.user.is_active:
+            datos = {campo: getattr(sesion.user, campo) for campo in CAMPOS_USUARIO}
+        ttl_compartida = getattr(settings, "TOKENS_CACHE_COMPARTIDA_TTL_SEGUNDOS", 300)
+        if ttl is not None:
+            ttl_compartida = min(ttl_compartida, ttl)
+        if ttl_compartida > 0:
+            cache.set(PREFIJO_COMPARTIDA + jti, datos, ttl_compartida)
+
+    cache_sesiones.guardar(jti, datos, ttl=ttl)
+    return usuario_cacheado(datos)
+
+
+def invalidar_sesiones(*jtis):
+    """Olvidar las sesiones de los access tokens dados (logout, login)."""
+    jtis = [jti for jti in jtis if jti]
+    for jti in jtis:
+        cache_sesiones.borrar(jti)
+    if jtis:
+        cache.delete_many([PREFIJO_COMPARTIDA + jti for jti in jtis])
+
+
+def cerrar_sesiones_excedentes(user):
+    """
+    Borrar las sesiones más viejas del usuario por encima de
+    TOKENS_MAX_SESIONES (1: cada login cierra la sesión anterior).
+    """
+    maximo = getattr(settings, "TOKENS_MAX_SESIONES", 1)
+    excedentes = list(
+        Token.objects.filter(user=user)
+        .order_by("-created_at", "-id")
+        .values_list("id", "access_jti")[maximo:]
+    )
+    if excedentes:
+        Token.objects.filter(id__in=[id for id, _ in excedentes]).delete()
+        invalidar_sesiones(*(jti for _, jti in excedentes))
@@ -0,0 +1,80 @@
+import django.db.models.deletion
+import jwt
+from django.conf import settings
+from django.db import migrations, models
+
+
+def _jti(token):
+    """jti de un JWT guardado, sin verificar firma (ya se verificó al emitirlo)."""
+    try:
+        return jwt.decode(token, options={"verify_signature": False}).get("jti")
+    except jwt.InvalidTokenError:
+        return None
+
+
+def tokens_a_jti(apps, schema_editor):
+    Token = apps.get_model("users", "Token")
+    for token in Token.objects.all():
+        token.access_jti = _jti(token.access_token)
+        token.refresh_jti = _jti(token.refresh_token)
+        if token.access_jti and token.refresh_jti:
+            token.save(update_fields=["access_jti", "refresh_jti"])
+        else:
+            # Sin jti no hay forma de reconocer la sesión: el usuario vuelve
+            # a iniciar sesión
+            token.delete()
+
+
+def borrar_sesiones(apps, schema_editor):
+    apps.get_model("users", "Token").objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="token",
+            name="access_jti",
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="token",
+            name="refresh_jti",
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.RunPython(tokens_a_jti, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="token",
+            name="access_token",
+        ),
+        migrations.RemoveField(
+            model_name="token",
+            name="refresh_token",
+        ),
+        # Los tokens completos no se pueden reconstruir desde el jti: al
+        # revertir se cierran todas las sesiones
+        migrations.RunPython(migrations.RunPython.noop, borrar_sesiones),
+        migrations.AlterField(
+            model_name="token",
+            name="access_jti",
+            field=models.CharField(max_length=64, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="token",
+            name="refresh_jti",
+            field=models.CharField(max_length=64, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="token",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="tokens",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -85,11 +85,14 @@ class Administrador(User):
 
 
 class Token(models.Model):
-    user = models.OneToOneField(
-        User, on_delete=models.CASCADE, related_name="personalized_token"
-    )
-    refresh_token = models.TextField()
-    access_token = models.TextField()  # Campo para almacenar el access token
+    """
+    Sesión abierta por un login. Guarda solo los `jti` de los JWT emitidos
+    (32 caracteres, con índice único) en lugar de los tokens completos.
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="tokens")
+    access_jti = models.CharField(max_length=64, unique=True)
+    refresh_jti = models.CharField(max_length=64, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
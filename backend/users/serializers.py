@@ -2,6 +2,7 @@ from rest_framework import serializers
 from django.contrib.auth.hashers import make_password
 from rest_framework_simplejwt.tokens import RefreshToken
 from .models import User, Token
+from .cache_tokens import cerrar_sesiones_excedentes
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -28,16 +29,16 @@ class LoginSerializer(serializers.Serializer):
         if user and user.check_password(data["password"]):
             # Genera un refresh token y su correspondiente access token
             refresh = RefreshToken.for_user(user)
-            access = str(refresh.access_token)
+            access_token = refresh.access_token
+            access = str(access_token)
 
-            # Actualiza o crea el registro en la tabla Token
-            Token.objects.update_or_create(
+            # Registrar la sesión y cerrar las que excedan el máximo
+            Token.objects.create(
                 user=user,
-                defaults={
-                    "refresh_token": str(refresh),
-                    "access_token": access,  # Guardar el access token
-                },
+                access_jti=access_token["jti"],
+                refresh_jti=refresh["jti"],
             )
+            cerrar_sesiones_excedentes(user)
 
             # Incluye el usuario en los datos validados
             return {
@@ -0,0 +1,18 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .cache_tokens import invalidar_sesiones
+from .models import Token, User
+
+
+@receiver(post_save)
+def invalidar_sesiones_del_usuario(sender, instance, **kwargs):
+    """
+    Al guardar un usuario se olvidan sus sesiones cacheadas, que guardan
+    copia de sus campos: uno desactivado deja de autenticar y un cambio de
+    rol o email se ve en la próxima conexión. Sin `sender` para cubrir
+    también a Conductor, Pasajero y los demás hijos de User.
+    """
+    if isinstance(instance, User) and not kwargs.get("created"):
+        invalidar_sesiones(
+            *Token.objects.filter(user=instance).values_list("access_jti", flat=True)
+        )
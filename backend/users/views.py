@@ -5,6 +5,7 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.exceptions import TokenError
 from .serializers import UserSerializer, LoginSerializer
 from .models import Token
+from .cache_tokens import invalidar_sesiones
 
 
 class RegisterView(APIView):
@@ -42,8 +43,10 @@ class LogoutView(APIView):
     def post(self, request):
         user = request.user
 
-        # Eliminar el token asociado al usuario
-        Token.objects.filter(user=user).delete()
+        # Cerrar la sesión de este token y olvidarla en la cache
+        jti = request.auth["jti"]
+        Token.objects.filter(user=user, access_jti=jti).delete()
+        invalidar_sesiones(jti)
 
         return Response({"message": "Logged out successfully."})
 